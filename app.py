@@ -9,15 +9,17 @@ import sys
 
 # Importar tus módulos existentes
 from app.database import (
-    connect_to_database,
     fetch_categorias,
     fetch_marcas,
     fetch_vendedores,
     fetch_departamentos,
-    fetch_ciudades,
-    fetch_points_with_last_sale_preventa_1,
-    fetch_points_with_last_sale_preventa_no_1
+    fetch_ciudades
 )
+from app.db_pool import get_pool
+from app.fetch_orchestrator import fetch_map_rows
+from app.filters import FilterManager
+from app.relation_index import get_relation_index
+from app.result_cache import get_data_version, get_result_cache
 # Asegúrate de importar generate_folium_map desde map_generator
 from app.map_generator import process_points_for_map, generate_folium_map
 # --- 1. Funciones de Utilidad (get_resource_path y load_db_config_streamlit) ---
@@ -62,62 +64,77 @@ def load_db_config_streamlit():
         st.stop()
 
 
-# --- 3. Conexión a la Base de Datos Cacheada con st.cache_resource ---
+# --- 3. Pool de Conexiones a la Base de Datos Cacheado con st.cache_resource ---
 
-@st.cache_resource(ttl="1h", show_spinner="Conectando a la base de datos...")
-def get_database_connection(db_config_streamlit):
+@st.cache_resource(show_spinner="Conectando a la base de datos...")
+def get_database_pool(db_config_streamlit):
     """
-    Función cacheada para obtener la conexión a la base de datos.
-    Reutiliza la conexión a través de las reruns de la aplicación.
+    Función cacheada para obtener el pool de conexiones compartido por todas las sesiones.
+    Cada consulta toma una conexión prestada, así las sesiones concurrentes no se
+    serializan sobre un único socket.
     """
-    print("--- [app.py] Intentando obtener conexión a la base de datos... ---")
-    conn = connect_to_database(db_config_streamlit)
-    if not conn:
-        st.error("❌ No se pudo establecer conexión a la base de datos.")
-        st.warning("🔧 Verifica la configuración en `app/db_config.json` o las Streamlit Secret Variables.")
-        print("--- [app.py] ERROR: Falló la conexión a la base de datos. ---")
-        st.stop()
-    print("--- [app.py] Conexión a la base de datos establecida exitosamente. ---")
-    return conn
-
-# --- Funciones para cargar opciones de selectbox (CACHED) ---
-# AÑADIMOS '_' AL PARÁMETRO 'conn' para que Streamlit NO intente hashear la conexión
-@st.cache_data(ttl="1h", show_spinner=False)
-def get_categorias_options(_conn):
+    print("--- [app.py] Intentando obtener el pool de conexiones a la base de datos... ---")
+    pool = get_pool(db_config_streamlit)
+    # Verificar la configuración de inmediato tomando (y devolviendo) una conexión
+    with pool.connection() as conn:
+        if not conn:
+            st.error("❌ No se pudo establecer conexión a la base de datos.")
+            st.warning("🔧 Verifica la configuración en `app/db_config.json` o las Streamlit Secret Variables.")
+            print("--- [app.py] ERROR: Falló la conexión a la base de datos. ---")
+            st.stop()
+    print("--- [app.py] Pool de conexiones a la base de datos listo. ---")
+    return pool
+
+@st.cache_resource(show_spinner=False)
+def get_filter_manager(db_config_streamlit):
+    """
+    FilterManager compartido por todas las sesiones: guarda el dataset sin filtrar con índices
+    en memoria, así "Aplicar Filtros" se resuelve sin volver a consultar MySQL.
+    """
+    return FilterManager(db_config_streamlit)
+
+# --- Funciones para cargar opciones de selectbox ---
+# Las listas salen del índice de relaciones en memoria (app/relation_index.py), que se rearma solo
+# cuando cambia la versión de los datos: cambiar la categoría o el departamento no consulta MySQL.
+def _leer_opciones(_pool, metodo_indice, fetch, *filtro):
+    """Tuplas (id, descripcion) desde el índice de relaciones; si no se pudo armar, desde MySQL."""
+    indice = get_relation_index(_pool)
+    if indice is not None:
+        return getattr(indice, metodo_indice)(*filtro)
+    with _pool.connection() as conn:
+        return fetch(conn, *filtro) if conn else []
+
+def get_categorias_options(_pool):
     print("--- [app.py] Cargando opciones de categorías... ---")
-    categorias_raw = fetch_categorias(_conn)
+    categorias_raw = _leer_opciones(_pool, 'categorias', fetch_categorias)
     categorias_map = {c[1]: c[0] for c in categorias_raw}
     print(f"--- [app.py] Categorías cargadas: {len(categorias_map)} ---")
     return ["Todas"] + sorted(list(categorias_map.keys())), categorias_map
 
-@st.cache_data(ttl="1h", show_spinner=False)
-def get_marcas_options(_conn, id_categoria):
+def get_marcas_options(_pool, id_categoria):
     print(f"--- [app.py] Cargando opciones de marcas para categoría ID: {id_categoria}... ---")
-    marcas_raw = fetch_marcas(_conn, id_categoria=id_categoria)
+    marcas_raw = _leer_opciones(_pool, 'marcas', fetch_marcas, id_categoria)
     marcas_map = {m[1]: m[0] for m in marcas_raw}
     print(f"--- [app.py] Marcas cargadas: {len(marcas_map)} ---")
     return ["Todas"] + sorted(list(marcas_map.keys())), marcas_map
 
-@st.cache_data(ttl="1h", show_spinner=False)
-def get_vendedores_options(_conn, id_categoria):
+def get_vendedores_options(_pool, id_categoria):
     print(f"--- [app.py] Cargando opciones de vendedores para categoría ID: {id_categoria}... ---")
-    vendedores_raw = fetch_vendedores(_conn, id_categoria=id_categoria)
+    vendedores_raw = _leer_opciones(_pool, 'vendedores', fetch_vendedores, id_categoria)
     vendedores_map = {v[1]: v[0] for v in vendedores_raw}
     print(f"--- [app.py] Vendedores cargados: {len(vendedores_map)} ---")
     return ["Todos"] + sorted(list(vendedores_map.keys())), vendedores_map
 
-@st.cache_data(ttl="1h", show_spinner=False)
-def get_departamentos_options(_conn):
+def get_departamentos_options(_pool):
     print("--- [app.py] Cargando opciones de departamentos... ---")
-    departamentos_raw = fetch_departamentos(_conn)
+    departamentos_raw = _leer_opciones(_pool, 'departamentos', fetch_departamentos)
     departamentos_map = {d[1]: d[0] for d in departamentos_raw}
     print(f"--- [app.py] Departamentos cargados: {len(departamentos_map)} ---")
     return ["Todos"] + sorted(list(departamentos_map.keys())), departamentos_map
 
-@st.cache_data(ttl="1h", show_spinner=False)
-def get_ciudades_options(_conn, id_dpto):
+def get_ciudades_options(_pool, id_dpto):
     print(f"--- [app.py] Cargando opciones de ciudades para departamento ID: {id_dpto}... ---")
-    ciudades_raw = fetch_ciudades(_conn, id_dpto=id_dpto)
+    ciudades_raw = _leer_opciones(_pool, 'ciudades', fetch_ciudades, id_dpto)
     ciudades_map = {c[1]: c[0] for c in ciudades_raw}
     print(f"--- [app.py] Ciudades cargadas: {len(ciudades_map)} ---")
     return ["Todas"] + sorted(list(ciudades_map.keys())), ciudades_map
@@ -229,27 +246,29 @@ def show_main_app():
     # Obtener la conexión a la base de datos una sola vez al inicio de show_main_app
     print("--- [app.py] Cargando configuración de DB para la aplicación principal. ---")
     db_config_streamlit = load_db_config_streamlit()
-    conn = get_database_connection(db_config_streamlit) 
+    pool = get_database_pool(db_config_streamlit)
+    filter_manager = get_filter_manager(db_config_streamlit)
 
     with tab1:
         st.subheader("Dashboard Principal")
         print("--- [app.py] Mostrando Dashboard. ---")
-        if conn:
-            try:
-                with conn.cursor() as cursor:
-                    cursor.execute("SELECT COUNT(*) FROM puntos_venta")
-                    total_registros = cursor.fetchone()[0]
-                    st.metric("Total Puntos de Venta", total_registros)
-                    print(f"--- [app.py] Total Puntos de Venta: {total_registros} ---")
-                st.metric("Usuarios Conectados", "1")
-                st.metric("Estado Sistema", "✅ Activo")
-            except Exception as e:
-                st.error(f"Error al obtener métricas del Dashboard: {e}")
-                st.info("Verifica las tablas y datos de la base de datos.")
-                print(f"--- [app.py] ERROR al obtener métricas del Dashboard: {e} ---")
-        else:
-            st.warning("No hay conexión a la base de datos para mostrar métricas.")
-            print("--- [app.py] No hay conexión a la base de datos para el Dashboard. ---")
+        with pool.connection() as conn:
+            if conn:
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT COUNT(*) FROM puntos_venta")
+                        total_registros = cursor.fetchone()[0]
+                        st.metric("Total Puntos de Venta", total_registros)
+                        print(f"--- [app.py] Total Puntos de Venta: {total_registros} ---")
+                    st.metric("Usuarios Conectados", "1")
+                    st.metric("Estado Sistema", "✅ Activo")
+                except Exception as e:
+                    st.error(f"Error al obtener métricas del Dashboard: {e}")
+                    st.info("Verifica las tablas y datos de la base de datos.")
+                    print(f"--- [app.py] ERROR al obtener métricas del Dashboard: {e} ---")
+            else:
+                st.warning("No hay conexión a la base de datos para mostrar métricas.")
+                print("--- [app.py] No hay conexión a la base de datos para el Dashboard. ---")
 
     with tab2:
         st.subheader("🗺️ Mapa Interactivo")
@@ -273,9 +292,9 @@ def show_main_app():
             st.session_state.selected_ciudad_desc = "Todas"
         
         # Obtener opciones para Categoría y Departamento (siempre las mismas)
-        # NOTA: Pasamos `conn` como `_conn` a las funciones cacheada
-        categorias_opts, categorias_map = get_categorias_options(conn)
-        departamentos_opts, departamentos_map = get_departamentos_options(conn)
+        # NOTA: Pasamos `pool` como `_pool` a las funciones cacheadas
+        categorias_opts, categorias_map = get_categorias_options(pool)
+        departamentos_opts, departamentos_map = get_departamentos_options(pool)
 
         # 1. Filtro de Categoría
         selected_categoria_desc = st.sidebar.selectbox(
@@ -296,7 +315,7 @@ def show_main_app():
         selected_categoria_id_for_filters = categorias_map.get(selected_categoria_desc) if selected_categoria_desc != "Todas" else None
         
         # 2. Filtro de Marca (dependiente de Categoría)
-        marcas_opts, marcas_map = get_marcas_options(conn, id_categoria=selected_categoria_id_for_filters)
+        marcas_opts, marcas_map = get_marcas_options(pool, id_categoria=selected_categoria_id_for_filters)
         selected_marca_desc = st.sidebar.selectbox(
             "Marca:",
             marcas_opts,
@@ -309,7 +328,7 @@ def show_main_app():
             # No se necesita rerun aquí a menos que otros filtros dependan de la marca.
 
         # 3. Filtro de Vendedor (dependiente de Categoría)
-        vendedores_opts, vendedores_map = get_vendedores_options(conn, id_categoria=selected_categoria_id_for_filters)
+        vendedores_opts, vendedores_map = get_vendedores_options(pool, id_categoria=selected_categoria_id_for_filters)
         selected_vendedor_desc = st.sidebar.selectbox(
             "Vendedor:",
             vendedores_opts,
@@ -337,7 +356,7 @@ def show_main_app():
         selected_dpto_id_for_cities = departamentos_map.get(selected_dpto_desc) if selected_dpto_desc != "Todos" else None
         
         # 5. Filtro de Ciudad (dependiente de Departamento)
-        ciudades_opts, ciudades_map = get_ciudades_options(conn, id_dpto=selected_dpto_id_for_cities)
+        ciudades_opts, ciudades_map = get_ciudades_options(pool, id_dpto=selected_dpto_id_for_cities)
         selected_ciudad_desc = st.sidebar.selectbox(
             "Ciudad:",
             ciudades_opts,
@@ -392,36 +411,60 @@ def show_main_app():
             }
 
         # Cargar y procesar datos del mapa
-        # AÑADIMOS '_' AL PARÁMETRO 'conn_data' para que Streamlit NO intente hashear la conexión
-        @st.cache_data(show_spinner="Cargando y procesando datos del mapa...", ttl="1h")
-        def load_and_process_map_data_cached(_conn_data, filters_dict):
-            print(f"--- [app.py] [CACHED] Ejecutando load_and_process_map_data_cached con filtros: {filters_dict} ---")
-            points_preventa_1_raw = fetch_points_with_last_sale_preventa_1(
-                _conn_data,
-                id_categoria=filters_dict.get('categoria_id'),
-                id_marca=filters_dict.get('marca_id'),
-                descripcion_vend=filters_dict.get('vendedor_desc'),
-                id_dpto=filters_dict.get('departamento_id'),
-                id_ciudad=filters_dict.get('ciudad_id')
-            )
-            print(f"--- [app.py] [CACHED] fetched {len(points_preventa_1_raw) if points_preventa_1_raw else 0} points_preventa_1_raw ---")
-            
-            points_preventa_no_1_raw = fetch_points_with_last_sale_preventa_no_1(
-                _conn_data,
-                ids_marcas=None # Esto sigue siendo None, asumiendo que no necesitas filtrar por marca aquí
-            )
-            print(f"--- [app.py] [CACHED] fetched {len(points_preventa_no_1_raw) if points_preventa_no_1_raw else 0} points_preventa_no_1_raw ---")
-            
-            all_points_df, stats_dict = process_points_for_map(
-                points_preventa_1_raw,
-                points_preventa_no_1_raw,
-                filters_dict
-            )
-            print(f"--- [app.py] [CACHED] process_points_for_map retornó {len(all_points_df)} puntos y estadísticas. ---")
+        def load_and_process_map_data(_pool_data, filters_dict, dataset=None):
+            print(f"--- [app.py] Ejecutando load_and_process_map_data con filtros: {filters_dict} ---")
+            filtros_preventa_1 = {
+                'id_categoria': filters_dict.get('categoria_id'),
+                'id_marca': filters_dict.get('marca_id'),
+                'descripcion_vend': filters_dict.get('vendedor_desc'),
+                'id_dpto': filters_dict.get('departamento_id'),
+                'id_ciudad': filters_dict.get('ciudad_id')
+            }
+            # PREVENTA=1 y tránsito se ejecutan a la vez, cada una en su conexión del pool.
+            # Sin streaming: process_points_for_map arma un DataFrame con todas las filas, así que un
+            # cursor sin buffer no baja el pico de memoria y solo retiene la conexión mientras se procesa.
+            try:
+                if dataset is not None:
+                    # Dataset ya cargado en memoria para esta versión de los datos: filtros sin SQL.
+                    # Se usa el que retornó ensure_dataset: otra sesión puede reemplazar filter_manager.dataset
+                    points_preventa_1_raw, points_preventa_no_1_raw, _ = filter_manager.filter_rows(
+                        filtros_preventa_1, dataset=dataset
+                    )
+                else:
+                    points_preventa_1_raw, points_preventa_no_1_raw, _ = fetch_map_rows(
+                        _pool_data, filtros_preventa_1
+                    )
+                # Popups bajo demanda: el mapa recibe una tabla compacta y arma cada popup al hacer clic
+                all_points_df, stats_dict = process_points_for_map(
+                    points_preventa_1_raw,
+                    points_preventa_no_1_raw,
+                    filters_dict,
+                    lazy_popups=True
+                )
+            except ConnectionError as e:
+                st.error(f"❌ No se pudo obtener una conexión del pool para cargar el mapa: {e}")
+                st.stop()
+            print(f"--- [app.py] process_points_for_map retornó {len(all_points_df)} puntos y estadísticas. ---")
             return all_points_df, stats_dict
 
-        # Al llamar a la función, pasamos la conexión directamente
-        all_points_data, stats_data = load_and_process_map_data_cached(conn, st.session_state['current_filters'])
+        # Caché compartido con la app PyQt (app/result_cache.py): la clave incluye la versión de los
+        # datos de ventas, así una combinación de filtros repetida es instantánea y a lo sumo queda
+        # DEFAULT_INTERVALO_VERSION segundos atrasada respecto de la tabla.
+        def load_and_process_map_data_cached(_pool_data, filters_dict):
+            # Limitada a una consulta indexada por intervalo y por base (ver app/result_cache.py)
+            version = get_data_version(_pool_data)
+            with st.spinner("Cargando y procesando datos del mapa..."):
+                # Sin versión no se puede saber si el dataset en memoria está vigente: se consulta MySQL
+                dataset = filter_manager.ensure_dataset(version) if version is not None else None
+                all_points_df, stats_dict = get_result_cache().get_or_compute(
+                    'streamlit', filters_dict, version,
+                    lambda: load_and_process_map_data(_pool_data, filters_dict, dataset)
+                )
+            # Copia: el DataFrame se modifica más abajo (limpieza de lat/lon) y el del caché debe quedar intacto
+            return all_points_df.copy(), stats_dict
+
+        # Al llamar a la función, pasamos el pool directamente
+        all_points_data, stats_data = load_and_process_map_data_cached(pool, st.session_state['current_filters'])
         print(f"--- [app.py] Datos del mapa cargados. Total de puntos: {len(all_points_data)} ---")
 
         if not all_points_data.empty:
@@ -436,7 +479,8 @@ def show_main_app():
             if not all_points_data.empty:
                 print("--- [app.py] Llamando a generate_folium_map para obtener el objeto mapa. ---")
                 # LA LÍNEA CRUCIAL: Capturamos el objeto mapa que retorna generate_folium_map
-                folium_map_object = generate_folium_map(all_points_data) # stats_data ya no es un parámetro aquí
+                # modo_render='datos': los puntos viajan como un solo arreglo y los marcadores se crean en el navegador
+                folium_map_object = generate_folium_map(all_points_data, modo_render='datos') # stats_data ya no es un parámetro aquí
                 
                 print("--- [app.py] Objeto mapa recibido. Renderizando con folium_static. ---")
                 # Renderizamos el objeto mapa usando folium_static AQUÍ en app.py
@@ -0,0 +1,260 @@
+# app/cluster_engine.py
+
+import math
+
+import numpy as np
+
+from app.spatial_index import SpatialGridIndex, normalizar_limites
+
+# Agrupamiento de puntos del lado de Python, por nivel de zoom. Los puntos se proyectan a
+# Web Mercator y, para cada zoom entre 0 y max_zoom, se agrupan en celdas de 'radio_px' píxeles
+# alineadas a potencias de 2: cada celda de un zoom contiene exactamente 4 celdas del zoom
+# siguiente, así los clusters forman una jerarquía y se puede bajar de un cluster a sus hijos.
+# Cada cluster guarda su desglose forma x color con las mismas claves que calculate_statistics.
+# El mapa solo recibe lo que hay en la vista actual (get_view / get_clusters) y baja al detalle a pedido
+# (get_children / expansion_zoom), sin importar cuántos clientes haya en total.
+
+COLORES = ('green', 'orange', 'red', 'black')
+FORMAS = ('circle', 'diamond')
+
+DEFAULT_MAX_ZOOM = 16   # Con más zoom se muestran los puntos individuales
+DEFAULT_RADIO_PX = 64   # Tamaño de celda en píxeles (debe ser 256 / 2^k)
+DEFAULT_MAX_PUNTOS_VISTA = 2000  # Hasta esta cantidad de puntos en la vista se envían sin agrupar
+
+_LAT_MAXIMA = 85.05112878  # Límite de la proyección Web Mercator
+
+
+def _proyectar(lat, lon):
+    """Coordenadas Web Mercator normalizadas a [0, 1) (x hacia el este, y hacia el sur)."""
+    lat = np.clip(lat, -_LAT_MAXIMA, _LAT_MAXIMA)
+    x = (lon + 180.0) / 360.0
+    seno = np.sin(np.radians(lat))
+    y = 0.5 - np.log((1 + seno) / (1 - seno)) / (4 * math.pi)
+    return np.clip(x, 0.0, 1.0 - 1e-12), np.clip(y, 0.0, 1.0 - 1e-12)
+
+
+def _desglose(cantidad, conteos):
+    """Diccionario con las claves de calculate_statistics a partir de los 8 conteos forma x color."""
+    desglose = {'total_general_clientes': int(cantidad)}
+    for f, forma in enumerate(FORMAS):
+        fila = conteos[f * len(COLORES):(f + 1) * len(COLORES)]
+        desglose[f'total_{forma}s'] = int(fila.sum())
+        for c, color in enumerate(COLORES):
+            desglose[f'{forma}s_{color}'] = int(fila[c])
+    return desglose
+
+
+class _Nivel:
+    """
+    Clusters de un nivel de zoom: arreglos paralelos indexados por número de cluster.
+    Los puntos del cluster j son miembros[inicio[j]:inicio[j + 1]] (en orden de punto).
+    """
+
+    __slots__ = ('cluster_de_punto', 'cantidad', 'lat', 'lon', 'conteos', 'primer_punto', 'miembros', 'inicio')
+
+    def __init__(self, cluster_de_punto, cantidad, lat, lon, conteos, primer_punto):
+        self.cluster_de_punto = cluster_de_punto
+        self.cantidad = cantidad
+        self.lat = lat
+        self.lon = lon
+        self.conteos = conteos
+        self.primer_punto = primer_punto
+        self.miembros = np.argsort(cluster_de_punto, kind='stable').astype(np.int32)
+        self.inicio = np.concatenate(([0], np.cumsum(cantidad)))
+
+
+class ClusterIndex:
+    """
+    Jerarquía de clusters precalculada sobre los puntos procesados del mapa. 'puntos' puede ser un
+    PointStore (app/point_record.py) o una lista de diccionarios de punto (color_calculator).
+    Los puntos sin coordenadas válidas se ignoran.
+    """
+
+    def __init__(self, puntos, max_zoom=DEFAULT_MAX_ZOOM, radio_px=DEFAULT_RADIO_PX):
+        self.max_zoom = max_zoom
+        self._celdas_por_tile = max(1, 256 // radio_px)
+        self._puntos = puntos
+
+        lat, lon, categoria = self._columnas(puntos)
+        validos = np.isfinite(lat) & np.isfinite(lon)
+        self._indices = np.flatnonzero(validos)  # posición de cada punto en 'puntos'
+        self.lat = lat[validos]
+        self.lon = lon[validos]
+        self.categoria = categoria[validos]
+        self._x, self._y = _proyectar(self.lat, self.lon)
+        self._indice_espacial = SpatialGridIndex(self.lat, self.lon)
+
+        self._niveles = [self._agrupar(zoom) for zoom in range(max_zoom + 1)]
+        print(f"--- [cluster_engine.py] Índice de clusters armado: {len(self.lat)} puntos, "
+              f"{len(self._niveles[0].cantidad)}..{len(self._niveles[-1].cantidad)} clusters por zoom ---")
+
+    @staticmethod
+    def _columnas(puntos):
+        """Extrae latitud, longitud y categoría forma x color (-1 si no es conocida) de los puntos."""
+        if hasattr(puntos, 'registros'):
+            # PointStore: columnas ya acumuladas al agregar cada registro, sin recorrer los registros
+            return (np.array(puntos.latitudes, dtype=float), np.array(puntos.longitudes, dtype=float),
+                    ClusterIndex._categorias_de_codigos(puntos))
+
+        colores = {color: c for c, color in enumerate(COLORES)}
+        formas = {forma: f for f, forma in enumerate(FORMAS)}
+        lat = [p.get('LATITUD') for p in puntos]
+        lon = [p.get('LONGITUD') for p in puntos]
+        forma_color = [(formas.get(p.get('shape')), colores.get(p.get('color'))) for p in puntos]
+
+        categoria = np.array([-1 if f is None or c is None else f * len(COLORES) + c for f, c in forma_color],
+                             dtype=np.int64)
+        lat = np.array([np.nan if v is None else float(v) for v in lat], dtype=float)
+        lon = np.array([np.nan if v is None else float(v) for v in lon], dtype=float)
+        return lat, lon, categoria
+
+    @staticmethod
+    def _categorias_de_codigos(store):
+        """Categoría forma x color de cada registro de un PointStore, traduciendo sus códigos."""
+        def _traduccion(tabla, valores):
+            # Posición de cada código de la tabla en 'valores' (-1 si no es conocido)
+            return np.array([valores.index(v) if v in valores else -1 for v in tabla.valores] or [-1], dtype=np.int64)
+
+        codigos_forma = np.array(store.codigos_forma, dtype=np.int64)
+        codigos_color = np.array(store.codigos_color, dtype=np.int64)
+        conocidos = (codigos_forma >= 0) & (codigos_color >= 0)
+        forma = np.where(conocidos, _traduccion(store.formas, FORMAS)[np.maximum(codigos_forma, 0)], -1)
+        color = np.where(conocidos, _traduccion(store.colores, COLORES)[np.maximum(codigos_color, 0)], -1)
+        return np.where((forma >= 0) & (color >= 0), forma * len(COLORES) + color, -1)
+
+    def _agrupar(self, zoom):
+        celdas = self._celdas_por_tile << zoom  # celdas por lado del mundo en este zoom
+        clave = (self._x * celdas).astype(np.int64) * celdas + (self._y * celdas).astype(np.int64)
+        _, primer_punto, cluster_de_punto, cantidad = np.unique(
+            clave, return_index=True, return_inverse=True, return_counts=True
+        )
+        total = len(cantidad)
+        lat = np.bincount(cluster_de_punto, weights=self.lat, minlength=total) / np.maximum(cantidad, 1)
+        lon = np.bincount(cluster_de_punto, weights=self.lon, minlength=total) / np.maximum(cantidad, 1)
+
+        categorias = len(COLORES) * len(FORMAS)
+        conocidos = self.categoria >= 0
+        conteos = np.bincount(
+            cluster_de_punto[conocidos] * categorias + self.categoria[conocidos], minlength=total * categorias
+        ).reshape(total, categorias)
+        return _Nivel(cluster_de_punto.astype(np.int32), cantidad, lat, lon, conteos, primer_punto)
+
+    def __len__(self):
+        return len(self.lat)
+
+    # --- Consultas ---
+
+    def _punto(self, i):
+        """Diccionario de punto (el mismo formato que se envía al mapa) del i-ésimo punto válido."""
+        original = self._puntos.registros[self._indices[i]] if hasattr(self._puntos, 'registros') else None
+        if original is not None:
+            return self._puntos.to_dict(original)
+        return self._puntos[self._indices[i]]
+
+    def _cluster(self, zoom, j):
+        nivel = self._niveles[zoom]
+        return {
+            'id': f"{zoom}-{j}",
+            'lat': float(nivel.lat[j]),
+            'lng': float(nivel.lon[j]),
+            'cantidad': int(nivel.cantidad[j]),
+            'desglose': _desglose(nivel.cantidad[j], nivel.conteos[j]),
+        }
+
+    def _items(self, zoom, clusters):
+        """Clusters de 'zoom' listos para el mapa: los de un solo punto se entregan como punto."""
+        nivel = self._niveles[zoom]
+        resultado = {'clusters': [], 'puntos': []}
+        for j in clusters:
+            if nivel.cantidad[j] == 1:
+                resultado['puntos'].append(self._punto(nivel.primer_punto[j]))
+            else:
+                resultado['clusters'].append(self._cluster(zoom, j))
+        return resultado
+
+    @staticmethod
+    def _en_limites(lat, lon, limites):
+        if limites is None:
+            return np.ones(len(lat), dtype=bool)
+        sur, oeste, norte, este = normalizar_limites(limites)
+        dentro_lat = (lat >= sur) & (lat <= norte)
+        if oeste <= este:
+            return dentro_lat & (lon >= oeste) & (lon <= este)
+        return dentro_lat & ((lon >= oeste) | (lon <= este))  # La vista cruza el antimeridiano
+
+    def get_clusters(self, zoom, limites=None):
+        """
+        Clusters visibles en 'zoom' dentro de limites=(sur, oeste, norte, este), o todos si es None.
+        Retorna {'zoom': z, 'clusters': [...], 'puntos': [...]}. Con zoom > max_zoom se entregan
+        los puntos individuales.
+        """
+        zoom = max(0, int(zoom))
+        if zoom > self.max_zoom:
+            return {'zoom': zoom, 'clusters': [], 'puntos': self.get_points(limites)}
+        nivel = self._niveles[zoom]
+        visibles = np.flatnonzero(self._en_limites(nivel.lat, nivel.lon, limites))
+        resultado = self._items(zoom, visibles)
+        resultado['zoom'] = zoom
+        return resultado
+
+    def get_points(self, limites=None):
+        """Puntos individuales dentro de limites=(sur, oeste, norte, este), usando el índice espacial."""
+        if limites is None:
+            indices = range(len(self.lat))
+        else:
+            indices = self._indice_espacial.query(limites)
+        return [self._punto(i) for i in indices]
+
+    def get_view(self, zoom, limites, max_puntos=DEFAULT_MAX_PUNTOS_VISTA):
+        """
+        Contenido de la vista del mapa: los puntos dentro de 'limites' si son 'max_puntos' o menos
+        (o si el zoom supera max_zoom); si no, los clusters del zoom actual.
+        """
+        zoom = max(0, int(zoom))
+        indices = self._indice_espacial.query(limites)
+        if len(indices) <= max_puntos or zoom > self.max_zoom:
+            return {'zoom': zoom, 'clusters': [], 'puntos': [self._punto(i) for i in indices]}
+        return self.get_clusters(zoom, limites)
+
+    def _parsear_id(self, id_cluster):
+        zoom, j = (int(parte) for parte in str(id_cluster).split('-'))
+        if not 0 <= zoom <= self.max_zoom or not 0 <= j < len(self._niveles[zoom].cantidad):
+            raise ValueError(f"Cluster inexistente: {id_cluster}")
+        return zoom, j
+
+    def _miembros(self, zoom, j):
+        nivel = self._niveles[zoom]
+        return nivel.miembros[nivel.inicio[j]:nivel.inicio[j + 1]]
+
+    def get_children(self, id_cluster):
+        """Clusters (o puntos) del zoom siguiente que forman el cluster 'id_cluster'."""
+        zoom, j = self._parsear_id(id_cluster)
+        miembros = self._miembros(zoom, j)
+        if zoom == self.max_zoom:
+            return {'zoom': zoom + 1, 'clusters': [], 'puntos': [self._punto(i) for i in miembros]}
+        hijos = np.unique(self._niveles[zoom + 1].cluster_de_punto[miembros])
+        resultado = self._items(zoom + 1, hijos)
+        resultado['zoom'] = zoom + 1
+        return resultado
+
+    def expansion_zoom(self, id_cluster):
+        """Primer zoom en el que el cluster se separa en más de un cluster o punto."""
+        zoom, j = self._parsear_id(id_cluster)
+        miembros = self._miembros(zoom, j)
+        while zoom < self.max_zoom:
+            zoom += 1
+            if len(np.unique(self._niveles[zoom].cluster_de_punto[miembros])) > 1:
+                return zoom
+        return self.max_zoom + 1
+
+    def get_leaves(self, id_cluster, limite=100, desplazamiento=0):
+        """Puntos individuales de un cluster, paginados."""
+        zoom, j = self._parsear_id(id_cluster)
+        miembros = self._miembros(zoom, j)[desplazamiento:desplazamiento + limite]
+        return [self._punto(i) for i in miembros]
+
+    def bounds(self):
+        """Límites (sur, oeste, norte, este) de todos los puntos, o None si no hay puntos."""
+        if not len(self.lat):
+            return None
+        return (float(self.lat.min()), float(self.lon.min()), float(self.lat.max()), float(self.lon.max()))
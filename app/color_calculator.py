@@ -1,8 +1,16 @@
 # app/color_calculator.py
 
+import json
 from datetime import datetime, date
 from decimal import Decimal
 
+import numpy as np
+import pandas as pd
+
+from app.popup_templates import (
+    PLANTILLA_INFO_BASICA, PLANTILLA_TRANSITO, TRANSITO_VACIO, get_popup_cache, lineas_para_popup
+)
+
 # ¡LA CONSTANTE POPUP_HEADER_FOOTER_HTML HA SIDO ELIMINADA DE AQUÍ!
 # Su contenido (CSS y JS) se inyectará globalmente en map_generator.py si es necesario.
 
@@ -11,10 +19,6 @@ def formatear_info_basica_para_popup(datos_cliente):
     Formatea la información básica de un cliente para el popup.
     Ya NO incluye el CSS ni el JavaScript, ya que se inyectarán globalmente (si aplica para el mapa).
     """
-    html_content = "<div class='popup-content'>" # Abrir div principal
-
-    html_content += f"<h4>{datos_cliente.get('descripcion_cliente', 'N/A')} ({datos_cliente.get('id_cliente', 'N/A')})</h4>"
-
     ultima_venta_str = "No hay ventas de STOCK registradas."
     if datos_cliente.get('ultima_venta_stock_date'):
         if isinstance(datos_cliente['ultima_venta_stock_date'], date):
@@ -22,218 +26,277 @@ def formatear_info_basica_para_popup(datos_cliente):
         else:
             ultima_venta_str = str(datos_cliente['ultima_venta_stock_date'])
 
-    html_content += f"<p><strong>Última Venta STOCK:</strong> {ultima_venta_str}</p>"
-    html_content += f"<p><strong>Vendedor:</strong> {datos_cliente.get('descripcion_vend', 'N/A')}</p>"
-    html_content += f"<p><strong>Marca (última venta):</strong> {datos_cliente.get('descripcion_marca', 'N/A')}</p>"
-
-    # Usar las nuevas columnas de descripción
-    html_content += f"<p><strong>Categoría:</strong> {datos_cliente.get('DESCRIPCION_CATEGORIA', 'N/A')}</p>"
-    html_content += f"<p><strong>Departamento:</strong> {datos_cliente.get('DESCRIPCION_DPTO', 'N/A')}</p>"
-    html_content += f"<p><strong>Ciudad:</strong> {datos_cliente.get('DESCRIPCION_CIUDAD', 'N/A')}</p>"
-
-    return html_content # Dejamos el cierre del div principal para la función de concatenación
+    # Dejamos el cierre del div principal para la función de concatenación
+    return PLANTILLA_INFO_BASICA(
+        descripcion_cliente=datos_cliente.get('descripcion_cliente', 'N/A'),
+        id_cliente=datos_cliente.get('id_cliente', 'N/A'),
+        ultima_venta=ultima_venta_str,
+        descripcion_vend=datos_cliente.get('descripcion_vend', 'N/A'),
+        descripcion_marca=datos_cliente.get('descripcion_marca', 'N/A'),
+        categoria=datos_cliente.get('DESCRIPCION_CATEGORIA', 'N/A'),
+        departamento=datos_cliente.get('DESCRIPCION_DPTO', 'N/A'),
+        ciudad=datos_cliente.get('DESCRIPCION_CIUDAD', 'N/A'),
+    )
 
 def formatear_ventas_en_transito_para_popup(ventas_cliente): # Eliminado 'point_id' ya que no se usa para IDs de elementos ocultos
     """
     Formatea los detalles de las ventas en tránsito para el popup.
     Muestra la información directamente sin ningún botón de alternancia.
     """
-    html_content = ""
-
-    # Subtítulo para la sección de mercadería en tránsito
-    html_content += "<hr>" # Línea divisoria para separar del contenido básico
-    html_content += "<p><b>Mercadería en Tránsito/Programada:</b></p>"
-
-    if ventas_cliente: # Si hay datos de ventas en tránsito
-        for venta in ventas_cliente:
-            html_content += f"<p><strong>MARCA:</strong> {venta.get('MARCA', 'N/A')}</p>"
-            html_content += "<p>PROGRAMADO:</p>"
-            html_content += "<ul>"
-            # Asumiendo que 'venta' tiene una lista de programaciones o un campo similar
-            if 'PROGRAMACION' in venta and isinstance(venta['PROGRAMACION'], list):
-                for prog in venta['PROGRAMACION']:
-                    html_content += f"<li>{prog.get('FECHA', 'N/A')}: {prog.get('CANTIDAD', 'N/A')}</li>"
-            else:
-                 # Si no es una lista de programaciones, asume un solo campo.
-                html_content += f"<li>{venta.get('FECHA', 'N/A')}: {venta.get('CANTIDAD', 'N/A')}</li>"
-            html_content += "</ul>"
-            html_content += "<br>" # Espacio entre diferentes marcas o programaciones
+    if not ventas_cliente:
+        return TRANSITO_VACIO
+    return PLANTILLA_TRANSITO.render(lineas=lineas_para_popup(ventas_cliente))
+
+
+def render_popup_cliente(datos_cliente, transito_cliente, cache=None):
+    """
+    HTML completo del popup de un cliente (info básica + tránsito + cierre del div).
+    Usa la caché de fragmentos (por defecto la compartida): un cliente sin cambios en su última
+    venta ni en sus líneas en tránsito no se vuelve a renderizar entre refrescos.
+    """
+    cache = get_popup_cache() if cache is None else cache
+    return cache.get_or_render(
+        datos_cliente,
+        transito_cliente,
+        lambda: formatear_info_basica_para_popup(datos_cliente)
+                + formatear_ventas_en_transito_para_popup(expandir_lineas_transito(transito_cliente))
+                + "</div>"
+    )
 
-    else:
-        html_content += "<p>No hay mercadería en tránsito/programada para este cliente.</p>"
 
-    return html_content
+def expandir_lineas_transito(transito_cliente):
+    """
+    Retorna la lista de líneas en tránsito de un cliente como diccionarios (FECHA, TIPO, MARCA, CANTIDAD).
+    Acepta tanto la lista de filas detalladas como la fila agrupada por cliente
+    (CANTIDAD_LINEAS + LINEAS en JSON) de fetch_points_preventa_no_1_aggregated.
+    """
+    if isinstance(transito_cliente, dict):
+        lineas = transito_cliente.get('LINEAS') or []
+        if isinstance(lineas, (str, bytes)):
+            lineas = json.loads(lineas)
+        # JSON_ARRAYAGG no garantiza orden: se respeta el orden de la consulta detallada (FECHA DESC)
+        return sorted(lineas, key=lambda linea: linea.get('FECHA') or '', reverse=True)
+    return transito_cliente or []
 
 
-def calculate_colors_and_shapes_for_all_points(puntos_preventa_1, puntos_preventa_no_1):
+# Campos que se reemplazan cuando aparece una venta PREVENTA=1 más reciente del mismo cliente
+_CAMPOS_ACTUALIZABLES = [
+    "id_vend", "descripcion_vend", "descripcion_marca", "preventa",
+    "DESCRIPCION_CATEGORIA", "DESCRIPCION_DPTO", "DESCRIPCION_CIUDAD",
+]
+
+
+def _parsear_fila_preventa_1(punto_dict):
+    """
+    Convierte una fila PREVENTA=1 en (id_cliente, datos_cliente). Retorna None si la fila se
+    descarta por campos requeridos nulos o fecha inválida.
+    """
+    id_cliente = punto_dict.get('ID_CLIENTE')
+    descripcion_cliente = punto_dict.get('DESCRIPCION_CLIENTE')
+    latitud = punto_dict.get('LATITUD')
+    longitud = punto_dict.get('LONGITUD')
+    fecha_venta = punto_dict.get('ULTIMA_VENTA')
+
+    if id_cliente is None or descripcion_cliente is None or latitud is None or longitud is None:
+        print(f"Advertencia: Saltando diccionario PREVENTA=1 con campos requeridos nulos: {punto_dict}")
+        return None
+
+    sale_date = None
+    if fecha_venta is not None:
+        if isinstance(fecha_venta, str):
+            try:
+                sale_date = datetime.strptime(fecha_venta.strip(), "%Y-%m-%d %H:%M:%S").date()
+            except ValueError:
+                try:
+                    sale_date = datetime.strptime(fecha_venta.strip(), "%Y-%m-%d").date()
+                except ValueError as ve:
+                    print(f"Advertencia: Fecha inválida '{fecha_venta}' para cliente {id_cliente}. Error: {ve}")
+                    return None
+        elif isinstance(fecha_venta, datetime):
+            sale_date = fecha_venta.date()
+        elif isinstance(fecha_venta, date):
+            sale_date = fecha_venta
+
+    return id_cliente, {
+        "id_cliente": id_cliente,
+        "descripcion_cliente": descripcion_cliente,
+        "latitud": latitud,
+        "longitud": longitud,
+        "ultima_venta_stock_date": sale_date,
+        "id_vend": punto_dict.get('ID_VEND'),
+        "descripcion_vend": punto_dict.get('DESCRIPCION_VEND'),
+        "descripcion_marca": punto_dict.get('DESCRIPCION_MARCA'),
+        "preventa": punto_dict.get('PREVENTA'),
+        "id_marca": punto_dict.get('ID_MARCA'),
+        "id_categoria": punto_dict.get('ID_CATEGORIA'),
+        "DESCRIPCION_CATEGORIA": punto_dict.get('DESCRIPCION_CATEGORIA'),
+        "id_dpto": punto_dict.get('ID_DPTO'),
+        "DESCRIPCION_DPTO": punto_dict.get('DESCRIPCION_DPTO'),
+        "id_ciudad": punto_dict.get('ID_CIUDAD'),
+        "DESCRIPCION_CIUDAD": punto_dict.get('DESCRIPCION_CIUDAD'),
+    }
+
+
+def _acumular_venta_cliente(datos_cliente, datos_fila):
+    """Si la fila tiene una venta más reciente que la guardada, actualiza los datos de la última venta."""
+    current_latest_stock_date = datos_cliente["ultima_venta_stock_date"]
+    sale_date = datos_fila["ultima_venta_stock_date"]
+    if current_latest_stock_date is None or (sale_date and sale_date > current_latest_stock_date):
+        datos_cliente["ultima_venta_stock_date"] = sale_date
+        datos_cliente.update({campo: datos_fila[campo] for campo in _CAMPOS_ACTUALIZABLES})
+
+
+def _clasificar_cliente(datos_cliente, transito_cliente, hoy):
+    """Retorna (color, forma, inicial del vendedor) de un cliente."""
+    ultima_venta_stock_date = datos_cliente.get("ultima_venta_stock_date")
+
+    base_color = "black"
+
+    if ultima_venta_stock_date is not None:
+        dias_desde_ultima_venta_stock = (hoy - ultima_venta_stock_date).days
+        if dias_desde_ultima_venta_stock <= 30:
+            base_color = "green"
+        elif 31 <= dias_desde_ultima_venta_stock <= 60:
+            base_color = "orange"
+        elif 61 <= dias_desde_ultima_venta_stock <= 90:
+            base_color = "red"
+        # Si supera los 90 días, permanece en 'black' (valor por defecto)
+
+    shape = "diamond" if transito_cliente else "circle"
+
+    # --- Corrección para first_letter_vend ---
+    first_letter_vend = '?' # Valor por defecto
+    desc_vend = datos_cliente.get("descripcion_vend")
+
+    if desc_vend is not None:
+        desc_vend_stripped = str(desc_vend).strip()
+        if len(desc_vend_stripped) > 0:
+            first_letter_vend = desc_vend_stripped[0].upper()
+    # --- Fin Corrección first_letter_vend ---
+
+    return base_color, shape, first_letter_vend
+
+
+def _fecha_de_referencia(hoy):
+    """'hoy' (date, datetime o Timestamp) como date; por defecto, la fecha actual."""
+    if hoy is None:
+        return datetime.now().date()
+    if isinstance(hoy, datetime):  # También pd.Timestamp, que hereda de datetime
+        return hoy.date()
+    return hoy
+
+
+def _popup_de_cliente(id_cliente, datos_cliente, transito_cliente, popup_index):
+    """HTML del popup del cliente, o None en modo perezoso (los datos quedan en 'popup_index')."""
+    if popup_index is not None:
+        # Modo perezoso: solo se guardan los datos, el HTML se arma al abrir el popup
+        from app.popup_index import popup_datos
+        popup_index.add(id_cliente, popup_datos(datos_cliente, transito_cliente or []))
+        return None
+    # Generar el HTML del popup completo (o tomarlo de la caché de fragmentos)
+    return render_popup_cliente(datos_cliente, transito_cliente or [])
+
+
+def _construir_punto(id_cliente, datos_cliente, transito_cliente, popup_index, hoy):
+    """Arma el diccionario del punto del mapa (color, forma, inicial del vendedor y popup)."""
+    base_color, shape, first_letter_vend = _clasificar_cliente(datos_cliente, transito_cliente, hoy)
+    full_popup_html_content = _popup_de_cliente(id_cliente, datos_cliente, transito_cliente, popup_index)
+
+    punto_dict = {
+        "id_cliente": id_cliente,
+        "descripcion_cliente": datos_cliente.get("descripcion_cliente"),
+        "LATITUD": float(datos_cliente.get("latitud")) if isinstance(datos_cliente.get("latitud"), Decimal) else datos_cliente.get("latitud"),
+        "LONGITUD": float(datos_cliente.get("longitud")) if isinstance(datos_cliente.get("longitud"), Decimal) else datos_cliente.get("longitud"),
+        "id_vend": datos_cliente.get("id_vend"),
+        "descripcion_vend": datos_cliente.get("descripcion_vend"),
+        "descripcion_marca": datos_cliente.get("descripcion_marca"),
+        "preventa": datos_cliente.get("preventa"),
+        "id_marca": datos_cliente.get("id_marca"),
+        "id_categoria": datos_cliente.get("id_categoria"),
+        "DESCRIPCION_CATEGORIA": datos_cliente.get("DESCRIPCION_CATEGORIA"),
+        "id_dpto": datos_cliente.get("id_dpto"),
+        "DESCRIPCION_DPTO": datos_cliente.get("DESCRIPCION_DPTO"),
+        "id_ciudad": datos_cliente.get("id_ciudad"),
+        "DESCRIPCION_CIUDAD": datos_cliente.get("DESCRIPCION_CIUDAD"),
+        "color": base_color,
+        "shape": shape,
+        "popup_html": full_popup_html_content, # Esto ya contiene todo el HTML
+        "first_letter_vend": first_letter_vend # Usar el valor corregido
+    }
+    if full_popup_html_content is None:
+        del punto_dict["popup_html"]
+
+    return punto_dict
+
+
+def calculate_colors_and_shapes_for_all_points(puntos_preventa_1, puntos_preventa_no_1, popup_index=None, ordenado_por_cliente=False, construir=_construir_punto, hoy=None):
     """
     Calcula colores y formas para puntos basándose en datos de ventas, incluyendo PREVENTA.
+    Ambos argumentos pueden ser listas o iteradores (por ejemplo los generadores stream_* de
+    app/database.py): cada fila se procesa al llegar y no se guarda la lista completa.
+    Si se pasa 'popup_index' (app/popup_index.py) los popups no se arman: los puntos salen sin
+    'popup_html' y los datos de cada popup se guardan en el índice para generarlos al hacer clic.
+    Con ordenado_por_cliente=True (ambas entradas ordenadas por ID_CLIENTE, como las consultas)
+    se usa el merge join de iter_points_merge_join en lugar de los diccionarios por cliente, y se
+    retorna su generador: los puntos se producen a medida que el consumidor los pide.
+    'construir' arma cada punto; por defecto un diccionario (ver calculate_point_records).
+    'hoy' permite fijar la fecha de referencia (por defecto, la fecha actual).
     """
+    if ordenado_por_cliente:
+        return iter_points_merge_join(puntos_preventa_1, puntos_preventa_no_1, popup_index=popup_index, construir=construir, hoy=hoy)
+
     print("- Procesando puntos para asignar colores y formas -")
 
     sales_by_client = {}
-    print(f"- Puntos PREVENTA=1 recibidos: {len(puntos_preventa_1)}")
+    filas_preventa_1 = 0
 
     for punto_dict in puntos_preventa_1:
+        filas_preventa_1 += 1
         try:
-            id_cliente = punto_dict.get('ID_CLIENTE')
-            descripcion_cliente = punto_dict.get('DESCRIPCION_CLIENTE')
-            latitud = punto_dict.get('LATITUD')
-            longitud = punto_dict.get('LONGITUD')
-            fecha_venta = punto_dict.get('ULTIMA_VENTA')
-            id_vend = punto_dict.get('ID_VEND')
-            descripcion_vend = punto_dict.get('DESCRIPCION_VEND')
-            descripcion_marca = punto_dict.get('DESCRIPCION_MARCA')
-            preventa = punto_dict.get('PREVENTA')
-            id_marca = punto_dict.get('ID_MARCA')
-            id_categoria = punto_dict.get('ID_CATEGORIA')
-
-            descripcion_categoria = punto_dict.get('DESCRIPCION_CATEGORIA')
-            id_dpto = punto_dict.get('ID_DPTO')
-            descripcion_dpto = punto_dict.get('DESCRIPCION_DPTO')
-            id_ciudad = punto_dict.get('ID_CIUDAD')
-            descripcion_ciudad = punto_dict.get('DESCRIPCION_CIUDAD')
-
-            if id_cliente is None or descripcion_cliente is None or latitud is None or longitud is None:
-                print(f"Advertencia: Saltando diccionario PREVENTA=1 con campos requeridos nulos: {punto_dict}")
+            fila = _parsear_fila_preventa_1(punto_dict)
+            if fila is None:
                 continue
-
-            sale_date = None
-            if fecha_venta is not None:
-                if isinstance(fecha_venta, str):
-                    try:
-                        sale_date = datetime.strptime(fecha_venta.strip(), "%Y-%m-%d %H:%M:%S").date()
-                    except ValueError:
-                        try:
-                            sale_date = datetime.strptime(fecha_venta.strip(), "%Y-%m-%d").date()
-                        except ValueError as ve:
-                            print(f"Advertencia: Fecha inválida '{fecha_venta}' para cliente {id_cliente}. Error: {ve}")
-                            continue
-                elif isinstance(fecha_venta, datetime):
-                    sale_date = fecha_venta.date()
-                elif isinstance(fecha_venta, date):
-                    sale_date = fecha_venta
-
+            id_cliente, datos_fila = fila
 
             if id_cliente not in sales_by_client:
-                sales_by_client[id_cliente] = {
-                    "id_cliente": id_cliente,
-                    "descripcion_cliente": descripcion_cliente,
-                    "latitud": latitud,
-                    "longitud": longitud,
-                    "ultima_venta_stock_date": sale_date,
-                    "id_vend": id_vend,
-                    "descripcion_vend": descripcion_vend,
-                    "descripcion_marca": descripcion_marca,
-                    "preventa": preventa,
-                    "id_marca": id_marca,
-                    "id_categoria": id_categoria,
-                    "DESCRIPCION_CATEGORIA": descripcion_categoria,
-                    "id_dpto": id_dpto,
-                    "DESCRIPCION_DPTO": descripcion_dpto,
-                    "id_ciudad": id_ciudad,
-                    "DESCRIPCION_CIUDAD": descripcion_ciudad,
-                }
+                sales_by_client[id_cliente] = datos_fila
             else:
-                current_latest_stock_date = sales_by_client[id_cliente]["ultima_venta_stock_date"]
-                if current_latest_stock_date is None or (sale_date and sale_date > current_latest_stock_date):
-                    sales_by_client[id_cliente]["ultima_venta_stock_date"] = sale_date
-                    sales_by_client[id_cliente].update({
-                        "id_vend": id_vend,
-                        "descripcion_vend": descripcion_vend,
-                        "descripcion_marca": descripcion_marca,
-                        "preventa": preventa,
-                        "DESCRIPCION_CATEGORIA": descripcion_categoria,
-                        "DESCRIPCION_DPTO": descripcion_dpto,
-                        "DESCRIPCION_CIUDAD": descripcion_ciudad,
-                    })
+                _acumular_venta_cliente(sales_by_client[id_cliente], datos_fila)
 
         except Exception as e:
             print(f"Error al procesar diccionario en el paso de PREVENTA=1: {punto_dict}. Error: {e}")
             continue
 
+    print(f"- Puntos PREVENTA=1 recibidos: {filas_preventa_1}")
     print(f"Paso 1 completado. Clientes únicos con ventas PREVENTA=1: {len(sales_by_client)}")
 
     ventas_en_transito_por_cliente = {}
-    print(f"- Puntos PREVENTA!=1 recibidos: {len(puntos_preventa_no_1)}")
+    filas_preventa_no_1 = 0
 
     for punto_transito in puntos_preventa_no_1:
+        filas_preventa_no_1 += 1
         id_cliente_transito = punto_transito.get('ID_CLIENTE')
         if id_cliente_transito:
+            if 'CANTIDAD_LINEAS' in punto_transito:
+                # Fila ya agrupada en el servidor: se guarda tal cual, las líneas se expanden solo para el popup
+                if punto_transito['CANTIDAD_LINEAS']:
+                    ventas_en_transito_por_cliente[id_cliente_transito] = punto_transito
+                continue
             if id_cliente_transito not in ventas_en_transito_por_cliente:
                 ventas_en_transito_por_cliente[id_cliente_transito] = []
             ventas_en_transito_por_cliente[id_cliente_transito].append(punto_transito)
 
+    print(f"- Puntos PREVENTA!=1 recibidos: {filas_preventa_no_1}")
     print(f"Paso 2 completado. Clientes con ventas en tránsito: {len(ventas_en_transito_por_cliente)}")
 
     puntos_para_mapa = []
+    hoy = _fecha_de_referencia(hoy)
 
     for id_cliente, datos_cliente in sales_by_client.items():
         try:
-            ultima_venta_stock_date = datos_cliente.get("ultima_venta_stock_date")
-
-            base_color = "black"
-
-            if ultima_venta_stock_date is not None:
-                dias_desde_ultima_venta_stock = (datetime.now().date() - ultima_venta_stock_date).days
-                if dias_desde_ultima_venta_stock <= 30:
-                    base_color = "green"
-                elif 31 <= dias_desde_ultima_venta_stock <= 60:
-                    base_color = "orange"
-                elif 61 <= dias_desde_ultima_venta_stock <= 90:
-                    base_color = "red"
-                # Si supera los 90 días, permanece en 'black' (valor por defecto)
-
-
-            shape = "circle"
-            if id_cliente in ventas_en_transito_por_cliente:
-                shape = "diamond"
-
-            # --- Corrección para first_letter_vend ---
-            first_letter_vend = '?' # Valor por defecto
-            desc_vend = datos_cliente.get("descripcion_vend")
-
-            if desc_vend is not None:
-                desc_vend_stripped = str(desc_vend).strip()
-                if len(desc_vend_stripped) > 0:
-                    first_letter_vend = desc_vend_stripped[0].upper()
-            # --- Fin Corrección first_letter_vend ---
-
-
-            # Generar el HTML del popup completo
-            popup_html_content_basic = formatear_info_basica_para_popup(datos_cliente)
-            detalles_transito_cliente = ventas_en_transito_por_cliente.get(id_cliente, [])
-
-            # Pasamos solo los detalles de tránsito a la función, ya no necesitamos el point_id aquí.
-            popup_html_content_transito = formatear_ventas_en_transito_para_popup(detalles_transito_cliente)
-
-            # Concatenar todo el HTML y cerrar el div principal
-            full_popup_html_content = popup_html_content_basic + popup_html_content_transito + "</div>"
-
-            punto_dict = {
-                "id_cliente": id_cliente,
-                "descripcion_cliente": datos_cliente.get("descripcion_cliente"),
-                "LATITUD": float(datos_cliente.get("latitud")) if isinstance(datos_cliente.get("latitud"), Decimal) else datos_cliente.get("latitud"),
-                "LONGITUD": float(datos_cliente.get("longitud")) if isinstance(datos_cliente.get("longitud"), Decimal) else datos_cliente.get("longitud"),
-                "id_vend": datos_cliente.get("id_vend"),
-                "descripcion_vend": datos_cliente.get("descripcion_vend"),
-                "descripcion_marca": datos_cliente.get("descripcion_marca"),
-                "preventa": datos_cliente.get("preventa"),
-                "id_marca": datos_cliente.get("id_marca"),
-                "id_categoria": datos_cliente.get("id_categoria"),
-                "DESCRIPCION_CATEGORIA": datos_cliente.get("DESCRIPCION_CATEGORIA"),
-                "id_dpto": datos_cliente.get("id_dpto"),
-                "DESCRIPCION_DPTO": datos_cliente.get("DESCRIPCION_DPTO"),
-                "id_ciudad": datos_cliente.get("id_ciudad"),
-                "DESCRIPCION_CIUDAD": datos_cliente.get("DESCRIPCION_CIUDAD"),
-                "color": base_color,
-                "shape": shape,
-                "popup_html": full_popup_html_content, # Esto ya contiene todo el HTML
-                "first_letter_vend": first_letter_vend # Usar el valor corregido
-            }
-
-            puntos_para_mapa.append(punto_dict)
-
+            puntos_para_mapa.append(construir(
+                id_cliente, datos_cliente, ventas_en_transito_por_cliente.get(id_cliente), popup_index, hoy
+            ))
         except Exception as e:
             print(f"Error inesperado al procesar cliente {id_cliente} para el mapa: {e}")
             continue
@@ -241,6 +304,345 @@ def calculate_colors_and_shapes_for_all_points(puntos_preventa_1, puntos_prevent
     print("Paso 3 completado. Total de puntos procesados para visualización:", len(puntos_para_mapa))
     return puntos_para_mapa
 
+
+class UnsortedInputError(ValueError):
+    """Una entrada de iter_points_merge_join no está ordenada por ID_CLIENTE."""
+
+
+def iter_points_merge_join(puntos_preventa_1, puntos_preventa_no_1, popup_index=None, construir=_construir_punto, hoy=None):
+    """
+    Generador equivalente a calculate_colors_and_shapes_for_all_points para entradas ordenadas
+    por ID_CLIENTE (como las devuelven las consultas y el snapshot): avanza ambos flujos a la vez,
+    cliente por cliente, y produce cada punto terminado apenas se leyó su última fila.
+    La memoria queda acotada a las filas de un cliente y el consumidor puede empezar a trabajar
+    antes de que termine la lectura. Lanza UnsortedInputError si alguna entrada no está ordenada.
+    """
+    print("- Procesando puntos para asignar colores y formas (merge join por cliente) -")
+    hoy = _fecha_de_referencia(hoy)
+    transito_iter = iter(puntos_preventa_no_1)
+    estado = {'pendiente': None, 'ultimo_id': None, 'agotado': False}
+    contadores = {'preventa_1': 0, 'transito': 0, 'clientes_transito': 0, 'puntos': 0}
+
+    def _siguiente_transito():
+        # Próxima fila de tránsito con ID válido, verificando el orden
+        for punto_transito in transito_iter:
+            contadores['transito'] += 1
+            id_transito = punto_transito.get('ID_CLIENTE')
+            if not id_transito:
+                continue
+            if estado['ultimo_id'] is not None and id_transito < estado['ultimo_id']:
+                raise UnsortedInputError(f"Las filas en tránsito no están ordenadas por ID_CLIENTE ({id_transito} después de {estado['ultimo_id']}).")
+            estado['ultimo_id'] = id_transito
+            return punto_transito
+        estado['agotado'] = True
+        return None
+
+    def _transito_de(id_cliente):
+        # Descarta los clientes en tránsito sin ventas PREVENTA=1 y junta las filas del cliente actual
+        transito_cliente = None
+        while not estado['agotado']:
+            if estado['pendiente'] is None:
+                estado['pendiente'] = _siguiente_transito()
+                if estado['pendiente'] is None:
+                    break
+            punto_transito = estado['pendiente']
+            id_transito = punto_transito['ID_CLIENTE']
+            if id_transito > id_cliente:
+                break
+            estado['pendiente'] = None
+            if id_transito < id_cliente:
+                continue
+            if 'CANTIDAD_LINEAS' in punto_transito:
+                if punto_transito['CANTIDAD_LINEAS']:
+                    transito_cliente = punto_transito
+            else:
+                if transito_cliente is None:
+                    transito_cliente = []
+                transito_cliente.append(punto_transito)
+        if transito_cliente:
+            contadores['clientes_transito'] += 1
+        return transito_cliente
+
+    def _emitir(id_cliente, datos_cliente):
+        try:
+            punto = construir(id_cliente, datos_cliente, _transito_de(id_cliente), popup_index, hoy)
+        except UnsortedInputError:
+            # El orden roto invalida todo el merge join; un error de un cliente solo lo descarta a él
+            raise
+        except Exception as e:
+            print(f"Error inesperado al procesar cliente {id_cliente} para el mapa: {e}")
+            return None
+        contadores['puntos'] += 1
+        return punto
+
+    id_actual, datos_actual = None, None
+    for punto_dict in puntos_preventa_1:
+        contadores['preventa_1'] += 1
+        try:
+            fila = _parsear_fila_preventa_1(punto_dict)
+        except Exception as e:
+            print(f"Error al procesar diccionario en el paso de PREVENTA=1: {punto_dict}. Error: {e}")
+            continue
+        if fila is None:
+            continue
+        id_cliente, datos_fila = fila
+
+        if id_cliente == id_actual:
+            _acumular_venta_cliente(datos_actual, datos_fila)
+            continue
+        if id_actual is not None:
+            if id_cliente < id_actual:
+                raise UnsortedInputError(f"Las filas PREVENTA=1 no están ordenadas por ID_CLIENTE ({id_cliente} después de {id_actual}).")
+            punto = _emitir(id_actual, datos_actual)
+            if punto is not None:
+                yield punto
+        id_actual, datos_actual = id_cliente, datos_fila
+
+    if id_actual is not None:
+        punto = _emitir(id_actual, datos_actual)
+        if punto is not None:
+            yield punto
+
+    print(f"- Merge join completado: {contadores['preventa_1']} filas PREVENTA=1, {contadores['transito']} filas en tránsito "
+          f"({contadores['clientes_transito']} clientes con tránsito), {contadores['puntos']} puntos.")
+
+
+def calculate_point_records(puntos_preventa_1, puntos_preventa_no_1, popup_index=None, ordenado_por_cliente=False):
+    """
+    Igual que calculate_colors_and_shapes_for_all_points pero devuelve un PointStore
+    (app/point_record.py): registros compactos con __slots__ y textos como códigos enteros,
+    en lugar de un diccionario de ~20 claves por cliente. Con ordenado_por_cliente=True el store
+    consume el merge join registro a registro (sin una lista intermedia de puntos).
+    """
+    from app.point_record import PointStore
+    store = PointStore()
+    return store.consumir(calculate_colors_and_shapes_for_all_points(
+        puntos_preventa_1, puntos_preventa_no_1,
+        popup_index=popup_index, ordenado_por_cliente=ordenado_por_cliente, construir=store.construir
+    ))
+
+
+# --- MOTOR VECTORIZADO (pandas/NumPy) ---
+# Misma clasificación que calculate_colors_and_shapes_for_all_points, pero sobre columnas:
+# parseo de fechas, antigüedad de la última venta, color, forma y first_letter_vend se
+# calculan con operaciones vectorizadas. Solo el HTML del popup se arma fila por fila
+# (reutilizando los mismos formateadores), y puede omitirse con incluir_popup=False.
+
+COLUMNAS_PREVENTA_1 = [
+    'ID_CLIENTE', 'DESCRIPCION_CLIENTE', 'LATITUD', 'LONGITUD', 'ULTIMA_VENTA',
+    'ID_VEND', 'DESCRIPCION_VEND', 'DESCRIPCION_MARCA', 'PREVENTA', 'ID_MARCA', 'ID_CATEGORIA',
+    'DESCRIPCION_CATEGORIA', 'ID_DPTO', 'DESCRIPCION_DPTO', 'ID_CIUDAD', 'DESCRIPCION_CIUDAD',
+]
+
+# Campos que se toman de la fila con la venta más reciente del cliente (el resto, de la primera fila)
+_CAMPOS_ULTIMA_VENTA = [
+    'ID_VEND', 'DESCRIPCION_VEND', 'DESCRIPCION_MARCA', 'PREVENTA',
+    'DESCRIPCION_CATEGORIA', 'DESCRIPCION_DPTO', 'DESCRIPCION_CIUDAD',
+]
+
+COLUMNAS_PUNTOS_MAPA = [
+    'id_cliente', 'descripcion_cliente', 'LATITUD', 'LONGITUD', 'id_vend', 'descripcion_vend',
+    'descripcion_marca', 'preventa', 'id_marca', 'id_categoria', 'DESCRIPCION_CATEGORIA', 'id_dpto',
+    'DESCRIPCION_DPTO', 'id_ciudad', 'DESCRIPCION_CIUDAD', 'color', 'shape', 'popup_html', 'first_letter_vend',
+]
+
+
+def _parsear_fechas(columna):
+    """
+    Convierte ULTIMA_VENTA (texto, date o datetime) a datetime64 normalizado al día.
+    Retorna (fechas, invalidas): 'invalidas' marca los textos que no tienen formato de fecha.
+    """
+    tipo = pd.api.types.infer_dtype(columna, skipna=True)
+    if tipo in ('string', 'empty'):
+        es_texto = columna.notna()
+    elif tipo in ('date', 'datetime', 'datetime64'):
+        es_texto = pd.Series(False, index=columna.index)
+    else:
+        es_texto = columna.map(lambda valor: isinstance(valor, str)).astype(bool)
+    texto = columna.where(es_texto).str.strip()
+    fechas_texto = pd.to_datetime(texto, format="%Y-%m-%d %H:%M:%S", errors='coerce')
+    fechas_texto = fechas_texto.fillna(pd.to_datetime(texto, format="%Y-%m-%d", errors='coerce'))
+    otras = columna.where(~es_texto & columna.notna())
+    fechas_otras = pd.to_datetime(otras, errors='coerce')
+    fechas = fechas_texto.where(es_texto, fechas_otras).dt.normalize()
+    invalidas = es_texto & fechas_texto.isna()
+    return fechas, invalidas
+
+
+def _clientes_en_transito(puntos_preventa_no_1):
+    """IDs de clientes con mercadería en tránsito y, para el popup, su detalle por cliente."""
+    transito = {}
+    for punto_transito in puntos_preventa_no_1:
+        id_cliente_transito = punto_transito.get('ID_CLIENTE')
+        if not id_cliente_transito:
+            continue
+        if 'CANTIDAD_LINEAS' in punto_transito:
+            if punto_transito['CANTIDAD_LINEAS']:
+                transito[id_cliente_transito] = punto_transito
+            continue
+        transito.setdefault(id_cliente_transito, []).append(punto_transito)
+    return transito
+
+
+def classify_points_vectorized(puntos_preventa_1, puntos_preventa_no_1, hoy=None, incluir_popup=True, lazy_popups=False):
+    """
+    Versión vectorizada de calculate_colors_and_shapes_for_all_points. 'puntos_preventa_1' puede
+    ser un iterable de filas (diccionarios) o un DataFrame ya en columnas. Retorna un DataFrame con
+    las columnas de COLUMNAS_PUNTOS_MAPA (una fila por cliente, en orden de primera aparición).
+    'hoy' permite fijar la fecha de referencia (por defecto, la fecha actual).
+    Con lazy_popups=True la columna 'popup_html' se reemplaza por 'popup_datos' (datos sin HTML,
+    ver app/popup_index.py) para generar cada popup recién al abrirlo.
+    """
+    print("- Procesando puntos para asignar colores y formas (vectorizado) -")
+    hoy = pd.Timestamp(hoy or datetime.now().date())
+
+    if isinstance(puntos_preventa_1, pd.DataFrame):
+        df = puntos_preventa_1.reindex(columns=COLUMNAS_PREVENTA_1)
+    else:
+        df = pd.DataFrame.from_records(puntos_preventa_1, columns=COLUMNAS_PREVENTA_1)
+    print(f"- Puntos PREVENTA=1 recibidos: {len(df)}")
+
+    requeridos = df[['ID_CLIENTE', 'DESCRIPCION_CLIENTE', 'LATITUD', 'LONGITUD']].notna().all(axis=1)
+    if (~requeridos).any():
+        print(f"Advertencia: Saltando {int((~requeridos).sum())} filas PREVENTA=1 con campos requeridos nulos.")
+    fechas, invalidas = _parsear_fechas(df['ULTIMA_VENTA'])
+    invalidas &= requeridos
+    if invalidas.any():
+        print(f"Advertencia: Saltando {int(invalidas.sum())} filas PREVENTA=1 con fecha inválida.")
+
+    validas = requeridos & ~invalidas
+    if not validas.all():
+        df, fechas = df[validas], fechas[validas]
+    df = df.reset_index(drop=True)
+    fechas = fechas.reset_index(drop=True)
+
+    if df['ID_CLIENTE'].is_unique:
+        # Caso habitual (consulta con ROW_NUMBER): ya hay una fila por cliente
+        clientes, fecha_cliente = df, fechas
+    else:
+        # Datos fijos del cliente: primera fila. Datos de la última venta: la primera fila con la
+        # fecha máxima; si el cliente no tiene ninguna fecha, la última fila (igual que el bucle).
+        orden = np.arange(len(df))
+        clave_orden = np.where(fechas.notna(), -orden, orden)
+        ultimas = (
+            pd.DataFrame({'id': df['ID_CLIENTE'], 'fecha': fechas, 'clave': clave_orden})
+              .sort_values(['id', 'fecha', 'clave'], na_position='first', kind='mergesort')
+              .drop_duplicates('id', keep='last')
+        )
+        posicion_ultima = pd.Series(ultimas.index, index=ultimas['id'])
+
+        clientes = df[~df['ID_CLIENTE'].duplicated(keep='first')].reset_index(drop=True)
+        posiciones = posicion_ultima.reindex(clientes['ID_CLIENTE']).to_numpy()
+        for campo in _CAMPOS_ULTIMA_VENTA:
+            clientes[campo] = df[campo].iloc[posiciones].to_numpy()
+        fecha_cliente = fechas.iloc[posiciones].reset_index(drop=True)
+    print(f"Paso 1 completado. Clientes únicos con ventas PREVENTA=1: {len(clientes)}")
+
+    transito = _clientes_en_transito(puntos_preventa_no_1)
+    print(f"Paso 2 completado. Clientes con ventas en tránsito: {len(transito)}")
+
+    dias = (hoy - fecha_cliente).dt.days
+    color = np.select(
+        [dias <= 30, dias <= 60, dias <= 90],
+        ['green', 'orange', 'red'],
+        default='black'
+    )
+    shape = np.where(clientes['ID_CLIENTE'].isin(list(transito.keys())), 'diamond', 'circle')
+
+    # Pocos vendedores distintos: la inicial se calcula una vez por descripción única
+    codigos, vendedores_unicos = pd.factorize(clientes['DESCRIPCION_VEND'])
+    iniciales = np.array([(str(v).strip()[:1].upper() or '?') for v in vendedores_unicos] + ['?'], dtype=object)
+    first_letter_vend = iniciales[codigos]  # código -1 (NULL) -> último elemento, '?'
+
+    def _numerico(columna):
+        try:
+            return pd.to_numeric(columna)
+        except (ValueError, TypeError):
+            return columna.map(lambda v: float(v) if isinstance(v, Decimal) else v)
+
+    resultado = pd.DataFrame({
+        'id_cliente': clientes['ID_CLIENTE'],
+        'descripcion_cliente': clientes['DESCRIPCION_CLIENTE'],
+        'LATITUD': _numerico(clientes['LATITUD']),
+        'LONGITUD': _numerico(clientes['LONGITUD']),
+        'id_vend': clientes['ID_VEND'],
+        'descripcion_vend': clientes['DESCRIPCION_VEND'],
+        'descripcion_marca': clientes['DESCRIPCION_MARCA'],
+        'preventa': clientes['PREVENTA'],
+        'id_marca': clientes['ID_MARCA'],
+        'id_categoria': clientes['ID_CATEGORIA'],
+        'DESCRIPCION_CATEGORIA': clientes['DESCRIPCION_CATEGORIA'],
+        'id_dpto': clientes['ID_DPTO'],
+        'DESCRIPCION_DPTO': clientes['DESCRIPCION_DPTO'],
+        'id_ciudad': clientes['ID_CIUDAD'],
+        'DESCRIPCION_CIUDAD': clientes['DESCRIPCION_CIUDAD'],
+        'color': color,
+        'shape': shape,
+        'popup_html': None,
+        'first_letter_vend': first_letter_vend,
+    }, columns=COLUMNAS_PUNTOS_MAPA)
+
+    if incluir_popup and len(resultado):
+        fechas_popup = fecha_cliente.dt.date.astype(object).where(fecha_cliente.notna(), None)
+        datos_popup = pd.DataFrame({
+            'id_cliente': clientes['ID_CLIENTE'],
+            'descripcion_cliente': clientes['DESCRIPCION_CLIENTE'],
+            'ultima_venta_stock_date': fechas_popup,
+            'descripcion_vend': clientes['DESCRIPCION_VEND'],
+            'descripcion_marca': clientes['DESCRIPCION_MARCA'],
+            'DESCRIPCION_CATEGORIA': clientes['DESCRIPCION_CATEGORIA'],
+            'DESCRIPCION_DPTO': clientes['DESCRIPCION_DPTO'],
+            'DESCRIPCION_CIUDAD': clientes['DESCRIPCION_CIUDAD'],
+        }).astype(object).where(lambda d: d.notna(), None)
+        if lazy_popups:
+            from app.popup_index import popup_datos
+            resultado['popup_datos'] = [
+                popup_datos(datos, transito.get(datos['id_cliente'], []))
+                for datos in datos_popup.to_dict('records')
+            ]
+            resultado = resultado.drop(columns=['popup_html'])
+        else:
+            resultado['popup_html'] = [
+                render_popup_cliente(datos, transito.get(datos['id_cliente'], []))
+                for datos in datos_popup.to_dict('records')
+            ]
+
+    print("Paso 3 completado. Total de puntos procesados para visualización:", len(resultado))
+    return resultado
+
+
+def check_vectorized_equivalence(puntos_preventa_1, puntos_preventa_no_1, hoy=None):
+    """
+    Compara classify_points_vectorized con calculate_colors_and_shapes_for_all_points sobre las
+    mismas filas, con la misma fecha de referencia 'hoy' (por defecto, la fecha actual).
+    Retorna una lista de diferencias (vacía si ambos motores coinciden).
+    """
+    hoy = _fecha_de_referencia(hoy)
+    puntos_preventa_1 = list(puntos_preventa_1)
+    puntos_preventa_no_1 = list(puntos_preventa_no_1)
+
+    esperado = pd.DataFrame(
+        calculate_colors_and_shapes_for_all_points(puntos_preventa_1, puntos_preventa_no_1, hoy=hoy),
+        columns=COLUMNAS_PUNTOS_MAPA
+    )
+    obtenido = classify_points_vectorized(puntos_preventa_1, puntos_preventa_no_1, hoy=hoy)
+
+    if len(esperado) != len(obtenido):
+        return [f"Cantidad de puntos distinta: {len(esperado)} (bucle) vs {len(obtenido)} (vectorizado)"]
+
+    diferencias = []
+    for columna in COLUMNAS_PUNTOS_MAPA:
+        a = esperado[columna].astype(object).where(esperado[columna].notna(), None).tolist()
+        b = obtenido[columna].astype(object).where(obtenido[columna].notna(), None).tolist()
+        if columna in ('LATITUD', 'LONGITUD'):
+            a = [None if v is None else float(v) for v in a]
+            b = [None if v is None else float(v) for v in b]
+        for fila, (va, vb) in enumerate(zip(a, b)):
+            if va != vb:
+                diferencias.append(f"Fila {fila}, columna '{columna}': {va!r} (bucle) vs {vb!r} (vectorizado)")
+    return diferencias
+
+
 # Helper function
 def format_date_for_display(date_obj):
     if isinstance(date_obj, (datetime, date)):
@@ -1,8 +1,10 @@
 import pymysql
 import json
 import os
+import re
 from datetime import datetime, date
 import sys
+import time
 
 # NOTA: get_db_path es probablemente para una base de datos SQLite local con PyInstaller.
 # Si tu aplicación Streamlit se conecta a un MySQL remoto, esta función
@@ -18,6 +20,28 @@ def get_db_path(db_filename="database.db"):
     print(f"Intentando conectar a la base de datos en: {db_path}")
     return db_path
 
+def load_db_config(config_filename="db_config.json"):
+    """
+    Carga la configuración de la base de datos desde app/db_config.json.
+    Cuando la app está empaquetada con PyInstaller, el archivo se busca en sys._MEIPASS/app.
+    Retorna un diccionario con 'host', 'port', 'user', 'password', 'database' o None si falla.
+    """
+    if getattr(sys, 'frozen', False):
+        config_dir = os.path.join(sys._MEIPASS, 'app')
+    else:
+        config_dir = os.path.dirname(os.path.abspath(__file__))
+
+    config_path = os.path.join(config_dir, config_filename)
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"Error: Archivo de configuración de BD no encontrado en {config_path}")
+        return None
+    except json.JSONDecodeError as e:
+        print(f"Error: Archivo de configuración de BD inválido ({config_path}): {e}")
+        return None
+
 def connect_to_database(db_config):
     """
     Intenta establecer una conexión con la base de datos MySQL usando los parámetros proporcionados.
@@ -156,110 +180,277 @@ def fetch_ciudades(conexion, id_dpto=None):
 
 # --- FUNCIONES CLAVE PARA EL MAPA ---
 
-def fetch_points_with_last_sale_preventa_1(conexion, id_categoria=None, id_marca=None, descripcion_vend=None, id_dpto=None, id_ciudad=None):
+def _filtro_presente(valor):
+    return valor is not None and valor != ''
+
+def build_points_preventa_1_query_max_join(id_categoria=None, id_marca=None, descripcion_vend=None, id_dpto=None, id_ciudad=None):
     """
-    Recupera puntos de venta con la última venta de 'PREVENTA = 1', aplicando varios filtros.
+    Construye la consulta original de PREVENTA=1: una CTE con MAX(FECHA) por cliente y un
+    JOIN de vuelta a 'ventas' por (ID_CLIENTE, FECHA). Puede devolver varias filas por cliente
+    si en la última fecha hubo varias ventas. Retorna (consulta, parámetros).
     """
-    try:
-        with conexion.cursor(pymysql.cursors.DictCursor) as cursor:
-            # Lista para almacenar los parámetros en el orden correcto de aparición en la consulta
-            params = []
+    # Lista para almacenar los parámetros en el orden correcto de aparición en la consulta
+    params = []
 
-            # --- CTE para encontrar la ÚLTIMA FECHA según los filtros de VENTA ---
-            cte_where_parts = ["v_sub.PREVENTA = 1"]
-            cte_join_parts = []
-            
-            if id_categoria is not None and id_categoria != '':
-                cte_where_parts.append("v_sub.ID_CATEGORIA = %s")
-                params.append(id_categoria)
-            
-            if id_marca is not None and id_marca != '':
-                cte_where_parts.append("v_sub.ID_MARCA = %s")
-                params.append(id_marca)
-
-            if descripcion_vend is not None and descripcion_vend != '':
-                cte_join_parts.append("JOIN vendedor ve_sub ON v_sub.ID_VEND = ve_sub.ID_VEND")
-                cte_where_parts.append("ve_sub.DESCRIPCION_VEND = %s")
-                params.append(descripcion_vend)
-
-            cte_where_clause = " AND ".join(cte_where_parts)
-            cte_joins_clause = " ".join(cte_join_parts)
-
-            cte_definition = f"""
-                WITH ultima_venta_preventa_1_por_cliente AS (
-                    SELECT
-                        v_sub.ID_CLIENTE,
-                        MAX(v_sub.FECHA) as ULTIMA_FECHA
-                    FROM ventas v_sub
-                    {cte_joins_clause}
-                    WHERE {cte_where_clause}
-                    GROUP BY v_sub.ID_CLIENTE
-                )
-            """
-            
-            # --- Cláusula WHERE principal (filtros de puntos_venta y filtros adicionales de v_latest) ---
-            main_where_parts = ["pv.LATITUD IS NOT NULL", "pv.LONGITUD IS NOT NULL", "pv.LATITUD != ''", "pv.LONGITUD != ''"]
+    # --- CTE para encontrar la ÚLTIMA FECHA según los filtros de VENTA ---
+    cte_where_parts = ["v_sub.PREVENTA = 1"]
+    cte_join_parts = []
 
-            if id_dpto is not None and id_dpto != '':
-                main_where_parts.append("pv.ID_DPTO = %s")
-                params.append(id_dpto)
+    if _filtro_presente(id_categoria):
+        cte_where_parts.append("v_sub.ID_CATEGORIA = %s")
+        params.append(id_categoria)
 
-            if id_ciudad is not None and id_ciudad != '':
-                main_where_parts.append("pv.ID_CIUDAD = %s")
-                params.append(id_ciudad)
+    if _filtro_presente(id_marca):
+        cte_where_parts.append("v_sub.ID_MARCA = %s")
+        params.append(id_marca)
 
-            # Las condiciones de categoría y marca para `v_latest` que aseguran que
-            # la venta obtenida por la CTE coincide con los filtros generales.
-            if id_categoria is not None and id_categoria != '':
-                main_where_parts.append("v_latest.ID_CATEGORIA = %s")
-                params.append(id_categoria) # Este es un parámetro repetido, pero necesario si el filtro aplica a v_latest
+    if _filtro_presente(descripcion_vend):
+        cte_join_parts.append("JOIN vendedor ve_sub ON v_sub.ID_VEND = ve_sub.ID_VEND")
+        cte_where_parts.append("ve_sub.DESCRIPCION_VEND = %s")
+        params.append(descripcion_vend)
 
-            if id_marca is not None and id_marca != '':
-                main_where_parts.append("v_latest.ID_MARCA = %s")
-                params.append(id_marca) # Este es un parámetro repetido, pero necesario si el filtro aplica a v_latest
-            
-            # Si se filtró por vendedor, la condición para el SELECT final.
-            # Esta condición se aplica a la tabla 'vendedor' que se une en el SELECT principal.
-            if descripcion_vend is not None and descripcion_vend != '':
-                main_where_parts.append("ve.DESCRIPCION_VEND = %s")
-                params.append(descripcion_vend) # Este es un parámetro repetido, pero necesario si el filtro aplica a ve
-
-
-            final_where_clause = " AND ".join(main_where_parts)
-
-            # --- Combinar todas las partes en la consulta final ---
-            full_query = f"""
-                {cte_definition}
-                SELECT
-                    pv.ID_CLIENTE,
-                    pv.DESCRIPCION_CLIENTE,
-                    pv.LATITUD,
-                    pv.LONGITUD,
-                    v_latest.FECHA AS ULTIMA_VENTA,
-                    v_latest.ID_VEND,
-                    ve.DESCRIPCION_VEND,
-                    m.DESCRIPCION_MARCA,
-                    v_latest.PREVENTA,
-                    v_latest.ID_MARCA,
-                    v_latest.ID_CATEGORIA,
-                    cat.DESCRIPCION_CATEGORIA,
-                    dpto.DESCRIPCION_DPTO,
-                    ciu.DESCRIPCION_CIUDAD
-                FROM puntos_venta pv
-                JOIN ultima_venta_preventa_1_por_cliente uvp1 ON pv.ID_CLIENTE = uvp1.ID_CLIENTE
-                JOIN ventas v_latest ON uvp1.ID_CLIENTE = v_latest.ID_CLIENTE 
-                                     AND uvp1.ULTIMA_FECHA = v_latest.FECHA
-                                     AND v_latest.PREVENTA = 1 -- Asegurar que la venta es de PREVENTA=1
-                LEFT JOIN vendedor ve ON v_latest.ID_VEND = ve.ID_VEND
-                LEFT JOIN marca m ON v_latest.ID_MARCA = m.ID_MARCA
-                LEFT JOIN categoria cat ON v_latest.ID_CATEGORIA = cat.ID_CATEGORIA
-                LEFT JOIN departamento dpto ON pv.ID_DPTO = dpto.ID_DPTO 
-                LEFT JOIN ciudad ciu ON pv.ID_CIUDAD = ciu.ID_CIUDAD 
-                WHERE {final_where_clause}
-                ORDER BY pv.ID_CLIENTE, v_latest.FECHA DESC;
-            """
-            
-            print("\n--- Consulta SQL generada para PREVENTA=1 ---")
+    cte_where_clause = " AND ".join(cte_where_parts)
+    cte_joins_clause = " ".join(cte_join_parts)
+
+    cte_definition = f"""
+        WITH ultima_venta_preventa_1_por_cliente AS (
+            SELECT
+                v_sub.ID_CLIENTE,
+                MAX(v_sub.FECHA) as ULTIMA_FECHA
+            FROM ventas v_sub
+            {cte_joins_clause}
+            WHERE {cte_where_clause}
+            GROUP BY v_sub.ID_CLIENTE
+        )
+    """
+
+    # --- Cláusula WHERE principal (filtros de puntos_venta y filtros adicionales de v_latest) ---
+    main_where_parts = ["pv.LATITUD IS NOT NULL", "pv.LONGITUD IS NOT NULL", "pv.LATITUD != ''", "pv.LONGITUD != ''"]
+
+    if _filtro_presente(id_dpto):
+        main_where_parts.append("pv.ID_DPTO = %s")
+        params.append(id_dpto)
+
+    if _filtro_presente(id_ciudad):
+        main_where_parts.append("pv.ID_CIUDAD = %s")
+        params.append(id_ciudad)
+
+    # Las condiciones de categoría y marca para `v_latest` que aseguran que
+    # la venta obtenida por la CTE coincide con los filtros generales.
+    if _filtro_presente(id_categoria):
+        main_where_parts.append("v_latest.ID_CATEGORIA = %s")
+        params.append(id_categoria) # Este es un parámetro repetido, pero necesario si el filtro aplica a v_latest
+
+    if _filtro_presente(id_marca):
+        main_where_parts.append("v_latest.ID_MARCA = %s")
+        params.append(id_marca) # Este es un parámetro repetido, pero necesario si el filtro aplica a v_latest
+
+    # Si se filtró por vendedor, la condición para el SELECT final.
+    # Esta condición se aplica a la tabla 'vendedor' que se une en el SELECT principal.
+    if _filtro_presente(descripcion_vend):
+        main_where_parts.append("ve.DESCRIPCION_VEND = %s")
+        params.append(descripcion_vend) # Este es un parámetro repetido, pero necesario si el filtro aplica a ve
+
+    final_where_clause = " AND ".join(main_where_parts)
+
+    # --- Combinar todas las partes en la consulta final ---
+    full_query = f"""
+        {cte_definition}
+        SELECT
+            pv.ID_CLIENTE,
+            pv.DESCRIPCION_CLIENTE,
+            pv.LATITUD,
+            pv.LONGITUD,
+            v_latest.FECHA AS ULTIMA_VENTA,
+            v_latest.ID_VEND,
+            ve.DESCRIPCION_VEND,
+            m.DESCRIPCION_MARCA,
+            v_latest.PREVENTA,
+            v_latest.ID_MARCA,
+            v_latest.ID_CATEGORIA,
+            cat.DESCRIPCION_CATEGORIA,
+            dpto.DESCRIPCION_DPTO,
+            ciu.DESCRIPCION_CIUDAD
+        FROM puntos_venta pv
+        JOIN ultima_venta_preventa_1_por_cliente uvp1 ON pv.ID_CLIENTE = uvp1.ID_CLIENTE
+        JOIN ventas v_latest ON uvp1.ID_CLIENTE = v_latest.ID_CLIENTE
+                             AND uvp1.ULTIMA_FECHA = v_latest.FECHA
+                             AND v_latest.PREVENTA = 1 -- Asegurar que la venta es de PREVENTA=1
+        LEFT JOIN vendedor ve ON v_latest.ID_VEND = ve.ID_VEND
+        LEFT JOIN marca m ON v_latest.ID_MARCA = m.ID_MARCA
+        LEFT JOIN categoria cat ON v_latest.ID_CATEGORIA = cat.ID_CATEGORIA
+        LEFT JOIN departamento dpto ON pv.ID_DPTO = dpto.ID_DPTO
+        LEFT JOIN ciudad ciu ON pv.ID_CIUDAD = ciu.ID_CIUDAD
+        WHERE {final_where_clause}
+        ORDER BY pv.ID_CLIENTE, v_latest.FECHA DESC, v_latest.ID_MARCA, v_latest.ID_VEND, v_latest.ID_CATEGORIA;
+    """
+    return full_query, params
+
+def build_points_preventa_1_query_row_number(id_categoria=None, id_marca=None, descripcion_vend=None, id_dpto=None, id_ciudad=None):
+    """
+    Construye la consulta de PREVENTA=1 con ROW_NUMBER() OVER (PARTITION BY ID_CLIENTE ORDER BY FECHA DESC).
+    Recorre 'ventas' una sola vez y devuelve exactamente una fila por cliente. Retorna (consulta, parámetros).
+    Si un cliente tiene varias ventas el mismo día, desempata por ID_MARCA, ID_VEND e ID_CATEGORIA
+    (NULL primero, igual que SIN_ID): la fila elegida no cambia entre ejecuciones. El snapshot local y el motor
+    en memoria (app/filters.py) desempatan igual; no hay clave primaria de ventas a ese nivel.
+    """
+    params = []
+
+    # --- Filtros de VENTA, aplicados antes de numerar las filas de cada cliente ---
+    ranked_where_parts = ["v.PREVENTA = 1"]
+    ranked_join_parts = []
+
+    if _filtro_presente(id_categoria):
+        ranked_where_parts.append("v.ID_CATEGORIA = %s")
+        params.append(id_categoria)
+
+    if _filtro_presente(id_marca):
+        ranked_where_parts.append("v.ID_MARCA = %s")
+        params.append(id_marca)
+
+    if _filtro_presente(descripcion_vend):
+        ranked_join_parts.append("JOIN vendedor ve_sub ON v.ID_VEND = ve_sub.ID_VEND")
+        ranked_where_parts.append("ve_sub.DESCRIPCION_VEND = %s")
+        params.append(descripcion_vend)
+
+    # Los filtros de ubicación se repiten como semi-join dentro de la CTE para que
+    # solo se numeren las ventas de los clientes del departamento/ciudad elegidos.
+    pv_where_parts = []
+    pv_params = []
+    if _filtro_presente(id_dpto):
+        pv_where_parts.append("pv_sub.ID_DPTO = %s")
+        pv_params.append(id_dpto)
+
+    if _filtro_presente(id_ciudad):
+        pv_where_parts.append("pv_sub.ID_CIUDAD = %s")
+        pv_params.append(id_ciudad)
+
+    if pv_where_parts:
+        ranked_where_parts.append(
+            f"v.ID_CLIENTE IN (SELECT pv_sub.ID_CLIENTE FROM puntos_venta pv_sub WHERE {' AND '.join(pv_where_parts)})"
+        )
+        params.extend(pv_params)
+
+    ranked_where_clause = " AND ".join(ranked_where_parts)
+    ranked_joins_clause = " ".join(ranked_join_parts)
+
+    cte_definition = f"""
+        WITH ventas_preventa_1_numeradas AS (
+            SELECT
+                v.ID_CLIENTE,
+                v.FECHA,
+                v.ID_VEND,
+                v.PREVENTA,
+                v.ID_MARCA,
+                v.ID_CATEGORIA,
+                ROW_NUMBER() OVER (
+                    PARTITION BY v.ID_CLIENTE
+                    ORDER BY v.FECHA DESC, v.ID_MARCA, v.ID_VEND, v.ID_CATEGORIA
+                ) AS RN
+            FROM ventas v
+            {ranked_joins_clause}
+            WHERE {ranked_where_clause}
+        )
+    """
+
+    main_where_parts = ["uv.RN = 1", "pv.LATITUD IS NOT NULL", "pv.LONGITUD IS NOT NULL", "pv.LATITUD != ''", "pv.LONGITUD != ''"]
+
+    if _filtro_presente(id_dpto):
+        main_where_parts.append("pv.ID_DPTO = %s")
+        params.append(id_dpto)
+
+    if _filtro_presente(id_ciudad):
+        main_where_parts.append("pv.ID_CIUDAD = %s")
+        params.append(id_ciudad)
+
+    final_where_clause = " AND ".join(main_where_parts)
+
+    full_query = f"""
+        {cte_definition}
+        SELECT
+            pv.ID_CLIENTE,
+            pv.DESCRIPCION_CLIENTE,
+            pv.LATITUD,
+            pv.LONGITUD,
+            uv.FECHA AS ULTIMA_VENTA,
+            uv.ID_VEND,
+            ve.DESCRIPCION_VEND,
+            m.DESCRIPCION_MARCA,
+            uv.PREVENTA,
+            uv.ID_MARCA,
+            uv.ID_CATEGORIA,
+            cat.DESCRIPCION_CATEGORIA,
+            dpto.DESCRIPCION_DPTO,
+            ciu.DESCRIPCION_CIUDAD
+        FROM puntos_venta pv
+        JOIN ventas_preventa_1_numeradas uv ON pv.ID_CLIENTE = uv.ID_CLIENTE
+        LEFT JOIN vendedor ve ON uv.ID_VEND = ve.ID_VEND
+        LEFT JOIN marca m ON uv.ID_MARCA = m.ID_MARCA
+        LEFT JOIN categoria cat ON uv.ID_CATEGORIA = cat.ID_CATEGORIA
+        LEFT JOIN departamento dpto ON pv.ID_DPTO = dpto.ID_DPTO
+        LEFT JOIN ciudad ciu ON pv.ID_CIUDAD = ciu.ID_CIUDAD
+        WHERE {final_where_clause}
+        ORDER BY pv.ID_CLIENTE;
+    """
+    return full_query, params
+
+# ROW_NUMBER() OVER (...) y WITH requieren MySQL 8.0+ o MariaDB 10.2+. En servidores más viejos
+# se usa la estrategia original MAX(FECHA) + JOIN.
+VERSION_MINIMA_FUNCIONES_VENTANA = {'mysql': (8, 0), 'mariadb': (10, 2)}
+
+def soporta_funciones_ventana(conexion):
+    """
+    True si el servidor de 'conexion' admite funciones de ventana (ROW_NUMBER), según la versión
+    que informó al conectarse (no ejecuta consultas). False si no se puede determinar.
+    """
+    try:
+        version = str(conexion.get_server_info())
+    except Exception:
+        return False
+    motor = 'mariadb' if 'mariadb' in version.lower() else 'mysql'
+    if motor == 'mariadb' and version.startswith('5.5.5-'):
+        version = version[len('5.5.5-'):]  # Prefijo de compatibilidad que MariaDB antepone a su versión
+    coincidencia = re.match(r'(\d+)\.(\d+)', version)
+    if not coincidencia:
+        return False
+    return (int(coincidencia.group(1)), int(coincidencia.group(2))) >= VERSION_MINIMA_FUNCIONES_VENTANA[motor]
+
+def _resolver_estrategia(conexion, usar_row_number):
+    """usar_row_number=None: ROW_NUMBER si el servidor lo admite, si no MAX+JOIN."""
+    if usar_row_number is None:
+        return soporta_funciones_ventana(conexion)
+    return usar_row_number
+
+def build_points_preventa_1_query(id_categoria=None, id_marca=None, descripcion_vend=None, id_dpto=None, id_ciudad=None, usar_row_number=False):
+    """
+    Retorna (consulta, parámetros) para los puntos PREVENTA=1 según la estrategia elegida:
+    ROW_NUMBER() (una fila por cliente, MySQL 8.0+ / MariaDB 10.2+) o la CTE con MAX(FECHA) + JOIN
+    (estrategia original, por defecto).
+    """
+    builder = build_points_preventa_1_query_row_number if usar_row_number else build_points_preventa_1_query_max_join
+    return builder(id_categoria=id_categoria, id_marca=id_marca, descripcion_vend=descripcion_vend, id_dpto=id_dpto, id_ciudad=id_ciudad)
+
+def fetch_points_with_last_sale_preventa_1(conexion, id_categoria=None, id_marca=None, descripcion_vend=None, id_dpto=None, id_ciudad=None, usar_row_number=None):
+    """
+    Recupera puntos de venta con la última venta de 'PREVENTA = 1', aplicando varios filtros.
+    Con usar_row_number=True devuelve exactamente una fila por cliente usando ROW_NUMBER();
+    con False usa la CTE original con MAX(FECHA) + JOIN de vuelta a 'ventas'. Con None (por defecto)
+    usa ROW_NUMBER solo si el servidor admite funciones de ventana (soporta_funciones_ventana).
+    """
+    usar_row_number = _resolver_estrategia(conexion, usar_row_number)
+    try:
+        with conexion.cursor(pymysql.cursors.DictCursor) as cursor:
+            full_query, params = build_points_preventa_1_query(
+                id_categoria=id_categoria,
+                id_marca=id_marca,
+                descripcion_vend=descripcion_vend,
+                id_dpto=id_dpto,
+                id_ciudad=id_ciudad,
+                usar_row_number=usar_row_number
+            )
+
+            estrategia = "ROW_NUMBER" if usar_row_number else "MAX+JOIN"
+            print(f"\n--- Consulta SQL generada para PREVENTA=1 ({estrategia}) ---")
             print(full_query)
             print(f"Parámetros de la consulta: {params}")
             print("---------------------------------------------")
@@ -271,40 +462,202 @@ def fetch_points_with_last_sale_preventa_1(conexion, id_categoria=None, id_marca
         print(f"Error al recuperar puntos con última venta (PREVENTA=1) filtrada: {e}")
         return []
 
-def fetch_points_with_last_sale_preventa_no_1(conexion, ids_marcas=None):
+def compare_preventa_1_strategies(conexion, repeticiones=3, **filtros):
+    """
+    Ejecuta ambas estrategias de PREVENTA=1 (MAX+JOIN y ROW_NUMBER) sobre los mismos datos
+    y filtros, 'repeticiones' veces cada una, e imprime una comparación lado a lado.
+    Retorna un diccionario con tiempos (mínimo y promedio), filas y clientes únicos por estrategia.
+    """
+    resultados = {}
+    for nombre, usar_row_number in (("max_join", False), ("row_number", True)):
+        if usar_row_number and not soporta_funciones_ventana(conexion):
+            print(f"Advertencia: El servidor no admite ROW_NUMBER() (requiere MySQL 8.0+ / MariaDB 10.2+), se omite {nombre}.")
+            resultados[nombre] = {"error": "funciones de ventana no disponibles"}
+            continue
+        query, params = build_points_preventa_1_query(usar_row_number=usar_row_number, **filtros)
+        tiempos = []
+        filas = []
+        try:
+            for _ in range(repeticiones):
+                with conexion.cursor(pymysql.cursors.DictCursor) as cursor:
+                    inicio = time.perf_counter()
+                    cursor.execute(query, tuple(params))
+                    filas = cursor.fetchall()
+                    tiempos.append(time.perf_counter() - inicio)
+        except Exception as e:
+            print(f"Error al medir la estrategia {nombre}: {e}")
+            resultados[nombre] = {"error": str(e)}
+            continue
+
+        resultados[nombre] = {
+            "min_segundos": min(tiempos),
+            "promedio_segundos": sum(tiempos) / len(tiempos),
+            "filas": len(filas),
+            "clientes_unicos": len({fila['ID_CLIENTE'] for fila in filas}),
+        }
+
+    print("\n--- Comparación de estrategias PREVENTA=1 ---")
+    print(f"Filtros: {filtros} | Repeticiones: {repeticiones}")
+    print(f"{'Estrategia':<12} {'Mín (s)':>10} {'Prom (s)':>10} {'Filas':>10} {'Clientes':>10}")
+    for nombre, r in resultados.items():
+        if "error" in r:
+            print(f"{nombre:<12} ERROR: {r['error']}")
+        else:
+            print(f"{nombre:<12} {r['min_segundos']:>10.4f} {r['promedio_segundos']:>10.4f} {r['filas']:>10} {r['clientes_unicos']:>10}")
+    print("---------------------------------------------")
+    return resultados
+
+def build_clientes_preventa_1_condition(columna_cliente, id_categoria=None, id_marca=None, descripcion_vend=None, id_dpto=None, id_ciudad=None):
+    """
+    Construye una condición sobre 'columna_cliente' que deja solo los clientes que devolvería la
+    consulta de PREVENTA=1 para los mismos filtros (clientes con coordenadas y al menos una venta
+    PREVENTA=1 que cumple los filtros de venta y de ubicación). Retorna (condición, parámetros).
+    Son EXISTS correlacionados: cada línea en tránsito se verifica por ID_CLIENTE contra
+    puntos_venta y ventas, en lugar de recorrer 'ventas' para armar el conjunto de clientes en
+    cada consulta. Sin filtros de venta no se consulta 'ventas' más que para ver si el cliente
+    tiene alguna venta PREVENTA=1.
+    """
+    params = []
+    pv_where_parts = [
+        f"pv_c.ID_CLIENTE = {columna_cliente}",
+        "pv_c.LATITUD IS NOT NULL", "pv_c.LONGITUD IS NOT NULL", "pv_c.LATITUD != ''", "pv_c.LONGITUD != ''"
+    ]
+    if _filtro_presente(id_dpto):
+        pv_where_parts.append("pv_c.ID_DPTO = %s")
+        params.append(id_dpto)
+
+    if _filtro_presente(id_ciudad):
+        pv_where_parts.append("pv_c.ID_CIUDAD = %s")
+        params.append(id_ciudad)
+
+    joins = []
+    v_where_parts = [f"v_c.ID_CLIENTE = {columna_cliente}", "v_c.PREVENTA = 1"]
+    if _filtro_presente(id_categoria):
+        v_where_parts.append("v_c.ID_CATEGORIA = %s")
+        params.append(id_categoria)
+
+    if _filtro_presente(id_marca):
+        v_where_parts.append("v_c.ID_MARCA = %s")
+        params.append(id_marca)
+
+    if _filtro_presente(descripcion_vend):
+        joins.append("JOIN vendedor ve_c ON v_c.ID_VEND = ve_c.ID_VEND")
+        v_where_parts.append("ve_c.DESCRIPCION_VEND = %s")
+        params.append(descripcion_vend)
+
+    condicion = f"""
+        EXISTS (SELECT 1 FROM puntos_venta pv_c WHERE {" AND ".join(pv_where_parts)})
+        AND EXISTS (
+            SELECT 1 FROM ventas v_c
+            {" ".join(joins)}
+            WHERE {" AND ".join(v_where_parts)}
+        )
+    """
+    return condicion, params
+
+def _build_transito_where(ids_marcas=None, filtros_preventa_1=None):
+    """
+    Construye las condiciones adicionales (sobre el alias 'v' de ventas) comunes a las consultas
+    de mercadería en tránsito. Retorna (condiciones_sql, parámetros).
+    El filtro de marca de PREVENTA=1 solo elige clientes: sus líneas en tránsito son de todas las
+    marcas, como en la consulta original (los popups las muestran todas). Para limitarlas a
+    marcas se usa 'ids_marcas'.
+    """
+    condiciones = ""
+    params = []
+    if ids_marcas is not None:
+        if ids_marcas:
+            placeholders = ", ".join(["%s"] * len(ids_marcas))
+            condiciones += f" AND v.ID_MARCA IN ({placeholders})"
+            params.extend(ids_marcas)
+        else:
+            condiciones += " AND 1=0" # Asegura que no se devuelvan resultados si no hay marcas
+
+    if filtros_preventa_1 is not None:
+        condicion, sub_params = build_clientes_preventa_1_condition(
+            "v.ID_CLIENTE",
+            id_categoria=filtros_preventa_1.get('id_categoria'),
+            id_marca=filtros_preventa_1.get('id_marca'),
+            descripcion_vend=filtros_preventa_1.get('descripcion_vend'),
+            id_dpto=filtros_preventa_1.get('id_dpto'),
+            id_ciudad=filtros_preventa_1.get('id_ciudad')
+        )
+        condiciones += f" AND {condicion}"
+        params.extend(sub_params)
+
+    return condiciones, params
+
+def build_points_preventa_no_1_query(ids_marcas=None, filtros_preventa_1=None):
+    """
+    Construye la consulta de ventas en tránsito/programadas (PREVENTA 2 o 3). Retorna (consulta, parámetros).
+    - ids_marcas: lista de ID_MARCA a incluir (None = todas, lista vacía = ninguna).
+    - filtros_preventa_1: diccionario con los filtros de la consulta PREVENTA=1 (id_categoria, id_marca,
+      descripcion_vend, id_dpto, id_ciudad). Si se indica, la consulta se limita en el servidor a los
+      clientes de ese resultado (EXISTS por cliente); sus líneas se traen de todas las marcas.
+    """
+    condiciones, params = _build_transito_where(ids_marcas=ids_marcas, filtros_preventa_1=filtros_preventa_1)
+    query = f"""
+        SELECT
+            v.ID_CLIENTE,
+            v.FECHA,
+            CASE
+                WHEN v.PREVENTA = 2 THEN 'PREVENTA'
+                WHEN v.PREVENTA = 3 THEN 'PROGRAMADO'
+            END AS TIPO,
+            m.DESCRIPCION_MARCA AS MARCA,
+            v.CANTIDAD
+        FROM ventas v
+        LEFT JOIN marca m ON v.ID_MARCA = m.ID_MARCA
+        WHERE v.PREVENTA IN (2, 3)
+            AND v.CANTIDAD > 0
+            {condiciones}
+        ORDER BY v.ID_CLIENTE, v.FECHA DESC;
+    """
+    return query, params
+
+def build_points_preventa_no_1_aggregated_query(ids_marcas=None, filtros_preventa_1=None):
+    """
+    Igual que build_points_preventa_no_1_query pero agrupado en el servidor: una fila por cliente
+    con CANTIDAD_LINEAS (conteo de líneas en tránsito) y LINEAS (JSON_ARRAYAGG con FECHA, TIPO,
+    MARCA, ID_MARCA y CANTIDAD de cada línea). Retorna (consulta, parámetros).
+    """
+    condiciones, params = _build_transito_where(ids_marcas=ids_marcas, filtros_preventa_1=filtros_preventa_1)
+    # FECHA y CANTIDAD se envían como texto para que el popup las muestre igual que en la consulta detallada.
+    query = f"""
+        SELECT
+            v.ID_CLIENTE,
+            COUNT(*) AS CANTIDAD_LINEAS,
+            JSON_ARRAYAGG(JSON_OBJECT(
+                'FECHA', CAST(v.FECHA AS CHAR),
+                'TIPO', CASE
+                            WHEN v.PREVENTA = 2 THEN 'PREVENTA'
+                            WHEN v.PREVENTA = 3 THEN 'PROGRAMADO'
+                        END,
+                'MARCA', m.DESCRIPCION_MARCA,
+                'ID_MARCA', v.ID_MARCA,
+                'CANTIDAD', CAST(v.CANTIDAD AS CHAR)
+            )) AS LINEAS
+        FROM ventas v
+        LEFT JOIN marca m ON v.ID_MARCA = m.ID_MARCA
+        WHERE v.PREVENTA IN (2, 3)
+            AND v.CANTIDAD > 0
+            {condiciones}
+        GROUP BY v.ID_CLIENTE
+        ORDER BY v.ID_CLIENTE;
+    """
+    return query, params
+
+def fetch_points_with_last_sale_preventa_no_1(conexion, ids_marcas=None, filtros_preventa_1=None):
     """
     Recupera puntos de venta con 'PREVENTA' diferente de 1 (2 o 3),
     utilizado para identificar mercadería en tránsito o programada.
+    Con 'filtros_preventa_1' solo se traen las filas de los clientes que devuelve la consulta
+    PREVENTA=1 con esos filtros, así la transferencia crece con el resultado filtrado.
     """
     try:
         with conexion.cursor(pymysql.cursors.DictCursor) as cursor:
-            query = """
-                SELECT
-                    v.ID_CLIENTE,
-                    v.FECHA,
-                    CASE
-                        WHEN v.PREVENTA = 2 THEN 'PREVENTA'
-                        WHEN v.PREVENTA = 3 THEN 'PROGRAMADO'
-                    END AS TIPO,
-                    m.DESCRIPCION_MARCA AS MARCA,
-                    v.CANTIDAD
-                FROM ventas v
-                LEFT JOIN marca m ON v.ID_MARCA = m.ID_MARCA
-                WHERE v.PREVENTA IN (2, 3)
-                    AND v.CANTIDAD > 0
-            """
+            query, params = build_points_preventa_no_1_query(ids_marcas=ids_marcas, filtros_preventa_1=filtros_preventa_1)
 
-            params = []
-            if ids_marcas is not None:
-                if ids_marcas:
-                    placeholders = ", ".join(["%s"] * len(ids_marcas))
-                    query += f" AND v.ID_MARCA IN ({placeholders})"
-                    params.extend(ids_marcas)
-                else:
-                    query += " AND 1=0" # Asegura que no se devuelvan resultados si no hay marcas
-            
-            query += " ORDER BY v.ID_CLIENTE, v.FECHA DESC;"
-            
             print("\n--- Consulta SQL generada para PREVENTA!=1 (revertida) ---")
             print(query)
             print(f"Parámetros de la consulta: {params}")
@@ -316,4 +669,75 @@ def fetch_points_with_last_sale_preventa_no_1(conexion, ids_marcas=None):
 
     except Exception as e:
         print(f"Error al recuperar puntos con ventas en tránsito (PREVENTA ≠ 1): {e}")
-        return []
\ No newline at end of file
+        return []
+
+
+def fetch_points_preventa_no_1_aggregated(conexion, ids_marcas=None, filtros_preventa_1=None):
+    """
+    Variante agrupada de fetch_points_with_last_sale_preventa_no_1: devuelve una fila por cliente
+    con CANTIDAD_LINEAS y LINEAS (JSON sin parsear). La forma del punto (círculo/diamante) se decide
+    con el conteo; las líneas solo se expanden cuando se arma el popup.
+    """
+    try:
+        with conexion.cursor(pymysql.cursors.DictCursor) as cursor:
+            query, params = build_points_preventa_no_1_aggregated_query(ids_marcas=ids_marcas, filtros_preventa_1=filtros_preventa_1)
+
+            print("\n--- Consulta SQL generada para PREVENTA!=1 (agrupada por cliente) ---")
+            print(query)
+            print(f"Parámetros de la consulta: {params}")
+            print("---------------------------------------------")
+
+            cursor.execute(query, tuple(params))
+            return cursor.fetchall()
+
+    except Exception as e:
+        print(f"Error al recuperar ventas en tránsito agrupadas por cliente (PREVENTA ≠ 1): {e}")
+        return []
+
+# --- VARIANTES EN STREAMING (cursor sin buffer) ---
+# Con SSDictCursor las filas se leen del socket a medida que se consumen, en lotes de 'batch_size'
+# (fetchmany), en lugar de cargar todo el resultado con fetchall(). Mientras un generador no se
+# agote, la conexión queda ocupada: no se puede ejecutar otra consulta sobre ella.
+# A diferencia de las variantes fetch_*, un error a mitad de la lectura se propaga: el consumidor ya
+# recibió parte de las filas y un resultado vacío o parcial no debe tomarse como completo (ni cachearse).
+
+STREAM_BATCH_SIZE = 2000
+
+def _stream_query(conexion, query, params, batch_size, descripcion):
+    try:
+        with conexion.cursor(pymysql.cursors.SSDictCursor) as cursor:
+            cursor.execute(query, tuple(params))
+            while True:
+                lote = cursor.fetchmany(batch_size)
+                if not lote:
+                    break
+                yield from lote
+    except Exception as e:
+        print(f"Error al recuperar {descripcion} en streaming: {e}")
+        raise
+
+def stream_points_with_last_sale_preventa_1(conexion, id_categoria=None, id_marca=None, descripcion_vend=None, id_dpto=None, id_ciudad=None, usar_row_number=None, batch_size=STREAM_BATCH_SIZE):
+    """
+    Generador equivalente a fetch_points_with_last_sale_preventa_1: produce las filas una a una,
+    leyéndolas del servidor en lotes de 'batch_size'.
+    """
+    usar_row_number = _resolver_estrategia(conexion, usar_row_number)
+    query, params = build_points_preventa_1_query(
+        id_categoria=id_categoria,
+        id_marca=id_marca,
+        descripcion_vend=descripcion_vend,
+        id_dpto=id_dpto,
+        id_ciudad=id_ciudad,
+        usar_row_number=usar_row_number
+    )
+    yield from _stream_query(conexion, query, params, batch_size, "puntos con última venta (PREVENTA=1)")
+
+def stream_points_with_last_sale_preventa_no_1(conexion, ids_marcas=None, filtros_preventa_1=None, batch_size=STREAM_BATCH_SIZE):
+    """Generador equivalente a fetch_points_with_last_sale_preventa_no_1 (una fila por línea en tránsito)."""
+    query, params = build_points_preventa_no_1_query(ids_marcas=ids_marcas, filtros_preventa_1=filtros_preventa_1)
+    yield from _stream_query(conexion, query, params, batch_size, "ventas en tránsito (PREVENTA ≠ 1)")
+
+def stream_points_preventa_no_1_aggregated(conexion, ids_marcas=None, filtros_preventa_1=None, batch_size=STREAM_BATCH_SIZE):
+    """Generador equivalente a fetch_points_preventa_no_1_aggregated (una fila por cliente)."""
+    query, params = build_points_preventa_no_1_aggregated_query(ids_marcas=ids_marcas, filtros_preventa_1=filtros_preventa_1)
+    yield from _stream_query(conexion, query, params, batch_size, "ventas en tránsito agrupadas por cliente")
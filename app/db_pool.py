@@ -0,0 +1,277 @@
+# app/db_pool.py
+
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+
+from app.database import connect_to_database, close_database_connection, load_db_config
+
+# Pool de conexiones pymysql compartido por la app PyQt (Bridge, DataWorker),
+# el FilterManager y la app de Streamlit. Evita el handshake de conexión en cada
+# cambio de dropdown y permite que varias sesiones ejecuten consultas en paralelo.
+
+DEFAULT_MAX_SIZE = 5
+DEFAULT_IDLE_TIMEOUT = 300     # Segundos sin uso tras los cuales una conexión libre se cierra
+DEFAULT_PING_INTERVAL = 30     # Segundos sin uso tras los cuales se verifica la conexión antes de entregarla
+DEFAULT_CHECKOUT_TIMEOUT = 10  # Segundos máximos de espera cuando todas las conexiones están en uso
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones thread-safe con checkout/release, tamaño máximo,
+    desalojo de conexiones inactivas, ping de salud y contadores de tiempo por checkout.
+    """
+
+    def __init__(self, db_config, max_size=DEFAULT_MAX_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 ping_interval=DEFAULT_PING_INTERVAL, checkout_timeout=DEFAULT_CHECKOUT_TIMEOUT):
+        self.db_config = db_config
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.checkout_timeout = checkout_timeout
+
+        self._lock = threading.Condition()
+        self._idle = []          # Lista de (conexion, instante_de_liberacion), la más reciente al final
+        self._in_use = {}        # id(conexion) -> instante_de_checkout
+        self._closed = False
+
+        self._stats = {
+            'checkouts': 0,
+            'checkout_failures': 0,
+            'connections_created': 0,
+            'connections_closed': 0,
+            'idle_evictions': 0,
+            'ping_failures': 0,
+            'total_wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+            'total_hold_seconds': 0.0,
+            'max_hold_seconds': 0.0,
+        }
+
+    # --- Creación y verificación de conexiones ---
+
+    def _create_connection(self):
+        conexion = connect_to_database(self.db_config)
+        if conexion is None:
+            return None
+        try:
+            # Con autocommit cada SELECT ve los datos más recientes; sin él, la conexión
+            # reutilizada quedaría atada a la instantánea de su primera transacción.
+            conexion.autocommit(True)
+        except pymysql.MySQLError as e:
+            print(f"Advertencia: No se pudo activar autocommit en la conexión del pool: {e}")
+        return conexion
+
+    def _is_healthy(self, conexion, released_at):
+        if time.monotonic() - released_at < self.ping_interval:
+            return True
+        try:
+            conexion.ping(reconnect=False)
+            return True
+        except Exception as e:
+            print(f"Advertencia: Conexión del pool no responde al ping, se descarta: {e}")
+            with self._lock:
+                self._stats['ping_failures'] += 1
+            return False
+
+    def _discard(self, conexion):
+        close_database_connection(conexion)
+        with self._lock:
+            self._stats['connections_closed'] += 1
+
+    def _pop_expired_locked(self):
+        """Quita de la lista de libres las conexiones inactivas por más de idle_timeout (requiere el lock)."""
+        ahora = time.monotonic()
+        vigentes = []
+        expiradas = []
+        for conexion, released_at in self._idle:
+            if ahora - released_at > self.idle_timeout:
+                expiradas.append(conexion)
+            else:
+                vigentes.append((conexion, released_at))
+        self._idle = vigentes
+        self._stats['idle_evictions'] += len(expiradas)
+        return expiradas
+
+    # --- API pública ---
+
+    def checkout(self, timeout=None):
+        """
+        Obtiene una conexión del pool. Reutiliza una libre si existe, crea una nueva si
+        no se alcanzó max_size, o espera hasta 'timeout' segundos a que se libere una.
+        Retorna None si no se pudo obtener una conexión (igual que connect_to_database).
+        """
+        timeout = self.checkout_timeout if timeout is None else timeout
+        inicio = time.monotonic()
+        limite = inicio + timeout
+        expiradas = []
+
+        while True:
+            candidata = None
+            with self._lock:
+                if self._closed:
+                    print("Error: Se intentó obtener una conexión de un pool cerrado.")
+                    self._stats['checkout_failures'] += 1
+                    return None
+
+                expiradas.extend(self._pop_expired_locked())
+
+                if self._idle:
+                    candidata, released_at = self._idle.pop()
+                elif len(self._in_use) >= self.max_size:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        self._stats['checkout_failures'] += 1
+                        print(f"Error: Tiempo de espera agotado ({timeout}s) esperando una conexión libre del pool.")
+                        break
+                    self._lock.wait(restante)
+                    continue
+
+                # Reservar el lugar mientras se crea o verifica la conexión fuera del lock
+                reserva = object()
+                self._in_use[id(reserva)] = inicio
+
+            for conexion in expiradas:
+                self._discard(conexion)
+            expiradas = []
+
+            conexion = None
+            if candidata is not None and self._is_healthy(candidata, released_at):
+                conexion = candidata
+            else:
+                if candidata is not None:
+                    self._discard(candidata)
+                conexion = self._create_connection()
+                if conexion is not None:
+                    with self._lock:
+                        self._stats['connections_created'] += 1
+
+            with self._lock:
+                del self._in_use[id(reserva)]
+                if conexion is None:
+                    # No se pudo crear (o reponer) la conexión: connect_to_database ya informó el error
+                    self._stats['checkout_failures'] += 1
+                    self._lock.notify()
+                    return None
+
+                espera = time.monotonic() - inicio
+                self._in_use[id(conexion)] = time.monotonic()
+                self._stats['checkouts'] += 1
+                self._stats['total_wait_seconds'] += espera
+                self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], espera)
+                return conexion
+
+        for conexion in expiradas:
+            self._discard(conexion)
+        return None
+
+    def release(self, conexion, discard=False):
+        """
+        Devuelve una conexión al pool. Si 'discard' es True (por ejemplo tras un error de red)
+        la conexión se cierra en lugar de reutilizarse.
+        """
+        if conexion is None:
+            return
+        with self._lock:
+            checkout_at = self._in_use.pop(id(conexion), None)
+            if checkout_at is not None:
+                retenida = time.monotonic() - checkout_at
+                self._stats['total_hold_seconds'] += retenida
+                self._stats['max_hold_seconds'] = max(self._stats['max_hold_seconds'], retenida)
+
+            reutilizar = not discard and not self._closed and getattr(conexion, 'open', True)
+            if reutilizar:
+                self._idle.append((conexion, time.monotonic()))
+            self._lock.notify()
+
+        if not reutilizar:
+            self._discard(conexion)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Context manager que entrega una conexión del pool (o None si no se pudo obtener)
+        y la devuelve al salir. Las conexiones que fallan con un error operacional se descartan.
+        """
+        conexion = self.checkout(timeout=timeout)
+        discard = False
+        try:
+            yield conexion
+        except pymysql.OperationalError:
+            discard = True
+            raise
+        finally:
+            if conexion is not None:
+                self.release(conexion, discard=discard)
+
+    def evict_idle(self):
+        """Cierra las conexiones libres que superaron idle_timeout. Retorna cuántas se cerraron."""
+        with self._lock:
+            expiradas = self._pop_expired_locked()
+        for conexion in expiradas:
+            self._discard(conexion)
+        return len(expiradas)
+
+    def stats(self):
+        """Retorna una copia de los contadores del pool, con promedios por checkout."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = len(self._in_use)
+            stats['max_size'] = self.max_size
+        checkouts = stats['checkouts']
+        stats['avg_wait_seconds'] = stats['total_wait_seconds'] / checkouts if checkouts else 0.0
+        stats['avg_hold_seconds'] = stats['total_hold_seconds'] / checkouts if checkouts else 0.0
+        return stats
+
+    def close_all(self):
+        """Cierra todas las conexiones libres y marca el pool como cerrado."""
+        with self._lock:
+            self._closed = True
+            libres = [conexion for conexion, _ in self._idle]
+            self._idle = []
+            self._lock.notify_all()
+        for conexion in libres:
+            self._discard(conexion)
+
+
+# --- Registro global de pools (uno por configuración de BD) ---
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _config_key(db_config):
+    return (db_config.get('host'), db_config.get('port'), db_config.get('user'), db_config.get('database'))
+
+
+def get_pool(db_config=None, **pool_kwargs):
+    """
+    Retorna el pool compartido para 'db_config', creándolo la primera vez.
+    Si no se pasa configuración se usa app/db_config.json (app de escritorio PyQt).
+    Retorna None si no hay configuración disponible.
+    """
+    if db_config is None:
+        db_config = load_db_config()
+        if db_config is None:
+            return None
+
+    key = _config_key(db_config)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool._closed:
+            print(f"--- [db_pool.py] Creando pool de conexiones para {key[0]}:{key[1]}/{key[3]} ---")
+            pool = ConnectionPool(db_config, **pool_kwargs)
+            _pools[key] = pool
+        return pool
+
+
+def close_all_pools():
+    """Cierra todos los pools registrados (por ejemplo al cerrar la aplicación)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
@@ -0,0 +1,156 @@
+# app/fetch_orchestrator.py
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import database
+
+# Orquestador de las dos consultas de puntos de cada refresco del mapa.
+# PREVENTA=1 y tránsito (PREVENTA 2/3, agrupado por cliente) se ejecutan a la vez, cada una en
+# su propia conexión del pool, así un refresco tarda max(q1, q2) en lugar de q1 + q2.
+#
+# Dependencia de marcas (app PyQt): los diamantes se limitan a las marcas presentes en los
+# círculos. La consulta de tránsito no espera a la de PREVENTA=1: se lanza acotada solo por los
+# filtros (superconjunto, limitado en el servidor a los clientes PREVENTA=1) y, cuando la primera
+# termina, se quitan en Python las líneas cuyas ID_MARCA no aparecen en los círculos.
+
+MAX_WORKERS = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="fetch_mapa")
+        return _executor
+
+
+def _ejecutar_en_conexion(pool, tiempos, clave, funcion, *args, cancelacion=None, **kwargs):
+    """
+    Ejecuta 'funcion(conexion, ...)' en una conexión propia del pool y guarda su duración en tiempos[clave].
+    Con 'cancelacion' (CancelToken de app/load_control.py) la consulta se puede cancelar en el servidor
+    y se lanza LoadCancelled si la carga se canceló antes o durante la consulta.
+    """
+    inicio = time.perf_counter()
+    with pool.connection() as conexion:
+        if conexion is None:
+            raise ConnectionError(f"No se pudo obtener una conexión del pool para la consulta '{clave}'.")
+        if cancelacion is None:
+            resultado = funcion(conexion, *args, **kwargs)
+        else:
+            with cancelacion.consulta(conexion):
+                resultado = funcion(conexion, *args, **kwargs)
+            # Una consulta interrumpida con KILL QUERY retorna [] (database.py captura el error):
+            # ese resultado vacío no debe usarse
+            cancelacion.check()
+    tiempos[clave] = time.perf_counter() - inicio
+    return resultado
+
+
+def _stream_en_conexion(pool, tiempos, clave, funcion, *args, **kwargs):
+    """Igual que _ejecutar_en_conexion pero para un generador stream_*: la conexión se retiene hasta agotarlo."""
+    inicio = time.perf_counter()
+    with pool.connection() as conexion:
+        if conexion is None:
+            raise ConnectionError(f"No se pudo obtener una conexión del pool para la consulta '{clave}'.")
+        yield from funcion(conexion, *args, **kwargs)
+    tiempos[clave] = time.perf_counter() - inicio
+
+
+def restringir_transito_a_marcas(fila_transito, ids_marcas):
+    """
+    Deja en una fila agrupada de tránsito solo las líneas cuya ID_MARCA está en 'ids_marcas'
+    y recalcula CANTIDAD_LINEAS. Retorna None si no queda ninguna línea.
+    """
+    lineas = fila_transito.get('LINEAS') or []
+    if isinstance(lineas, (str, bytes)):
+        lineas = json.loads(lineas)
+    lineas = [linea for linea in lineas if linea.get('ID_MARCA') in ids_marcas]
+    if not lineas:
+        return None
+    fila = dict(fila_transito)
+    fila['LINEAS'] = lineas
+    fila['CANTIDAD_LINEAS'] = len(lineas)
+    return fila
+
+
+def _imprimir_tiempos(tiempos):
+    q1 = tiempos.get('preventa_1', 0.0)
+    q2 = tiempos.get('transito', 0.0)
+    print(f"--- [fetch_orchestrator.py] PREVENTA=1: {q1:.3f}s | Tránsito: {q2:.3f}s | "
+          f"Total: {tiempos.get('total', 0.0):.3f}s (secuencial hubiera sido ~{q1 + q2:.3f}s) ---")
+
+
+def fetch_map_rows(pool, filtros, restringir_marcas_a_preventa_1=False, streaming=False, cancelacion=None):
+    """
+    Ejecuta en paralelo las consultas PREVENTA=1 y de tránsito agrupado con los 'filtros'
+    (id_categoria, id_marca, descripcion_vend, id_dpto, id_ciudad).
+
+    Retorna (puntos_preventa_1, puntos_transito, tiempos). 'tiempos' tiene las claves
+    'preventa_1', 'transito' y 'total' (segundos de reloj).
+
+    - restringir_marcas_a_preventa_1: limita el tránsito a las marcas de los círculos (app PyQt).
+    - streaming: PREVENTA=1 se devuelve como generador sin buffer, para consumidores que procesan
+      fila a fila. El tránsito siempre se trae completo en segundo plano (es una fila por cliente).
+      En este modo 'tiempos' se completa cuando el consumidor agota el tránsito, que se lee después
+      de PREVENTA=1, y un error de MySQL a mitad de la lectura se propaga al consumidor.
+    - cancelacion: CancelToken (app/load_control.py) de la carga (app PyQt). Si se cancela, las
+      consultas en curso reciben KILL QUERY y se lanza LoadCancelled. En modo streaming solo
+      se aplica a la consulta de tránsito.
+
+    Lanza ConnectionError si el pool no entrega conexión para alguna de las consultas.
+    """
+    inicio = time.perf_counter()
+    tiempos = {}
+    executor = _get_executor()
+
+    futuro_transito = executor.submit(
+        _ejecutar_en_conexion, pool, tiempos, 'transito',
+        database.fetch_points_preventa_no_1_aggregated,
+        ids_marcas=None, filtros_preventa_1=filtros, cancelacion=cancelacion
+    )
+
+    if not streaming:
+        futuro_preventa_1 = executor.submit(
+            _ejecutar_en_conexion, pool, tiempos, 'preventa_1',
+            database.fetch_points_with_last_sale_preventa_1, cancelacion=cancelacion, **filtros
+        )
+        puntos_preventa_1 = futuro_preventa_1.result()
+        puntos_transito = futuro_transito.result()
+
+        if restringir_marcas_a_preventa_1:
+            ids_marcas = {p.get('ID_MARCA') for p in puntos_preventa_1 if p.get('ID_MARCA') is not None}
+            print(f"- IDs de marcas únicas en PREVENTA=1 para filtrar diamantes: {len(ids_marcas)}")
+            restringidas = (restringir_transito_a_marcas(fila, ids_marcas) for fila in puntos_transito)
+            puntos_transito = [fila for fila in restringidas if fila is not None]
+
+        tiempos['total'] = time.perf_counter() - inicio
+        _imprimir_tiempos(tiempos)
+        return puntos_preventa_1, puntos_transito, tiempos
+
+    ids_marcas_vistas = set()
+
+    def _preventa_1():
+        for fila in _stream_en_conexion(pool, tiempos, 'preventa_1',
+                                        database.stream_points_with_last_sale_preventa_1, **filtros):
+            if fila.get('ID_MARCA') is not None:
+                ids_marcas_vistas.add(fila['ID_MARCA'])
+            yield fila
+
+    def _transito():
+        # Se consume después de agotar PREVENTA=1, así ids_marcas_vistas ya está completo
+        for fila in futuro_transito.result():
+            if restringir_marcas_a_preventa_1:
+                fila = restringir_transito_a_marcas(fila, ids_marcas_vistas)
+                if fila is None:
+                    continue
+            yield fila
+        tiempos['total'] = time.perf_counter() - inicio
+        _imprimir_tiempos(tiempos)
+
+    return _preventa_1(), _transito(), tiempos
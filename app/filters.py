@@ -1,5 +1,13 @@
 # filters.py - Adaptado para Streamlit
 
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
 # Aquí importamos las funciones que ya tienes en app/database.py
 from app.database import (
     fetch_points_with_last_sale_preventa_1,
@@ -8,8 +16,14 @@ from app.database import (
     fetch_marcas, # <--- CAMBIO AQUÍ: Usamos el nombre correcto de fetch_marcas
     fetch_vendedores, # <--- CAMBIO AQUÍ: Usamos el nombre correcto de fetch_vendedores
     fetch_categorias,
-    fetch_departamentos
+    fetch_departamentos,
+    fetch_points_preventa_no_1_aggregated
 )
+from app.color_calculator import calculate_point_records
+from app.db_pool import get_pool
+from app.fetch_orchestrator import restringir_transito_a_marcas
+from app.relation_index import get_relation_index
+from app.snapshot_store import SIN_ID, fetch_dataset_rows
 # Las funciones de color y mapa las importaremos en app.py, no aquí.
 # from app.color_calculator import calculate_colors_and_shapes_for_all_points
 # from app.map_generator import generate_map
@@ -39,10 +53,427 @@ from app.database import (
 # definiremos una clase placeholder simple, o puedes eliminarla
 # si decides no usarla en Streamlit.
 
+# --- Motor de filtros en memoria ---
+# El FilterManager puede guardar una sola vez el dataset sin filtrar: la última fecha PREVENTA=1
+# por (cliente, categoría, marca, vendedor), el mismo nivel de detalle que el snapshot local
+# (app/snapshot_store.py), más las líneas en tránsito. Las filas se ordenan por cliente y fecha
+# descendente, y cada dimensión (categoría, marca, vendedor, departamento, ciudad) tiene un
+# índice de arreglo ordenado: valor -> posiciones de sus filas, en orden. Una combinación de
+# filtros es la intersección de esos arreglos; la primera posición de cada cliente es su última
+# venta con esos filtros (lo mismo que el ROW_NUMBER() de la consulta SQL).
+
+COLORES = ('green', 'orange', 'red', 'black')
+FORMAS = ('circle', 'diamond')
+_SIN_FECHA = np.iinfo(np.int64).min  # Día de las filas sin fecha válida (quedan en negro)
+
+
+def _filtro_presente(valor):
+    return valor is not None and valor != ''
+
+
+def _como_id(valor):
+    """Valor de filtro (entero o texto de un <select>) como entero; None si no es un número."""
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _como_texto(valor):
+    """Fechas y decimales como texto, igual que el CAST(... AS CHAR) de la consulta de tránsito."""
+    if isinstance(valor, (datetime, date, Decimal)):
+        return str(valor)
+    return valor
+
+
+def _sin_id(valor):
+    return None if valor == SIN_ID else valor
+
+
+class SortedArrayIndex:
+    """Índice de una columna entera: para cada valor, las posiciones de sus filas en orden ascendente."""
+
+    def __init__(self, valores):
+        valores = np.asarray(valores, dtype=np.int64)
+        self._orden = np.argsort(valores, kind='stable')
+        self._valores = valores[self._orden]
+
+    def lookup(self, valor):
+        desde = np.searchsorted(self._valores, valor, side='left')
+        hasta = np.searchsorted(self._valores, valor, side='right')
+        return self._orden[desde:hasta]
+
+    def lookup_many(self, valores):
+        partes = [self.lookup(valor) for valor in valores]
+        if not partes:
+            return np.empty(0, dtype=np.int64)
+        return partes[0] if len(partes) == 1 else np.unique(np.concatenate(partes))
+
+    def valores(self):
+        return np.unique(self._valores)
+
+
+class FilterResult:
+    """Resultado de FilterDataset.apply: arreglos paralelos por cliente y las estadísticas."""
+
+    __slots__ = ('filas', 'clientes', 'color', 'shape', 'lineas', 'cantidad_lineas', 'estadisticas', 'segundos')
+
+    def __init__(self, filas, clientes, color, shape, lineas, cantidad_lineas, estadisticas, segundos):
+        self.filas = filas                      # Posición de la última venta de cada cliente
+        self.clientes = clientes                # ID_CLIENTE, ascendente
+        self.color = color                      # Índice en COLORES
+        self.shape = shape                      # Índice en FORMAS
+        self.lineas = lineas                    # Posiciones de las líneas en tránsito que aplican (None: todas)
+        self.cantidad_lineas = cantidad_lineas  # Líneas en tránsito por cliente
+        self.estadisticas = estadisticas
+        self.segundos = segundos
+
+    def __len__(self):
+        return len(self.clientes)
+
+
+class FilterDataset:
+    """
+    Dataset del mapa sin filtrar con índices por dimensión. Se arma con las filas de
+    snapshot_store.fetch_dataset_rows (ventas_p1, transito, puntos, tablas).
+    """
+
+    def __init__(self, ventas_p1, transito, puntos, tablas, version=None):
+        inicio = time.perf_counter()
+        self.version = version  # Versión de los datos con la que se cargó (result_cache.get_data_version)
+        self.descripciones = {
+            tabla: {fila['ID']: fila['DESCRIPCION'] for fila in filas} for tabla, filas in tablas.items()
+        }
+        self.vendedores_por_descripcion = {}
+        for id_vend, descripcion in self.descripciones.get('vendedor', {}).items():
+            self.vendedores_por_descripcion.setdefault(descripcion, []).append(id_vend)
+
+        # Puntos de venta con coordenadas válidas (los demás no aparecen en el mapa)
+        self.puntos = {}
+        for fila in puntos:
+            try:
+                self.puntos[fila['ID_CLIENTE']] = (
+                    fila['DESCRIPCION_CLIENTE'], float(fila['LATITUD']), float(fila['LONGITUD']),
+                    fila['ID_DPTO'], fila['ID_CIUDAD'],
+                )
+            except (TypeError, ValueError):
+                continue
+
+        ventas = [fila for fila in ventas_p1 if fila['ID_CLIENTE'] in self.puntos]
+        fechas = pd.to_datetime(pd.Series([fila['ULTIMA_FECHA'] for fila in ventas], dtype=object), errors='coerce')
+        dias = fechas.dt.normalize().to_numpy(dtype='datetime64[D]').astype(np.int64)
+        dias[fechas.isna().to_numpy()] = _SIN_FECHA
+        # Clave de orden: más reciente primero y las filas sin fecha al final
+        reciente_primero = np.where(fechas.isna().to_numpy(), np.iinfo(np.int64).max,
+                                    -fechas.to_numpy(dtype='datetime64[s]').astype(np.int64))
+        cliente = np.array([fila['ID_CLIENTE'] for fila in ventas], dtype=np.int64)
+        categoria = np.array([fila['ID_CATEGORIA'] for fila in ventas], dtype=np.int64)
+        marca = np.array([fila['ID_MARCA'] for fila in ventas], dtype=np.int64)
+        vendedor = np.array([fila['ID_VEND'] for fila in ventas], dtype=np.int64)
+
+        # Orden por cliente y, dentro del cliente, de la venta más reciente a la más antigua; las
+        # ventas del mismo día se desempatan por marca, vendedor y categoría, como el ROW_NUMBER()
+        orden = np.lexsort((categoria, vendedor, marca, reciente_primero, cliente))
+        ventas = [ventas[i] for i in orden]
+        self.cliente = cliente[orden]
+        self.dia = dias[orden]
+        self.fecha = [fila['ULTIMA_FECHA'] for fila in ventas]
+        self.categoria = categoria[orden]
+        self.marca = marca[orden]
+        self.vendedor = vendedor[orden]
+        self.dpto = np.array([SIN_ID if self.puntos[c][3] is None else self.puntos[c][3] for c in self.cliente], dtype=np.int64)
+        self.ciudad = np.array([SIN_ID if self.puntos[c][4] is None else self.puntos[c][4] for c in self.cliente], dtype=np.int64)
+
+        self.indices = {
+            'id_categoria': SortedArrayIndex(self.categoria),
+            'id_marca': SortedArrayIndex(self.marca),
+            'id_vend': SortedArrayIndex(self.vendedor),
+            'id_dpto': SortedArrayIndex(self.dpto),
+            'id_ciudad': SortedArrayIndex(self.ciudad),
+        }
+        self._todas = np.arange(len(self.cliente), dtype=np.int64)
+        self._ultimas = self._primera_de_cada_cliente(self._todas)  # Resultado sin filtros
+        self._colores = (None, None)  # (hoy, color de cada fila para ese día)
+
+        # Líneas en tránsito ordenadas por cliente (para ubicar las de cada cliente con searchsorted)
+        transito = sorted((fila for fila in transito if fila['ID_CLIENTE'] is not None), key=lambda fila: fila['ID_CLIENTE'])
+        self.transito_cliente = np.array([fila['ID_CLIENTE'] for fila in transito], dtype=np.int64)
+        self.transito_marca = np.array([SIN_ID if fila['ID_MARCA'] is None else fila['ID_MARCA'] for fila in transito], dtype=np.int64)
+        self.transito_lineas = [
+            {'FECHA': _como_texto(fila['FECHA']), 'TIPO': fila['TIPO'], 'MARCA': fila['MARCA'],
+             'ID_MARCA': fila['ID_MARCA'], 'CANTIDAD': _como_texto(fila['CANTIDAD'])}
+            for fila in transito
+        ]
+        # Rango de líneas en tránsito del cliente de cada fila
+        self.transito_desde = np.searchsorted(self.transito_cliente, self.cliente, side='left')
+        self.transito_hasta = np.searchsorted(self.transito_cliente, self.cliente, side='right')
+        print(f"--- [filters.py] Dataset en memoria: {len(self.cliente)} filas PREVENTA=1 de {len(np.unique(self.cliente))} "
+              f"clientes, {len(transito)} líneas en tránsito ({time.perf_counter() - inicio:.2f}s) ---")
+
+    def __len__(self):
+        return len(self.cliente)
+
+    def _filas_filtradas(self, filtros):
+        """Posiciones (ascendentes) de las filas que cumplen todos los filtros."""
+        candidatas = []
+        for clave in ('id_categoria', 'id_marca', 'id_dpto', 'id_ciudad'):
+            if _filtro_presente(filtros.get(clave)):
+                valor = _como_id(filtros[clave])
+                candidatas.append(self.indices[clave].lookup(valor) if valor is not None else np.empty(0, dtype=np.int64))
+        if _filtro_presente(filtros.get('descripcion_vend')):
+            ids_vend = self.vendedores_por_descripcion.get(filtros['descripcion_vend'], [])
+            candidatas.append(self.indices['id_vend'].lookup_many(ids_vend))
+        if not candidatas:
+            return self._todas
+        candidatas.sort(key=len)  # Se intersecta empezando por el filtro más selectivo
+        filas = candidatas[0]
+        for otras in candidatas[1:]:
+            if not len(filas):
+                break
+            filas = np.intersect1d(filas, otras, assume_unique=True)
+        return filas
+
+    def _primera_de_cada_cliente(self, filas):
+        """De posiciones ascendentes, la primera de cada cliente: su venta más reciente entre ellas."""
+        clientes = self.cliente[filas]
+        primera = np.ones(len(filas), dtype=bool)
+        primera[1:] = clientes[1:] != clientes[:-1]
+        return filas[primera]
+
+    def _lineas_de(self, filas):
+        """(posiciones de las líneas en tránsito de los clientes de 'filas', índice en 'filas' de cada una)."""
+        desde = self.transito_desde[filas]
+        cantidad = self.transito_hasta[filas] - desde
+        duenio = np.repeat(np.arange(len(filas)), cantidad)
+        lineas = np.arange(int(cantidad.sum()), dtype=np.int64) + np.repeat(desde - (np.cumsum(cantidad) - cantidad), cantidad)
+        return lineas, duenio
+
+    def _color_por_fila(self, hoy):
+        """Índice en COLORES de cada fila según los días desde su venta (se recalcula al cambiar el día)."""
+        dia_calculado, colores = self._colores
+        if dia_calculado != hoy:
+            dias = np.datetime64(hoy, 'D').astype(np.int64) - self.dia
+            colores = np.select([dias <= 30, dias <= 60, dias <= 90], [0, 1, 2], default=3)
+            colores[self.dia == _SIN_FECHA] = 3
+            self._colores = (hoy, colores)
+        return colores
+
+    def apply(self, id_categoria=None, id_marca=None, descripcion_vend=None, id_dpto=None, id_ciudad=None,
+              restringir_marcas_a_preventa_1=False, hoy=None):
+        """
+        Aplica los filtros en memoria. Mismo resultado que las consultas de fetch_map_rows:
+        la última venta PREVENTA=1 de cada cliente que cumple los filtros, sus líneas en tránsito
+        (de todas las marcas o, con restringir_marcas_a_preventa_1, de las marcas de los círculos),
+        color, forma y estadísticas (mismas claves que calculate_statistics).
+        """
+        inicio = time.perf_counter()
+        filtros = {'id_categoria': id_categoria, 'id_marca': id_marca, 'descripcion_vend': descripcion_vend,
+                   'id_dpto': id_dpto, 'id_ciudad': id_ciudad}
+        filas = self._filas_filtradas(filtros)
+        filas = self._ultimas if filas is self._todas else self._primera_de_cada_cliente(filas)
+        clientes = self.cliente[filas]
+
+        if restringir_marcas_a_preventa_1:
+            lineas, duenio = self._lineas_de(filas)
+            marcas = np.unique(self.marca[filas])
+            aplican = np.isin(self.transito_marca[lineas], marcas[marcas != SIN_ID])
+            lineas = lineas[aplican]
+            cantidad_lineas = np.bincount(duenio[aplican], minlength=len(filas))
+        else:
+            # Todas las líneas del cliente aplican: alcanza con el tamaño de su rango
+            lineas = None
+            cantidad_lineas = self.transito_hasta[filas] - self.transito_desde[filas]
+
+        color = self._color_por_fila(hoy or date.today())[filas]
+        shape = (cantidad_lineas > 0).astype(np.int64)
+
+        conteos = np.bincount(shape * len(COLORES) + color, minlength=len(COLORES) * len(FORMAS))
+        estadisticas = {'total_general_clientes': len(clientes)}
+        for f, forma in enumerate(FORMAS):
+            fila = conteos[f * len(COLORES):(f + 1) * len(COLORES)]
+            estadisticas[f'total_{forma}s'] = int(fila.sum())
+            for c, nombre_color in enumerate(COLORES):
+                estadisticas[f'{forma}s_{nombre_color}'] = int(fila[c])
+
+        return FilterResult(filas, clientes, color, shape, lineas, cantidad_lineas, estadisticas,
+                            time.perf_counter() - inicio)
+
+    def rows(self, resultado):
+        """
+        Filas de un FilterResult con las mismas columnas que las consultas SQL:
+        (puntos_preventa_1, puntos_transito_agrupados), listas para color_calculator/map_generator.
+        """
+        desc = self.descripciones
+        puntos_preventa_1 = []
+        for fila in resultado.filas:
+            id_cliente = int(self.cliente[fila])
+            descripcion, latitud, longitud, id_dpto, id_ciudad = self.puntos[id_cliente]
+            id_vend, id_marca, id_categoria = (_sin_id(int(v)) for v in (self.vendedor[fila], self.marca[fila], self.categoria[fila]))
+            puntos_preventa_1.append({
+                'ID_CLIENTE': id_cliente,
+                'DESCRIPCION_CLIENTE': descripcion,
+                'LATITUD': latitud,
+                'LONGITUD': longitud,
+                'ULTIMA_VENTA': self.fecha[fila],
+                'ID_VEND': id_vend,
+                'DESCRIPCION_VEND': desc.get('vendedor', {}).get(id_vend),
+                'DESCRIPCION_MARCA': desc.get('marca', {}).get(id_marca),
+                'PREVENTA': 1,
+                'ID_MARCA': id_marca,
+                'ID_CATEGORIA': id_categoria,
+                'DESCRIPCION_CATEGORIA': desc.get('categoria', {}).get(id_categoria),
+                'DESCRIPCION_DPTO': desc.get('departamento', {}).get(id_dpto),
+                'DESCRIPCION_CIUDAD': desc.get('ciudad', {}).get(id_ciudad),
+            })
+
+        # Las líneas de cada cliente están contiguas en 'lineas', en el orden de los clientes
+        lineas = resultado.lineas if resultado.lineas is not None else self._lineas_de(resultado.filas)[0]
+        desde = np.cumsum(resultado.cantidad_lineas) - resultado.cantidad_lineas
+        puntos_transito = []
+        for i in np.flatnonzero(resultado.cantidad_lineas):
+            inicio, cantidad = int(desde[i]), int(resultado.cantidad_lineas[i])
+            puntos_transito.append({
+                'ID_CLIENTE': int(resultado.clientes[i]),
+                'CANTIDAD_LINEAS': cantidad,
+                'LINEAS': [self.transito_lineas[j] for j in lineas[inicio:inicio + cantidad]],
+            })
+        return puntos_preventa_1, puntos_transito
+
+
 # ASUMIENTO que necesitas una clase llamada FilterManager (si es el caso)
 class FilterManager:
     def __init__(self, db_config):
         self.db_config = db_config
+        # Pool compartido: los métodos piden una conexión prestada en lugar de abrir una nueva
+        self.pool = get_pool(db_config)
+        # Dataset sin filtrar con índices en memoria (ver FilterDataset), con su versión de los datos.
+        # El FilterManager se comparte entre sesiones de Streamlit (st.cache_resource): cada pedido
+        # toma una sola referencia al dataset y la usa de punta a punta, porque una recarga en otra
+        # sesión puede reemplazar self.dataset en cualquier momento.
+        self.dataset = None
+        self._dataset_lock = threading.Lock()
+
+    def _cargar_dataset(self, version):
+        # Se llama con _dataset_lock tomado
+        with self.pool.connection() as conn:
+            if not conn:
+                print("Error: No se pudo obtener una conexión para cargar el dataset de filtros.")
+                return None
+            filas = fetch_dataset_rows(conn)
+        self.dataset = FilterDataset(*filas, version=version)
+        return self.dataset
+
+    def load_dataset(self, version=None):
+        """Trae de MySQL el dataset sin filtrar y arma sus índices. Retorna el FilterDataset o None."""
+        with self._dataset_lock:
+            return self._cargar_dataset(version)
+
+    @staticmethod
+    def _vigente(dataset, version):
+        return dataset is not None and version is not None and dataset.version == version
+
+    def ensure_dataset(self, version):
+        """
+        Retorna el dataset en memoria, cargándolo si todavía no existe o si cambió 'version'
+        (la de result_cache.get_data_version). Retorna None si no se pudo cargar.
+        """
+        dataset = self.dataset
+        if self._vigente(dataset, version):
+            return dataset
+        try:
+            with self._dataset_lock:
+                # Otra sesión pudo cargar esta versión mientras se esperaba el lock
+                dataset = self.dataset
+                if self._vigente(dataset, version):
+                    return dataset
+                return self._cargar_dataset(version)
+        except Exception as e:
+            print(f"Error al cargar el dataset de filtros en memoria: {e}")
+            return None
+
+    def _dataset_a_usar(self, dataset):
+        dataset = dataset if dataset is not None else self.dataset
+        if dataset is None:
+            raise RuntimeError("El dataset de filtros no está cargado (FilterManager.ensure_dataset).")
+        return dataset
+
+    def apply_filters(self, filtros, restringir_marcas_a_preventa_1=False, dataset=None):
+        """
+        Resuelve una combinación de filtros (id_categoria, id_marca, descripcion_vend, id_dpto,
+        id_ciudad) en memoria: FilterResult con los clientes, su color y forma, y las estadísticas.
+        'dataset' es el que retornó ensure_dataset (por defecto, el vigente).
+        """
+        dataset = self._dataset_a_usar(dataset)
+        return dataset.apply(restringir_marcas_a_preventa_1=restringir_marcas_a_preventa_1, **filtros)
+
+    def filter_rows(self, filtros, restringir_marcas_a_preventa_1=False, dataset=None):
+        """
+        Igual que fetch_orchestrator.fetch_map_rows pero en memoria. Retorna
+        (puntos_preventa_1, puntos_transito, resultado) con las mismas columnas que las consultas SQL.
+        Las posiciones de 'resultado' solo valen para el dataset que lo produjo: se usa el mismo
+        para filtrar y para armar las filas.
+        """
+        dataset = self._dataset_a_usar(dataset)
+        resultado = self.apply_filters(filtros, restringir_marcas_a_preventa_1, dataset)
+        puntos_preventa_1, puntos_transito = dataset.rows(resultado)
+        print(f"--- [filters.py] Filtros {filtros} resueltos en memoria: {len(resultado)} clientes en "
+              f"{resultado.segundos * 1000:.3f} ms ---")
+        return puntos_preventa_1, puntos_transito, resultado
+
+    def check_against_sql(self, filtros, restringir_marcas_a_preventa_1=False, dataset=None):
+        """
+        Compara el resultado en memoria con el de las consultas SQL para los mismos filtros:
+        clientes, fecha de la última venta, líneas en tránsito por cliente y estadísticas.
+        Retorna {'coincide': bool, 'diferencias': {...}, 'segundos_sql': s, 'segundos_memoria': s}.
+        """
+        inicio = time.perf_counter()
+        with self.pool.connection() as conn:
+            if not conn:
+                raise ConnectionError("No se pudo obtener una conexión para comparar con SQL.")
+            puntos_sql = fetch_points_with_last_sale_preventa_1(conn, **filtros)
+            transito_sql = fetch_points_preventa_no_1_aggregated(conn, ids_marcas=None, filtros_preventa_1=filtros)
+        if restringir_marcas_a_preventa_1:
+            ids_marcas = {p.get('ID_MARCA') for p in puntos_sql if p.get('ID_MARCA') is not None}
+            restringidas = (restringir_transito_a_marcas(fila, ids_marcas) for fila in transito_sql)
+            transito_sql = [fila for fila in restringidas if fila is not None]
+        segundos_sql = time.perf_counter() - inicio
+
+        dataset = self._dataset_a_usar(dataset)
+        resultado = self.apply_filters(filtros, restringir_marcas_a_preventa_1, dataset)
+        puntos_mem, transito_mem = dataset.rows(resultado)
+
+        def _ultimas_ventas(puntos):
+            fechas = pd.to_datetime(pd.Series([p['ULTIMA_VENTA'] for p in puntos], dtype=object), errors='coerce')
+            return {int(p['ID_CLIENTE']): fecha.date() if not pd.isna(fecha) else None for p, fecha in zip(puntos, fechas)}
+
+        def _lineas(transito):
+            return {int(t['ID_CLIENTE']): int(t['CANTIDAD_LINEAS']) for t in transito if t.get('CANTIDAD_LINEAS')}
+
+        ventas_sql, ventas_mem = _ultimas_ventas(puntos_sql), _ultimas_ventas(puntos_mem)
+        lineas_sql, lineas_mem = _lineas(transito_sql), _lineas(transito_mem)
+        estadisticas_sql = calculate_point_records(puntos_sql, transito_sql).statistics()
+
+        diferencias = {}
+        if set(ventas_sql) != set(ventas_mem):
+            diferencias['clientes'] = {'solo_sql': sorted(set(ventas_sql) - set(ventas_mem)),
+                                       'solo_memoria': sorted(set(ventas_mem) - set(ventas_sql))}
+        fechas_distintas = [c for c in set(ventas_sql) & set(ventas_mem) if ventas_sql[c] != ventas_mem[c]]
+        if fechas_distintas:
+            diferencias['ultima_venta'] = sorted(fechas_distintas)
+        if lineas_sql != lineas_mem:
+            diferencias['transito'] = sorted(c for c in set(lineas_sql) | set(lineas_mem) if lineas_sql.get(c) != lineas_mem.get(c))
+        if estadisticas_sql != resultado.estadisticas:
+            diferencias['estadisticas'] = {'sql': estadisticas_sql, 'memoria': resultado.estadisticas}
+
+        comparacion = {
+            'coincide': not diferencias,
+            'diferencias': diferencias,
+            'segundos_sql': segundos_sql,
+            'segundos_memoria': resultado.segundos,
+        }
+        print(f"--- [filters.py] Memoria vs SQL {filtros}: {'coinciden' if not diferencias else f'DIFIEREN en {list(diferencias)}'} "
+              f"({len(ventas_mem)} clientes; SQL {segundos_sql:.3f}s, memoria {resultado.segundos * 1000:.3f} ms) ---")
+        return comparacion
 
     def get_all_filter_options(self):
         # Esta función conectará a la DB y traerá todas las opciones para los selectbox de Streamlit
@@ -50,38 +481,35 @@ class FilterManager:
 
         @st.cache_data(show_spinner="Cargando opciones de filtro...")
         def _cached_get_options():
-            from app.database import connect_to_database, close_database_connection
+            with self.pool.connection() as conn:
+                if conn:
+                    categorias_raw = fetch_categorias(conn)
+                    marcas_raw = fetch_marcas(conn)
+                    vendedores_raw = fetch_vendedores(conn)
+                    departamentos_raw = fetch_departamentos(conn)
+                    ciudades_raw = fetch_ciudades(conn) # Todas las ciudades sin filtro inicial
 
-            conn = connect_to_database(self.db_config)
-            if conn:
-                categorias_raw = fetch_categorias(conn)
-                marcas_raw = fetch_marcas(conn)
-                vendedores_raw = fetch_vendedores(conn)
-                departamentos_raw = fetch_departamentos(conn)
-                ciudades_raw = fetch_ciudades(conn) # Todas las ciudades sin filtro inicial
-                close_database_connection(conn)
-
-                # Transformar a formato adecuado para selectbox
-                categorias_desc = ["Todas"] + sorted([c[1] for c in categorias_raw])
-                marcas_desc = ["Todas"] + sorted([m[1] for m in marcas_raw])
-                vendedores_desc = ["Todos"] + sorted([v[1] for v in vendedores_raw])
-                departamentos_desc = ["Todos"] + sorted([d[1] for d in departamentos_raw])
-                ciudades_desc = ["Todas"] + sorted([c[1] for c in ciudades_raw])
-
-                return {
-                    "categorias": categorias_desc,
-                    "marcas": marcas_desc,
-                    "vendedores": vendedores_desc,
-                    "departamentos": departamentos_desc,
-                    "ciudades": ciudades_desc,
-                    "raw_data": { # Para mapear ID a descripción si es necesario
-                        "categorias": categorias_raw,
-                        "marcas": marcas_raw,
-                        "vendedores": vendedores_raw,
-                        "departamentos": departamentos_raw,
-                        "ciudades": ciudades_raw
+                    # Transformar a formato adecuado para selectbox
+                    categorias_desc = ["Todas"] + sorted([c[1] for c in categorias_raw])
+                    marcas_desc = ["Todas"] + sorted([m[1] for m in marcas_raw])
+                    vendedores_desc = ["Todos"] + sorted([v[1] for v in vendedores_raw])
+                    departamentos_desc = ["Todos"] + sorted([d[1] for d in departamentos_raw])
+                    ciudades_desc = ["Todas"] + sorted([c[1] for c in ciudades_raw])
+
+                    return {
+                        "categorias": categorias_desc,
+                        "marcas": marcas_desc,
+                        "vendedores": vendedores_desc,
+                        "departamentos": departamentos_desc,
+                        "ciudades": ciudades_desc,
+                        "raw_data": { # Para mapear ID a descripción si es necesario
+                            "categorias": categorias_raw,
+                            "marcas": marcas_raw,
+                            "vendedores": vendedores_raw,
+                            "departamentos": departamentos_raw,
+                            "ciudades": ciudades_raw
+                        }
                     }
-                }
             return {
                 "categorias": [], "marcas": [], "vendedores": [],
                 "departamentos": [], "ciudades": [], "raw_data": {}
@@ -90,29 +518,33 @@ class FilterManager:
 
     # Si necesitas funciones para obtener dependencias (por ejemplo, ciudades por departamento)
     # estas serían llamadas desde app.py cuando cambie un selectbox.
+    # Se sirven del índice de relaciones en memoria (app/relation_index.py) cuando está disponible.
     def get_marcas_by_categoria(self, categoria_id):
-        from app.database import connect_to_database, close_database_connection
-        conn = connect_to_database(self.db_config)
-        if conn:
-            marcas = fetch_marcas(conn, id_categoria=categoria_id)
-            close_database_connection(conn)
-            return ["Todas"] + sorted([m[1] for m in marcas])
+        indice = get_relation_index(self.pool)
+        if indice is not None:
+            return ["Todas"] + sorted([m[1] for m in indice.marcas(categoria_id)])
+        with self.pool.connection() as conn:
+            if conn:
+                marcas = fetch_marcas(conn, id_categoria=categoria_id)
+                return ["Todas"] + sorted([m[1] for m in marcas])
         return ["Todas"]
 
     def get_vendedores_by_categoria(self, categoria_id):
-        from app.database import connect_to_database, close_database_connection
-        conn = connect_to_database(self.db_config)
-        if conn:
-            vendedores = fetch_vendedores(conn, id_categoria=categoria_id)
-            close_database_connection(conn)
-            return ["Todos"] + sorted([v[1] for v in vendedores])
+        indice = get_relation_index(self.pool)
+        if indice is not None:
+            return ["Todos"] + sorted([v[1] for v in indice.vendedores(categoria_id)])
+        with self.pool.connection() as conn:
+            if conn:
+                vendedores = fetch_vendedores(conn, id_categoria=categoria_id)
+                return ["Todos"] + sorted([v[1] for v in vendedores])
         return ["Todos"]
 
     def get_ciudades_by_departamento(self, departamento_id):
-        from app.database import connect_to_database, close_database_connection
-        conn = connect_to_database(self.db_config)
-        if conn:
-            ciudades = fetch_ciudades(conn, id_dpto=departamento_id)
-            close_database_connection(conn)
-            return ["Todas"] + sorted([c[1] for c in ciudades])
+        indice = get_relation_index(self.pool)
+        if indice is not None:
+            return ["Todas"] + sorted([c[1] for c in indice.ciudades(departamento_id)])
+        with self.pool.connection() as conn:
+            if conn:
+                ciudades = fetch_ciudades(conn, id_dpto=departamento_id)
+                return ["Todas"] + sorted([c[1] for c in ciudades])
         return ["Todas"]
\ No newline at end of file
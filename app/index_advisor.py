@@ -0,0 +1,290 @@
+# app/index_advisor.py
+
+import argparse
+import itertools
+import json
+import random
+import time
+from datetime import date, timedelta
+
+import pymysql
+
+from app.database import (
+    connect_to_database,
+    close_database_connection,
+    load_db_config,
+    build_points_preventa_1_query,
+    build_points_preventa_no_1_aggregated_query,
+)
+
+# Asesor de índices para el esquema ventas/puntos_venta.
+# Ejecuta EXPLAIN sobre cada forma de consulta que puede generar fetch_points_with_last_sale_preventa_1
+# (cada combinación de filtros opcionales, con ambas estrategias) y sobre la consulta de tránsito,
+# marca los recorridos completos (type = ALL), propone los índices compuestos que faltan y,
+# con --apply, los crea midiendo los tiempos antes y después.
+#
+# Uso:  python -m app.index_advisor [--apply] [--host ... --database ...] [--seed-clientes N]
+
+FILTROS = ('id_categoria', 'id_marca', 'descripcion_vend', 'id_dpto', 'id_ciudad')
+
+# (tabla, nombre_indice, columnas). El orden de columnas sigue el de los filtros de igualdad
+# primero, luego ID_CLIENTE/FECHA para el GROUP BY / ROW_NUMBER, y al final columnas de cobertura.
+RECOMMENDED_INDEXES = [
+    ("ventas", "idx_ventas_prev_cli_fecha", ("PREVENTA", "ID_CLIENTE", "FECHA", "ID_CATEGORIA", "ID_MARCA", "ID_VEND")),
+    ("ventas", "idx_ventas_prev_cat_marca_cli", ("PREVENTA", "ID_CATEGORIA", "ID_MARCA", "ID_CLIENTE", "FECHA", "ID_VEND")),
+    ("ventas", "idx_ventas_prev_vend_cli", ("PREVENTA", "ID_VEND", "ID_CLIENTE", "FECHA", "ID_CATEGORIA", "ID_MARCA")),
+    ("ventas", "idx_ventas_cat_marca", ("ID_CATEGORIA", "ID_MARCA")),
+    ("ventas", "idx_ventas_cat_vend", ("ID_CATEGORIA", "ID_VEND")),
+    ("puntos_venta", "idx_pv_dpto_ciudad_cli", ("ID_DPTO", "ID_CIUDAD", "ID_CLIENTE")),
+    ("puntos_venta", "idx_pv_ciudad_cli", ("ID_CIUDAD", "ID_CLIENTE")),
+    ("vendedor", "idx_vendedor_desc", ("DESCRIPCION_VEND", "ID_VEND")),
+    ("ciudad", "idx_ciudad_dpto", ("ID_DPTO",)),
+]
+
+
+def _valores_de_muestra(conexion):
+    """Toma un valor real de cada filtro para que EXPLAIN use estadísticas representativas."""
+    consultas = {
+        'id_categoria': "SELECT ID_CATEGORIA FROM ventas WHERE PREVENTA = 1 AND ID_CATEGORIA IS NOT NULL LIMIT 1",
+        'id_marca': "SELECT ID_MARCA FROM ventas WHERE PREVENTA = 1 AND ID_MARCA IS NOT NULL LIMIT 1",
+        'descripcion_vend': "SELECT DESCRIPCION_VEND FROM vendedor LIMIT 1",
+        'id_dpto': "SELECT ID_DPTO FROM puntos_venta WHERE ID_DPTO IS NOT NULL LIMIT 1",
+        'id_ciudad': "SELECT ID_CIUDAD FROM puntos_venta WHERE ID_CIUDAD IS NOT NULL LIMIT 1",
+    }
+    valores = {}
+    with conexion.cursor() as cursor:
+        for filtro, query in consultas.items():
+            cursor.execute(query)
+            fila = cursor.fetchone()
+            valores[filtro] = fila[0] if fila else 0
+    return valores
+
+
+def iter_query_shapes(valores):
+    """
+    Genera (nombre, consulta, parámetros) para cada forma de consulta: las 32 combinaciones de
+    filtros de PREVENTA=1 con cada estrategia, más la consulta de tránsito agrupada con los mismos filtros.
+    """
+    for activos in itertools.product((False, True), repeat=len(FILTROS)):
+        filtros = {f: (valores[f] if activo else None) for f, activo in zip(FILTROS, activos)}
+        etiqueta = "+".join(f for f, activo in zip(FILTROS, activos) if activo) or "sin_filtros"
+        for usar_row_number in (True, False):
+            query, params = build_points_preventa_1_query(usar_row_number=usar_row_number, **filtros)
+            estrategia = "row_number" if usar_row_number else "max_join"
+            yield f"preventa_1[{estrategia}]:{etiqueta}", query, params
+        query, params = build_points_preventa_no_1_aggregated_query(filtros_preventa_1=filtros)
+        yield f"transito:{etiqueta}", query, params
+
+
+def explain_query(conexion, query, params):
+    """Ejecuta EXPLAIN y retorna las filas del plan como diccionarios."""
+    with conexion.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute("EXPLAIN " + query.strip().rstrip(';'), tuple(params))
+        return cursor.fetchall()
+
+
+def find_full_scans(plan):
+    """Retorna las tablas base que el plan recorre completas (type = ALL), ignorando tablas derivadas."""
+    return [
+        fila.get('table') for fila in plan
+        if str(fila.get('type', '')).upper() == 'ALL' and not str(fila.get('table', '')).startswith('<')
+    ]
+
+
+def time_query(conexion, query, params, repeticiones=3):
+    """Retorna el menor tiempo (segundos) de 'repeticiones' ejecuciones completas de la consulta."""
+    tiempos = []
+    with conexion.cursor() as cursor:
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            cursor.execute(query, tuple(params))
+            cursor.fetchall()
+            tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos)
+
+
+def existing_indexes(conexion):
+    """Retorna {tabla: [tupla_de_columnas, ...]} con los índices actuales del esquema."""
+    with conexion.cursor() as cursor:
+        cursor.execute("""
+            SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME
+            FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE()
+            ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+        """)
+        por_indice = {}
+        for tabla, indice, columna in cursor.fetchall():
+            por_indice.setdefault((tabla.lower(), indice), []).append(columna.upper())
+    indices = {}
+    for (tabla, _), columnas in por_indice.items():
+        indices.setdefault(tabla, []).append(tuple(columnas))
+    return indices
+
+
+def missing_indexes(conexion):
+    """Índices recomendados que no están cubiertos por un índice existente con el mismo prefijo de columnas."""
+    actuales = existing_indexes(conexion)
+    faltantes = []
+    for tabla, nombre, columnas in RECOMMENDED_INDEXES:
+        cubierto = any(idx[:len(columnas)] == columnas for idx in actuales.get(tabla, []))
+        if not cubierto:
+            faltantes.append((tabla, nombre, columnas))
+    return faltantes
+
+
+def index_ddl(tabla, nombre, columnas):
+    return f"CREATE INDEX {nombre} ON {tabla} ({', '.join(columnas)});"
+
+
+def analyze(conexion, medir_tiempos=True, repeticiones=3):
+    """Ejecuta EXPLAIN (y opcionalmente mide) cada forma de consulta. Retorna la lista de resultados."""
+    valores = _valores_de_muestra(conexion)
+    resultados = []
+    for nombre, query, params in iter_query_shapes(valores):
+        plan = explain_query(conexion, query, params)
+        resultado = {
+            "forma": nombre,
+            "full_scans": find_full_scans(plan),
+            "plan": [{k: fila.get(k) for k in ("table", "type", "key", "rows", "Extra")} for fila in plan],
+        }
+        if medir_tiempos:
+            resultado["segundos"] = time_query(conexion, query, params, repeticiones)
+        resultados.append(resultado)
+    return resultados
+
+
+def run_advisor(conexion, apply=False, medir_tiempos=True, repeticiones=3):
+    """
+    Analiza todas las formas de consulta, propone los índices faltantes y, si apply=True,
+    los crea y vuelve a medir. Retorna un informe con los resultados antes/después y el DDL.
+    """
+    print("--- [index_advisor.py] Analizando formas de consulta (antes) ---")
+    antes = analyze(conexion, medir_tiempos=medir_tiempos, repeticiones=repeticiones)
+    faltantes = missing_indexes(conexion)
+    ddl = [index_ddl(*indice) for indice in faltantes]
+
+    for r in antes:
+        if r["full_scans"]:
+            print(f"FULL SCAN en {r['forma']}: {', '.join(r['full_scans'])}")
+    print(f"--- [index_advisor.py] Índices faltantes: {len(ddl)} ---")
+    for sentencia in ddl:
+        print(sentencia)
+
+    informe = {"antes": antes, "ddl": ddl, "aplicado": False}
+
+    if apply and ddl:
+        with conexion.cursor() as cursor:
+            for sentencia in ddl:
+                print(f"--- [index_advisor.py] Aplicando: {sentencia} ---")
+                cursor.execute(sentencia)
+            for tabla in sorted({tabla for tabla, _, _ in faltantes}):
+                cursor.execute(f"ANALYZE TABLE {tabla}")
+                cursor.fetchall()
+        conexion.commit()
+        informe["aplicado"] = True
+
+        print("--- [index_advisor.py] Analizando formas de consulta (después) ---")
+        despues = analyze(conexion, medir_tiempos=medir_tiempos, repeticiones=repeticiones)
+        informe["despues"] = despues
+
+        if medir_tiempos:
+            print(f"{'Forma':<70} {'Antes (s)':>10} {'Después (s)':>12}")
+            for a, d in zip(antes, despues):
+                print(f"{a['forma']:<70} {a['segundos']:>10.4f} {d['segundos']:>12.4f}")
+
+    return informe
+
+
+# --- Datos de prueba para un MySQL/MariaDB local ---
+
+def create_stand_in_schema(conexion, clientes=2000, ventas_por_cliente=25, seed=1):
+    """
+    Crea (si no existen) las tablas que usa la app y las llena con datos sintéticos.
+    Pensado para una base local vacía; no toca tablas que ya tengan filas.
+    """
+    rnd = random.Random(seed)
+    ddl = [
+        "CREATE TABLE IF NOT EXISTS categoria (ID_CATEGORIA INT PRIMARY KEY, DESCRIPCION_CATEGORIA VARCHAR(100))",
+        "CREATE TABLE IF NOT EXISTS marca (ID_MARCA INT PRIMARY KEY, DESCRIPCION_MARCA VARCHAR(100))",
+        "CREATE TABLE IF NOT EXISTS vendedor (ID_VEND INT PRIMARY KEY, DESCRIPCION_VEND VARCHAR(100))",
+        "CREATE TABLE IF NOT EXISTS departamento (ID_DPTO INT PRIMARY KEY, DESCRIPCION_DPTO VARCHAR(100))",
+        "CREATE TABLE IF NOT EXISTS ciudad (ID_CIUDAD INT PRIMARY KEY, ID_DPTO INT, DESCRIPCION_CIUDAD VARCHAR(100))",
+        """CREATE TABLE IF NOT EXISTS puntos_venta (
+            ID_CLIENTE INT PRIMARY KEY, DESCRIPCION_CLIENTE VARCHAR(150),
+            LATITUD VARCHAR(30), LONGITUD VARCHAR(30), ID_DPTO INT, ID_CIUDAD INT)""",
+        """CREATE TABLE IF NOT EXISTS ventas (
+            ID INT AUTO_INCREMENT PRIMARY KEY, ID_CLIENTE INT, FECHA DATE, PREVENTA INT,
+            ID_CATEGORIA INT, ID_MARCA INT, ID_VEND INT, CANTIDAD DECIMAL(12,2))""",
+    ]
+    with conexion.cursor() as cursor:
+        for sentencia in ddl:
+            cursor.execute(sentencia)
+        cursor.execute("SELECT COUNT(*) FROM ventas")
+        if cursor.fetchone()[0] > 0:
+            print("--- [index_advisor.py] La tabla 'ventas' ya tiene datos; no se generan datos de prueba. ---")
+            return
+
+        cursor.executemany("INSERT INTO categoria VALUES (%s, %s)", [(i, f"CATEGORIA {i}") for i in range(1, 9)])
+        cursor.executemany("INSERT INTO marca VALUES (%s, %s)", [(i, f"MARCA {i}") for i in range(1, 61)])
+        cursor.executemany("INSERT INTO vendedor VALUES (%s, %s)", [(i, f"VENDEDOR {i}") for i in range(1, 31)])
+        cursor.executemany("INSERT INTO departamento VALUES (%s, %s)", [(i, f"DEPARTAMENTO {i}") for i in range(1, 18)])
+        cursor.executemany("INSERT INTO ciudad VALUES (%s, %s, %s)", [(i, (i % 17) + 1, f"CIUDAD {i}") for i in range(1, 251)])
+
+        puntos = []
+        for id_cliente in range(1, clientes + 1):
+            id_ciudad = rnd.randint(1, 250)
+            puntos.append((id_cliente, f"CLIENTE {id_cliente}", f"{rnd.uniform(-27.5, -19.5):.6f}",
+                           f"{rnd.uniform(-62.5, -54.5):.6f}", (id_ciudad % 17) + 1, id_ciudad))
+        cursor.executemany("INSERT INTO puntos_venta VALUES (%s, %s, %s, %s, %s, %s)", puntos)
+
+        hoy = date.today()
+        ventas = []
+        for id_cliente in range(1, clientes + 1):
+            for _ in range(ventas_por_cliente):
+                ventas.append((
+                    id_cliente, hoy - timedelta(days=rnd.randint(0, 400)), rnd.choices((1, 2, 3), weights=(90, 6, 4))[0],
+                    rnd.randint(1, 8), rnd.randint(1, 60), rnd.randint(1, 30), rnd.randint(1, 50)
+                ))
+        cursor.executemany(
+            "INSERT INTO ventas (ID_CLIENTE, FECHA, PREVENTA, ID_CATEGORIA, ID_MARCA, ID_VEND, CANTIDAD) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            ventas
+        )
+    conexion.commit()
+    print(f"--- [index_advisor.py] Datos de prueba creados: {clientes} clientes, {len(ventas)} ventas. ---")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Asesor de índices para las consultas del mapa.")
+    parser.add_argument("--apply", action="store_true", help="Crear los índices faltantes y medir de nuevo")
+    parser.add_argument("--no-timings", action="store_true", help="Solo EXPLAIN, sin medir tiempos")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--report", default=None, help="Archivo JSON donde guardar el informe")
+    parser.add_argument("--seed-clientes", type=int, default=0, help="Crear esquema y datos sintéticos con N clientes (base local vacía)")
+    for campo in ("host", "port", "user", "password", "database"):
+        parser.add_argument(f"--{campo}", default=None, help=f"Sobrescribe '{campo}' de app/db_config.json")
+    args = parser.parse_args(argv)
+
+    db_config = load_db_config() or {}
+    for campo in ("host", "port", "user", "password", "database"):
+        valor = getattr(args, campo)
+        if valor is not None:
+            db_config[campo] = int(valor) if campo == "port" else valor
+
+    conexion = connect_to_database(db_config)
+    if conexion is None:
+        return 1
+    try:
+        if args.seed_clientes:
+            create_stand_in_schema(conexion, clientes=args.seed_clientes)
+        informe = run_advisor(conexion, apply=args.apply, medir_tiempos=not args.no_timings, repeticiones=args.repeticiones)
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump(informe, f, indent=2, default=str)
+            print(f"--- [index_advisor.py] Informe guardado en {args.report} ---")
+    finally:
+        close_database_connection(conexion)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,151 @@
+# app/load_control.py
+
+import threading
+from contextlib import contextmanager
+
+import pymysql
+
+from app.database import connect_to_database, close_database_connection
+
+# Cancelación cooperativa de las cargas de datos del mapa PyQt.
+# Cada carga recibe un CancelToken con un número de generación; al pedir una carga nueva, la
+# anterior queda cancelada sin esperarla: el hilo de Qt solo marca el token y, si la carga tiene
+# consultas corriendo en MySQL, un hilo aparte les envía KILL QUERY (con el thread_id de la
+# conexión del pool) desde una conexión propia. La carga cancelada lo nota en el próximo punto de
+# control (CancelToken.check) y termina sin emitir resultados ni guardar nada en el caché.
+
+KILL_TIMEOUT = 5  # Segundos máximos que una conexión espera al KILL QUERY antes de volver al pool
+
+
+class LoadCancelled(Exception):
+    """La carga fue reemplazada por una más nueva (o cancelada al cerrar la aplicación)."""
+
+
+def _thread_id(conexion):
+    try:
+        return conexion.thread_id()
+    except Exception:
+        return None
+
+
+class CancelToken:
+    """Estado de cancelación de una carga y las conexiones que tiene ejecutando consultas."""
+
+    def __init__(self, generacion, db_config=None):
+        self.generacion = generacion
+        self.db_config = db_config  # Para abrir la conexión del KILL QUERY (None: solo cooperativa)
+        self._lock = threading.Lock()
+        self._cancelado = False
+        self._consultas = {}  # id(conexion) -> thread_id de MySQL
+        self._kill_terminado = threading.Event()
+        self._kill_terminado.set()
+
+    @property
+    def cancelado(self):
+        with self._lock:
+            return self._cancelado
+
+    def check(self):
+        """Punto de control: lanza LoadCancelled si la carga fue cancelada."""
+        if self.cancelado:
+            raise LoadCancelled(f"Carga {self.generacion} cancelada.")
+
+    @contextmanager
+    def consulta(self, conexion):
+        """
+        Registra 'conexion' mientras ejecuta una consulta de esta carga, para poder cancelarla en
+        el servidor. Lanza LoadCancelled antes de empezar si la carga ya fue cancelada.
+        """
+        thread_id = _thread_id(conexion)
+        with self._lock:
+            if self._cancelado:
+                raise LoadCancelled(f"Carga {self.generacion} cancelada.")
+            if thread_id is not None:
+                self._consultas[id(conexion)] = thread_id
+        try:
+            yield conexion
+        finally:
+            with self._lock:
+                self._consultas.pop(id(conexion), None)
+            # Un KILL QUERY todavía en camino alcanzaría la próxima consulta de esta conexión:
+            # no se devuelve al pool hasta que termine
+            self._kill_terminado.wait(KILL_TIMEOUT)
+
+    def cancel(self):
+        """
+        Cancela la carga sin bloquear: marca el token y envía KILL QUERY en segundo plano a las
+        consultas en curso. Retorna cuántas consultas se mandaron a cancelar en el servidor.
+        """
+        with self._lock:
+            if self._cancelado:
+                return 0
+            self._cancelado = True
+            thread_ids = list(self._consultas.values()) if self.db_config is not None else []
+            if thread_ids:
+                self._kill_terminado.clear()
+        if thread_ids:
+            threading.Thread(
+                target=self._matar_consultas, args=(thread_ids,),
+                name=f"kill_carga_{self.generacion}", daemon=True
+            ).start()
+        return len(thread_ids)
+
+    def _matar_consultas(self, thread_ids):
+        # Conexión propia y no del pool: el pool puede estar ocupado justamente por estas consultas
+        conexion = None
+        try:
+            conexion = connect_to_database(self.db_config)
+            if conexion is None:
+                print(f"Advertencia: No se pudo conectar para cancelar las consultas de la carga {self.generacion}.")
+                return
+            with conexion.cursor() as cursor:
+                for thread_id in thread_ids:
+                    try:
+                        cursor.execute(f"KILL QUERY {int(thread_id)}")
+                        print(f"--- [load_control.py] KILL QUERY {thread_id} (carga {self.generacion}) ---")
+                    except pymysql.MySQLError as e:
+                        # 1094: la consulta ya había terminado y el hilo no existe
+                        print(f"Advertencia: No se pudo cancelar la consulta {thread_id}: {e}")
+        except Exception as e:
+            print(f"Advertencia: Error al cancelar las consultas de la carga {self.generacion}: {e}")
+        finally:
+            if conexion is not None:
+                close_database_connection(conexion)
+            self._kill_terminado.set()
+
+
+class LoadController:
+    """Contador de generaciones: cada carga nueva cancela a la anterior."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generacion = 0
+        self._actual = None
+
+    def nueva_carga(self, db_config=None):
+        """Cancela la carga vigente (si la hay) y retorna el CancelToken de una nueva."""
+        with self._lock:
+            self._generacion += 1
+            anterior, self._actual = self._actual, CancelToken(self._generacion, db_config)
+            actual = self._actual
+        if anterior is not None:
+            anterior.cancel()
+        return actual
+
+    def cancelar(self):
+        """Cancela la carga vigente sin reemplazarla. Retorna su generación o None."""
+        with self._lock:
+            actual, self._actual = self._actual, None
+        if actual is None:
+            return None
+        actual.cancel()
+        return actual.generacion
+
+    def es_vigente(self, token):
+        with self._lock:
+            return token is not None and token is self._actual and not token.cancelado
+
+    @property
+    def generacion(self):
+        with self._lock:
+            return self._generacion
@@ -0,0 +1,62 @@
+# app/map_diff.py
+
+import threading
+
+# Actualizaciones incrementales del mapa PyQt. En lugar de borrar y volver a crear todos los
+# marcadores en cada cambio de vista o de filtros, se recuerda qué puntos tiene el mapa (por
+# id_cliente, con una firma de lo que se ve de cada uno) y se envía solo la diferencia:
+# puntos a agregar, a quitar y a reemplazar (cambió su posición, color, forma, inicial o popup).
+# window.aplicarCambiosMapa en mapa_base.html aplica esa diferencia sobre la capa de marcadores.
+
+
+def firma_punto(punto, popup_index=None):
+    """Lo que determina cómo se ve un punto en el mapa; si cambia, el marcador se reemplaza."""
+    id_cliente = punto.get('id_cliente')
+    if punto.get('popup_html') is not None:
+        version_popup = punto['popup_html']
+    elif popup_index is not None:
+        version_popup = popup_index.version(id_cliente)
+    else:
+        version_popup = None
+    return (
+        punto.get('LATITUD'), punto.get('LONGITUD'), punto.get('color'), punto.get('shape'),
+        punto.get('first_letter_vend'), version_popup,
+    )
+
+
+class MapState:
+    """Puntos que tiene el mapa en este momento: id_cliente (como texto) -> firma."""
+
+    def __init__(self):
+        self._firmas = {}
+        self._lock = threading.Lock()
+
+    def diff(self, puntos, popup_index=None):
+        """
+        Compara 'puntos' (lo que el mapa debe mostrar ahora) con lo enviado antes y registra el
+        nuevo estado. Retorna {'agregar': [punto], 'actualizar': [punto], 'quitar': [id_cliente]}.
+        """
+        nuevas = {}
+        por_id = {}
+        for punto in puntos:
+            clave = str(punto.get('id_cliente'))
+            nuevas[clave] = firma_punto(punto, popup_index)
+            por_id[clave] = punto
+
+        with self._lock:
+            anteriores = self._firmas
+            agregar = [por_id[clave] for clave in nuevas if clave not in anteriores]
+            actualizar = [por_id[clave] for clave, firma in nuevas.items()
+                          if clave in anteriores and anteriores[clave] != firma]
+            quitar = [clave for clave in anteriores if clave not in nuevas]
+            self._firmas = nuevas
+
+        return {'agregar': agregar, 'actualizar': actualizar, 'quitar': quitar}
+
+    def reset(self):
+        """Olvida lo enviado (el mapa se vació o quedó en un estado desconocido)."""
+        with self._lock:
+            self._firmas = {}
+
+    def __len__(self):
+        return len(self._firmas)
@@ -1,11 +1,17 @@
 # map_generator.py (VERSIÓN CON DELEGACIÓN DE EVENTOS)
 
+import contextlib
+import io
+import time
 from collections import defaultdict
 import pandas as pd
 import folium
 from folium.plugins import MarkerCluster
 from datetime import datetime, date, timedelta
-from app.color_calculator import calculate_colors_and_shapes_for_all_points
+from app.color_calculator import classify_points_vectorized
+from app.popup_index import LAZY_POPUP_JS_TEMPLATE, build_popup_lookup
+from app.marker_layer import ICON_SIZE, ICON_ANCHOR, icon_html, build_marker_payload, data_marker_script
+from branca.element import MacroElement, Template
 import numpy as np
 import folium.elements
 
@@ -64,6 +70,46 @@ POPUP_GLOBAL_CSS = """
     </style>
 """
 
+# --- CSS GLOBAL para los íconos de los marcadores ---
+# Una clase por forma y otra por color: el HTML de cada marcador (marker_layer.icon_html) solo
+# lleva los nombres de clase y la inicial del vendedor, en lugar de ~600 bytes de estilo en línea.
+MARKER_ICON_CSS = """
+    <style>
+        .mapa-icono {
+            width: 24px;
+            height: 24px;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            font-weight: bold;
+            color: white;
+            line-height: 1;
+        }
+        .mapa-icono-circle {
+            border-radius: 50%;
+            border: 1px solid white;
+            font-size: 12px;
+        }
+        .mapa-icono-diamond {
+            font-family: Arial, sans-serif;
+            font-size: 14px;
+            border-radius: 4px;
+            transform: rotate(45deg);
+            border: 2px solid white;
+            box-shadow: 0 0 5px rgba(0,0,0,0.5);
+        }
+        .mapa-icono-diamond span {
+            transform: rotate(-45deg);
+            display: inline-block;
+            line-height: 1;
+        }
+        .mapa-color-green { background-color: green; }
+        .mapa-color-orange { background-color: orange; }
+        .mapa-color-red { background-color: red; }
+        .mapa-color-black { background-color: black; }
+    </style>
+"""
+
 # JavaScript para la DELEGACIÓN DE EVENTOS
 # Este script se ejecutará una sola vez en el iframe principal del mapa.
 POPUP_TOGGLE_JS_TEMPLATE = """
@@ -103,50 +149,75 @@ POPUP_TOGGLE_JS_TEMPLATE = """
     });
 """
 
-def process_points_for_map(puntos_preventa_1_raw, puntos_preventa_no_1_raw, filters_dict):
-    # ... (esta función no cambia) ...
+def load_raw_points_from_snapshot(snapshot, filters_dict):
+    """
+    Lee del snapshot local (app/snapshot_store.py) las filas PREVENTA=1 y las de tránsito agrupadas
+    para los filtros de Streamlit (categoria_id, marca_id, vendedor_desc, departamento_id, ciudad_id).
+    """
+    filtros = {
+        'id_categoria': filters_dict.get('categoria_id'),
+        'id_marca': filters_dict.get('marca_id'),
+        'descripcion_vend': filters_dict.get('vendedor_desc'),
+        'id_dpto': filters_dict.get('departamento_id'),
+        'id_ciudad': filters_dict.get('ciudad_id')
+    }
+    puntos_preventa_1_raw = snapshot.fetch_points_preventa_1(**filtros)
+    puntos_preventa_no_1_raw = snapshot.fetch_points_preventa_no_1_aggregated(filtros_preventa_1=filtros)
+    return puntos_preventa_1_raw, puntos_preventa_no_1_raw
+
+
+def process_points_for_map(puntos_preventa_1_raw, puntos_preventa_no_1_raw, filters_dict, snapshot=None, lazy_popups=False):
+    """
+    Combina las filas PREVENTA=1 y de tránsito en puntos con color/forma y calcula las estadísticas.
+    Si se pasa 'snapshot', las filas se leen del snapshot local según 'filters_dict' (sin red).
+    Con lazy_popups=True no se arma el HTML de los popups (columna 'popup_datos' en su lugar).
+    """
     print("--- [map_generator.py] Iniciando procesamiento de puntos para el mapa ---")
 
-    if not isinstance(puntos_preventa_1_raw, list):
-        print("--- [map_generator.py] Convirtiendo puntos_preventa_1_raw a lista.")
-        puntos_preventa_1_raw = list(puntos_preventa_1_raw)
-    if not isinstance(puntos_preventa_no_1_raw, list):
-        print("--- [map_generator.py] Convirtiendo puntos_preventa_no_1_raw a lista.")
-        puntos_preventa_no_1_raw = list(puntos_preventa_no_1_raw)
+    if snapshot is not None:
+        print("--- [map_generator.py] Leyendo puntos desde el snapshot local.")
+        puntos_preventa_1_raw, puntos_preventa_no_1_raw = load_raw_points_from_snapshot(snapshot, filters_dict)
 
-    print("--- [map_generator.py] Llamando a calculate_colors_and_shapes_for_all_points para combinar y procesar puntos.")
-    all_processed_points = calculate_colors_and_shapes_for_all_points(puntos_preventa_1_raw, puntos_preventa_no_1_raw)
-    print(f"--- [map_generator.py] Puntos después de asignar colores y formas: {len(all_processed_points)} ---")
+    # Las filas pueden llegar como listas o como iteradores (generadores stream_* de app/database.py).
+    # La clasificación se hace con el motor vectorizado, que ya entrega un DataFrame.
 
-    df_map_points = pd.DataFrame()
-    statistics = {}
+    print("--- [map_generator.py] Llamando a classify_points_vectorized para combinar y procesar puntos.")
+    df_map_points = classify_points_vectorized(puntos_preventa_1_raw, puntos_preventa_no_1_raw, lazy_popups=lazy_popups)
+    print(f"--- [map_generator.py] Puntos después de asignar colores y formas: {len(df_map_points)} ---")
 
-    if not all_processed_points:
+    if df_map_points.empty:
         print("--- [map_generator.py] No hay puntos válidos después de asignar colores y formas. Retornando DataFrame vacío y estadísticas vacías.")
         statistics = {
             'total_general_clientes': 0,
             'total_circles': 0, 'circles_green': 0, 'circles_orange': 0, 'circles_red': 0, 'circles_black': 0,
             'total_diamonds': 0, 'diamonds_green': 0, 'diamonds_orange': 0, 'diamonds_red': 0, 'diamonds_black': 0
         }
-        return df_map_points, statistics
+        return pd.DataFrame(), statistics
 
-    print("--- [map_generator.py] Convirtiendo la lista de puntos a DataFrame.")
-    df_map_points = pd.DataFrame(all_processed_points)
+    print("--- [map_generator.py] Calculando estadísticas de los puntos.")
+    statistics = calculate_statistics_from_dataframe(df_map_points)
 
     df_map_points['LATITUD'] = pd.to_numeric(df_map_points['LATITUD'], errors='coerce')
     df_map_points['LONGITUD'] = pd.to_numeric(df_map_points['LONGITUD'], errors='coerce')
     df_map_points.dropna(subset=['LATITUD', 'LONGITUD'], inplace=True)
 
-    print("--- [map_generator.py] Calculando estadísticas de los puntos.")
-    statistics = calculate_statistics(all_processed_points)
-
     print("--- [map_generator.py] Procesamiento de puntos para el mapa completado ---")
     return df_map_points, statistics
 
 
-def generate_folium_map(df_map_points):
+def _agregar_script(m, script):
+    """Agrega 'script' al mapa como un MacroElement (sin que Jinja2 interprete su contenido)."""
+    elemento = MacroElement()
+    elemento._template = Template("{% macro script(this, kwargs) %}{% raw %}" + script + "{% endraw %}{% endmacro %}")
+    m.add_child(elemento)
+
+
+def generate_folium_map(df_map_points, modo_render='marcadores'):
     """
     Genera un objeto mapa de Folium a partir de un DataFrame de puntos.
+    modo_render='marcadores' crea un folium.Marker por punto; modo_render='datos' emite los puntos
+    una sola vez como arreglos y los marcadores se crean en el navegador (app/marker_layer.py),
+    con los mismos íconos y popups y un HTML mucho más chico.
     """
     print("--- [map_generator.py] Iniciando creación del objeto mapa de Folium ---")
     print(f"--- [map_generator.py] DataFrame de entrada para el mapa (shape): {df_map_points.shape} ---")
@@ -165,6 +236,7 @@ def generate_folium_map(df_map_points):
 
     # INYECTAR SÓLO EL CSS GLOBAL
     m.get_root().header.add_child(folium.elements.Element(POPUP_GLOBAL_CSS))
+    m.get_root().header.add_child(folium.elements.Element(MARKER_ICON_CSS))
     print("--- [map_generator.py] CSS global inyectado en el mapa. ---")
 
     # ¡¡¡INYECCIÓN GLOBAL DEL JAVASCRIPT CON DELEGACIÓN DE EVENTOS!!!
@@ -178,104 +250,98 @@ def generate_folium_map(df_map_points):
     marker_cluster = MarkerCluster().add_to(m)
     print("--- [map_generator.py] MarkerCluster añadido al mapa. ---")
 
-    points_added_count = 0
-    for idx, row in df_map_points.iterrows():
-        lat = row.get('LATITUD')
-        lon = row.get('LONGITUD')
-
-        if pd.isna(lat) or pd.isna(lon) or not isinstance(lat, (float, int)) or not isinstance(lon, (float, int)):
-            print(f"Advertencia: Saltando punto con coordenadas inválidas/nulas para ID_CLIENTE {row.get('ID_CLIENTE', 'N/A')}: Lat={lat}, lon={lon}")
-            continue
-
-        color = row['color']
-        shape = row['shape']
-
-        # El popup_html ya viene con los IDs formateados desde color_calculator
-        # y ahora NO CONTIENE EL ONCLICK (el JS lo maneja).
-        popup_html_content = row['popup_html']
+    # Popups bajo demanda (columna 'popup_datos'): los marcadores llevan solo su idCliente y el
+    # HTML, renderizado en Python por app/popup_index.build_popup_lookup, se enlaza al primer clic.
+    lazy_popups = 'popup_datos' in df_map_points.columns
+    popups_perezosos = []
 
-        first_letter_vend = row.get('first_letter_vend', '?')
-
-        icon_size = (24, 24)
-        icon_anchor = (icon_size[0] // 2, icon_size[1] // 2)
+    if modo_render == 'datos':
+        payload, popups_perezosos, points_added_count = build_marker_payload(df_map_points)
+        # Se agrega después del MarkerCluster para que su script se ejecute cuando la capa ya existe
+        _agregar_script(m, data_marker_script(marker_cluster.get_name(), payload))
+        print(f"--- [map_generator.py] Capa de marcadores por datos inyectada ({len(payload)} caracteres). ---")
+    else:
+        points_added_count = 0
+        for idx, row in df_map_points.iterrows():
+            lat = row.get('LATITUD')
+            lon = row.get('LONGITUD')
+
+            if pd.isna(lat) or pd.isna(lon) or not isinstance(lat, (float, int)) or not isinstance(lon, (float, int)):
+                print(f"Advertencia: Saltando punto con coordenadas inválidas/nulas para ID_CLIENTE {row.get('ID_CLIENTE', 'N/A')}: Lat={lat}, lon={lon}")
+                continue
+
+            color = row['color']
+            shape = row['shape']
+
+            opciones_marcador = {}
+            if lazy_popups:
+                id_cliente = row['id_cliente']
+                id_cliente = id_cliente.item() if hasattr(id_cliente, 'item') else id_cliente
+                popups_perezosos.append((id_cliente, row['popup_datos']))
+                opciones_marcador['idCliente'] = id_cliente
+            else:
+                # El popup_html ya viene con los IDs formateados desde color_calculator
+                # y ahora NO CONTIENE EL ONCLICK (el JS lo maneja).
+                popup_html_content = row['popup_html']
+
+            first_letter_vend = row.get('first_letter_vend', '?')
+
+            # Crear el objeto Popup.
+            # ¡¡¡AHORA SOLO PASAMOS EL HTML PURO!!!
+            # El JS global se encarga de los eventos.
+            popup = None
+            if not lazy_popups:
+                popup = folium.Popup(
+                    popup_html_content, # ¡No más folium.Html(..., script=...) aquí!
+                    max_width=300
+                )
+
+            icon_html_content = icon_html(shape, color, first_letter_vend)
+            if icon_html_content is not None:
+                folium.Marker(
+                    location=[lat, lon],
+                    icon=folium.DivIcon(
+                        icon_size=ICON_SIZE,
+                        icon_anchor=ICON_ANCHOR,
+                        html=icon_html_content
+                    ),
+                    popup=popup,
+                    **opciones_marcador
+                ).add_to(marker_cluster)
+
+            points_added_count += 1
 
-        icon_html = ""
+    print(f"--- [map_generator.py] Total de puntos añadidos al mapa: {points_added_count} ---")
 
-        # Crear el objeto Popup.
-        # ¡¡¡AHORA SOLO PASAMOS EL HTML PURO!!!
-        # El JS global se encarga de los eventos.
-        popup = folium.Popup(
-            popup_html_content, # ¡No más folium.Html(..., script=...) aquí!
-            max_width=300
+    if lazy_popups:
+        # Se agrega después del MarkerCluster para que su script se ejecute cuando la capa ya existe
+        script_popups = LAZY_POPUP_JS_TEMPLATE.format(
+            cluster=marker_cluster.get_name(),
+            lookup=build_popup_lookup(popups_perezosos)
         )
-
-        if shape == 'circle':
-            icon_html = f"""
-            <div style="
-                width: {icon_size[0]}px;
-                height: {icon_size[1]}px;
-                background-color: {color};
-                border-radius: 50%;
-                border: 1px solid white;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                font-size: 12px;
-                font-weight: bold;
-                color: white;
-                line-height: 1;
-            ">{first_letter_vend}</div>
-            """
-
-            folium.Marker(
-                location=[lat, lon],
-                icon=folium.DivIcon(
-                    icon_size=icon_size,
-                    icon_anchor=icon_anchor,
-                    html=icon_html
-                ),
-                popup=popup
-            ).add_to(marker_cluster)
-
-        elif shape == 'diamond':
-            icon_html = f"""
-            <div style="
-                font-family: Arial, sans-serif;
-                font-weight: bold;
-                font-size: 14px;
-                color: white;
-                background-color: {color};
-                width: {icon_size[0]}px;
-                height: {icon_size[1]}px;
-                border-radius: 4px;
-                transform: rotate(45deg);
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                border: 2px solid white;
-                box-shadow: 0 0 5px rgba(0,0,0,0.5);
-            ">
-                <span style="transform: rotate(-45deg); display: inline-block; line-height: 1;">{first_letter_vend}</span>
-            </div>
-            """
-
-            folium.Marker(
-                location=[lat, lon],
-                icon=folium.DivIcon(
-                    icon_size=icon_size,
-                    icon_anchor=icon_anchor,
-                    html=icon_html
-                ),
-                popup=popup
-            ).add_to(marker_cluster)
-
-        points_added_count += 1
-
-    print(f"--- [map_generator.py] Total de puntos añadidos al mapa: {points_added_count} ---")
+        _agregar_script(m, script_popups)
+        print(f"--- [map_generator.py] Tabla de popups bajo demanda inyectada ({len(popups_perezosos)} clientes). ---")
     print("--- [map_generator.py] Objeto mapa de Folium creado y configurado. Retornando 'm'. ---")
     return m
 
 
+def benchmark_render_modes(df_map_points, modos=('marcadores', 'datos')):
+    """
+    Mide, para cada modo de generate_folium_map, el tiempo de generar y renderizar el HTML del
+    mapa y el tamaño del HTML resultante. Retorna {modo: {'segundos': ..., 'bytes': ...}}.
+    """
+    resultados = {}
+    for modo in modos:
+        inicio = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            html = generate_folium_map(df_map_points, modo_render=modo).get_root().render()
+        segundos = time.perf_counter() - inicio
+        resultados[modo] = {'segundos': segundos, 'bytes': len(html.encode('utf-8'))}
+        print(f"--- [map_generator.py] Modo '{modo}': {len(df_map_points)} puntos en {segundos:.2f}s, "
+              f"{resultados[modo]['bytes'] / 1e6:.1f} MB de HTML ---")
+    return resultados
+
+
 def calculate_statistics(puntos_para_mapa):
     # ... (esta función no cambia) ...
     """
@@ -319,4 +385,27 @@ def calculate_statistics(puntos_para_mapa):
         'diamonds_orange': conteo_diamond.get('orange', 0),
         'diamonds_red': conteo_diamond.get('red', 0),
         'diamonds_black': conteo_diamond.get('black', 0)
-    }
\ No newline at end of file
+    }
+
+
+def calculate_statistics_from_dataframe(df_map_points):
+    """
+    Igual que calculate_statistics pero sobre el DataFrame de classify_points_vectorized:
+    los conteos por forma y color se hacen con un solo groupby.
+    """
+    conteo = df_map_points.groupby(['shape', 'color']).size()
+    circulos = conteo.get('circle', pd.Series(dtype=int))
+    diamantes = conteo.get('diamond', pd.Series(dtype=int))
+    return {
+        'total_general_clientes': int(df_map_points['id_cliente'].nunique()),
+        'total_circles': int(circulos.sum()),
+        'circles_green': int(circulos.get('green', 0)),
+        'circles_orange': int(circulos.get('orange', 0)),
+        'circles_red': int(circulos.get('red', 0)),
+        'circles_black': int(circulos.get('black', 0)),
+        'total_diamonds': int(diamantes.sum()),
+        'diamonds_green': int(diamantes.get('green', 0)),
+        'diamonds_orange': int(diamantes.get('orange', 0)),
+        'diamonds_red': int(diamantes.get('red', 0)),
+        'diamonds_black': int(diamantes.get('black', 0))
+    }
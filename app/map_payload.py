@@ -0,0 +1,152 @@
+# app/map_payload.py
+
+import base64
+import json
+import time
+
+import numpy as np
+
+# Formato columnar compacto para enviar puntos de Python al mapa PyQt por el QWebChannel.
+# En lugar de una lista de diccionarios serializada como literal JS (que la página tiene que
+# parsear como código), cada bloque lleva arreglos paralelos en base64 que el JS lee con typed
+# arrays (decodificarPuntosColumnar en mapa_base.html):
+#   lat, lng -> Float32Array      color, shape -> Uint8Array (índices en 'tablas')
+#   letra    -> Uint16Array (índice en tablas.letra)
+#   id       -> Int32Array si todos los id_cliente son enteros de 32 bits; si no, lista JSON
+# Los textos repetidos (colores, formas, iniciales) viajan una sola vez en 'tablas'. Los popups
+# son bajo demanda (Bridge.getPopupHtml); si un punto trae popup_html se agrega la lista 'popups'.
+# Bridge.getPointsInView envía el primer bloque de la diferencia de la vista en su respuesta y el
+# JS pide los demás con Bridge.getPointsChunk mientras inserta los anteriores. Una vista lleva a lo
+# sumo cluster_engine.DEFAULT_MAX_PUNTOS_VISTA puntos (más solo con zoom mayor a max_zoom).
+
+DEFAULT_PUNTOS_POR_BLOQUE = 500
+
+_INT32_MIN, _INT32_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def _b64(arreglo):
+    return base64.b64encode(np.ascontiguousarray(arreglo).tobytes()).decode('ascii')
+
+
+def _codificar(valores):
+    """(códigos, tabla) de una columna de texto; los nulos se codifican como '' en la tabla."""
+    tabla = []
+    codigos_por_valor = {}
+    codigos = []
+    for valor in valores:
+        valor = '' if valor is None else str(valor)
+        codigo = codigos_por_valor.get(valor)
+        if codigo is None:
+            codigo = codigos_por_valor[valor] = len(tabla)
+            tabla.append(valor)
+        codigos.append(codigo)
+    return codigos, tabla
+
+
+def _como_dicts(puntos):
+    if hasattr(puntos, 'to_dicts'):
+        return puntos.to_dicts()
+    return list(puntos)
+
+
+def encode_points_columnar(puntos):
+    """Bloque columnar (diccionario serializable a JSON) con los puntos dados."""
+    puntos = _como_dicts(puntos)
+    lat = np.array([p.get('LATITUD') if p.get('LATITUD') is not None else np.nan for p in puntos], dtype=np.float32)
+    lng = np.array([p.get('LONGITUD') if p.get('LONGITUD') is not None else np.nan for p in puntos], dtype=np.float32)
+    colores, tabla_colores = _codificar(p.get('color') for p in puntos)
+    formas, tabla_formas = _codificar(p.get('shape') for p in puntos)
+    letras, tabla_letras = _codificar(p.get('first_letter_vend') for p in puntos)
+
+    bloque = {
+        'n': len(puntos),
+        'lat': _b64(lat),
+        'lng': _b64(lng),
+        'color': _b64(np.array(colores, dtype=np.uint8)),
+        'shape': _b64(np.array(formas, dtype=np.uint8)),
+        'letra': _b64(np.array(letras, dtype=np.uint16)),
+        'tablas': {'color': tabla_colores, 'shape': tabla_formas, 'letra': tabla_letras},
+    }
+
+    ids = [p.get('id_cliente') for p in puntos]
+    if all(isinstance(i, int) and not isinstance(i, bool) and _INT32_MIN <= i <= _INT32_MAX for i in ids):
+        bloque['id'] = _b64(np.array(ids, dtype=np.int32))
+    else:
+        bloque['ids'] = ids
+
+    if any(p.get('popup_html') is not None for p in puntos):
+        bloque['popups'] = [p.get('popup_html') for p in puntos]
+    return bloque
+
+
+def iter_payload_blocks(puntos, puntos_por_bloque=DEFAULT_PUNTOS_POR_BLOQUE):
+    """Genera los bloques columnares (diccionarios) de a 'puntos_por_bloque' puntos."""
+    puntos = _como_dicts(puntos)
+    for desde in range(0, len(puntos), puntos_por_bloque):
+        bloque = encode_points_columnar(puntos[desde:desde + puntos_por_bloque])
+        bloque['desde'] = desde
+        bloque['total'] = len(puntos)
+        yield bloque
+
+
+def iter_payload_chunks(puntos, puntos_por_bloque=DEFAULT_PUNTOS_POR_BLOQUE):
+    """Genera los bloques JSON (texto) de a 'puntos_por_bloque' puntos, listos para el bridge."""
+    for bloque in iter_payload_blocks(puntos, puntos_por_bloque):
+        yield json.dumps(bloque, default=str)
+
+
+def view_payload(cambios, puntos_por_bloque=DEFAULT_PUNTOS_POR_BLOQUE):
+    """
+    Respuesta de una vista a partir de la diferencia de map_diff.MapState.diff: 'agregar' y
+    'actualizar' van juntos (el JS reemplaza el marcador si ya existe). Retorna
+    (respuesta, bloques_restantes): la respuesta lleva el primer bloque y la cantidad de bloques;
+    los restantes son textos JSON para Bridge.getPointsChunk.
+    """
+    bloques = list(iter_payload_blocks(cambios['agregar'] + cambios['actualizar'], puntos_por_bloque))
+    respuesta = {
+        'quitar': cambios['quitar'],
+        'agregados': len(cambios['agregar']),
+        'actualizados': len(cambios['actualizar']),
+        'bloques': len(bloques),
+        'primer_bloque': bloques[0] if bloques else None,
+    }
+    return respuesta, [json.dumps(bloque, default=str) for bloque in bloques[1:]]
+
+
+def benchmark_view_payload(cluster_index, vistas, puntos_por_bloque=DEFAULT_PUNTOS_POR_BLOQUE):
+    """
+    Mide la respuesta de Bridge.getPointsInView para cada vista (zoom, (sur, oeste, norte, este)),
+    como si el mapa estuviera vacío (primera vista después de una carga): la diferencia como
+    listas de diccionarios en un solo JSON (formato anterior) contra los bloques columnares.
+    Retorna totales de tiempo de serialización y bytes, y el tamaño de la primera respuesta.
+    """
+    from app.map_diff import MapState
+
+    resultado = {
+        'puntos': 0,
+        'dicts': {'segundos': 0.0, 'bytes': 0},
+        'columnar': {'segundos': 0.0, 'bytes': 0, 'bytes_primera_respuesta': 0, 'bloques': 0},
+    }
+    for zoom, limites in vistas:
+        vista = cluster_index.get_view(zoom, limites)
+        cambios = MapState().diff(vista['puntos'])
+        resultado['puntos'] += len(vista['puntos'])
+
+        inicio = time.perf_counter()
+        texto = json.dumps({'status': 'success', 'zoom': vista['zoom'], 'clusters': vista['clusters'], **cambios}, default=str)
+        resultado['dicts']['segundos'] += time.perf_counter() - inicio
+        resultado['dicts']['bytes'] += len(texto.encode('utf-8'))
+
+        inicio = time.perf_counter()
+        respuesta, restantes = view_payload(cambios, puntos_por_bloque)
+        primera = json.dumps({'status': 'success', 'zoom': vista['zoom'], 'clusters': vista['clusters'], **respuesta}, default=str)
+        resultado['columnar']['segundos'] += time.perf_counter() - inicio
+        resultado['columnar']['bytes_primera_respuesta'] += len(primera.encode('utf-8'))
+        resultado['columnar']['bytes'] += len(primera.encode('utf-8')) + sum(len(b) for b in restantes)
+        resultado['columnar']['bloques'] += respuesta['bloques']
+
+    print(f"--- [map_payload.py] {len(vistas)} vistas, {resultado['puntos']} puntos: diccionarios "
+          f"{resultado['dicts']['bytes'] / 1e6:.2f} MB en {resultado['dicts']['segundos']:.3f}s, columnar "
+          f"{resultado['columnar']['bytes'] / 1e6:.2f} MB en {resultado['columnar']['segundos']:.3f}s "
+          f"({resultado['columnar']['bloques']} bloques) ---")
+    return resultado
@@ -0,0 +1,125 @@
+# app/marker_layer.py
+
+import json
+
+import numpy as np
+import pandas as pd
+
+# Capa de marcadores "por datos" para el mapa de Folium. En lugar de un folium.Marker con su
+# DivIcon y su folium.Popup por cada punto (cientos de líneas de JS por cliente), los puntos se
+# emiten una sola vez como arreglos por columna y una única función JS crea los marcadores en
+# el navegador. Los íconos se definen una vez por combinación (forma, color, inicial) y los
+# popups se arman recién al abrirlos, con el mismo HTML y las mismas opciones que Folium.
+
+ICON_SIZE = (24, 24)
+ICON_ANCHOR = (ICON_SIZE[0] // 2, ICON_SIZE[1] // 2)
+
+
+def icon_html(shape, color, first_letter_vend):
+    """
+    HTML del DivIcon de un punto ('circle' o 'diamond'); None para otras formas.
+    El estilo está en las clases de map_generator.MARKER_ICON_CSS.
+    """
+    if shape == 'circle':
+        return f'<div class="mapa-icono mapa-icono-circle mapa-color-{color}">{first_letter_vend}</div>'
+    if shape == 'diamond':
+        return f'<div class="mapa-icono mapa-icono-diamond mapa-color-{color}"><span>{first_letter_vend}</span></div>'
+    return None
+
+
+def build_marker_payload(df_map_points):
+    """
+    Arma el JSON de la capa de marcadores a partir del DataFrame de puntos:
+    {'iconos': [html], 'lat': [...], 'lon': [...], 'icono': [i], 'ref': [...], 'popups': [html], 'lazy': bool}.
+    Con la columna 'popup_datos' (popups bajo demanda) 'ref' es el id_cliente de cada punto;
+    si no, es el índice de su HTML en 'popups'.
+    Retorna (payload_json, popups_perezosos, cantidad_de_puntos), donde popups_perezosos es la
+    lista (id_cliente, popup_datos) para build_popup_lookup.
+    """
+    lazy_popups = 'popup_datos' in df_map_points.columns
+
+    lat = pd.to_numeric(df_map_points['LATITUD'], errors='coerce')
+    lon = pd.to_numeric(df_map_points['LONGITUD'], errors='coerce')
+    validos = (lat.notna() & lon.notna() & df_map_points['shape'].isin(['circle', 'diamond'])).to_numpy()
+    descartados = int((~(lat.notna() & lon.notna())).sum())
+    if descartados:
+        print(f"Advertencia: Saltando {descartados} puntos con coordenadas inválidas/nulas.")
+
+    df = df_map_points[validos]
+    if 'first_letter_vend' in df.columns:
+        letras = df['first_letter_vend'].astype(str)
+    else:
+        letras = pd.Series('?', index=df.index)
+
+    # Un ícono por combinación (forma, color, inicial): en la práctica unas pocas decenas
+    combinaciones = pd.MultiIndex.from_arrays([df['shape'].astype(str), df['color'].astype(str), letras])
+    codigos, unicos = pd.factorize(combinaciones)
+    iconos = [icon_html(shape, color, letra) for shape, color, letra in unicos]
+
+    popups = []
+    popups_perezosos = []
+    if lazy_popups:
+        ids = df['id_cliente'].tolist()
+        ref = ids
+        popups_perezosos = list(zip(ids, df['popup_datos']))
+    else:
+        popups = df['popup_html'].tolist()
+        ref = list(range(len(popups)))
+
+    payload = {
+        'iconos': iconos,
+        'lat': lat[validos].astype(float).tolist(),
+        'lon': lon[validos].astype(float).tolist(),
+        'icono': np.asarray(codigos, dtype=np.int64).tolist(),
+        'ref': ref,
+        'popups': popups,
+        'lazy': lazy_popups,
+    }
+    payload_json = json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str)
+    # Un '</script>' dentro de un popup cerraría el bloque de script del mapa
+    return payload_json.replace('</', '<\\/'), popups_perezosos, len(df)
+
+
+# Script para Folium: {cluster} es la capa MarkerCluster y {payload} el JSON de build_marker_payload.
+# Los íconos y los popups usan las mismas opciones que folium.DivIcon y folium.Popup(max_width=300).
+DATA_MARKER_JS_TEMPLATE = """
+    (function() {{
+        var datos = {payload};
+
+        var iconos = datos.iconos.map(function(html) {{
+            return L.divIcon({{html: html, iconSize: [{ancho}, {alto}], iconAnchor: [{ancla_x}, {ancla_y}], className: 'empty'}});
+        }});
+
+        function contenidoPopup(marcador) {{
+            var div = document.createElement('div');
+            div.style.width = '100.0%';
+            div.style.height = '100.0%';
+            div.innerHTML = datos.popups[marcador.options.popupRef];
+            return div;
+        }}
+
+        var marcadores = new Array(datos.lat.length);
+        for (var i = 0; i < datos.lat.length; i++) {{
+            var opciones = {{icon: iconos[datos.icono[i]]}};
+            if (datos.lazy) {{
+                opciones.idCliente = datos.ref[i];
+            }} else {{
+                opciones.popupRef = datos.ref[i];
+            }}
+            var marcador = L.marker([datos.lat[i], datos.lon[i]], opciones);
+            if (!datos.lazy) {{
+                marcador.bindPopup(contenidoPopup, {{maxWidth: 300}});
+            }}
+            marcadores[i] = marcador;
+        }}
+        {cluster}.addLayers(marcadores);
+    }})();
+"""
+
+
+def data_marker_script(cluster_name, payload_json):
+    """JS que crea todos los marcadores de 'payload_json' dentro de la capa 'cluster_name'."""
+    return DATA_MARKER_JS_TEMPLATE.format(
+        cluster=cluster_name, payload=payload_json,
+        ancho=ICON_SIZE[0], alto=ICON_SIZE[1], ancla_x=ICON_ANCHOR[0], ancla_y=ICON_ANCHOR[1],
+    )
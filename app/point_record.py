@@ -0,0 +1,256 @@
+# app/point_record.py
+
+import math
+from decimal import Decimal
+
+import pandas as pd
+
+from app.color_calculator import _clasificar_cliente, _popup_de_cliente
+
+# Representación compacta de los puntos del mapa. En lugar de un diccionario de ~20 claves por
+# cliente, cada punto es un PointRecord con __slots__ y los textos de baja cardinalidad
+# (vendedor, marca, categoría, departamento, ciudad, color, forma, inicial) se guardan como
+# códigos enteros en tablas compartidas por todos los puntos (CodeTable).
+# Los adaptadores to_dicts() y to_dataframe() entregan el formato que esperan los consumidores
+# existentes (json.dumps hacia el mapa, calculate_statistics, DataFrame de Streamlit).
+
+SIN_CODIGO = -1  # Código de los valores nulos
+
+
+class CodeTable:
+    """Tabla compartida valor <-> código entero (None se codifica como SIN_CODIGO)."""
+
+    __slots__ = ('_codigos', 'valores')
+
+    def __init__(self, valores=()):
+        self.valores = []
+        self._codigos = {}
+        for valor in valores:
+            self.code(valor)
+
+    def code(self, valor):
+        if valor is None:
+            return SIN_CODIGO
+        codigo = self._codigos.get(valor)
+        if codigo is None:
+            codigo = len(self.valores)
+            self._codigos[valor] = codigo
+            self.valores.append(valor)
+        return codigo
+
+    def value(self, codigo):
+        return None if codigo == SIN_CODIGO else self.valores[codigo]
+
+    def __len__(self):
+        return len(self.valores)
+
+
+class PointRecord:
+    """Un punto del mapa. Los campos *_cod son códigos en las CodeTable del PointStore."""
+
+    __slots__ = (
+        'id_cliente', 'descripcion_cliente', 'latitud', 'longitud',
+        'id_vend', 'id_marca', 'id_categoria', 'id_dpto', 'id_ciudad', 'preventa',
+        'vendedor_cod', 'marca_cod', 'categoria_cod', 'dpto_cod', 'ciudad_cod',
+        'color_cod', 'shape_cod', 'inicial_cod', 'popup_html',
+    )
+
+    def __init__(self, id_cliente, descripcion_cliente, latitud, longitud,
+                 id_vend, id_marca, id_categoria, id_dpto, id_ciudad, preventa,
+                 vendedor_cod, marca_cod, categoria_cod, dpto_cod, ciudad_cod,
+                 color_cod, shape_cod, inicial_cod, popup_html=None):
+        self.id_cliente = id_cliente
+        self.descripcion_cliente = descripcion_cliente
+        self.latitud = latitud
+        self.longitud = longitud
+        self.id_vend = id_vend
+        self.id_marca = id_marca
+        self.id_categoria = id_categoria
+        self.id_dpto = id_dpto
+        self.id_ciudad = id_ciudad
+        self.preventa = preventa
+        self.vendedor_cod = vendedor_cod
+        self.marca_cod = marca_cod
+        self.categoria_cod = categoria_cod
+        self.dpto_cod = dpto_cod
+        self.ciudad_cod = ciudad_cod
+        self.color_cod = color_cod
+        self.shape_cod = shape_cod
+        self.inicial_cod = inicial_cod
+        self.popup_html = popup_html
+
+
+def _coordenada(valor):
+    return float(valor) if isinstance(valor, Decimal) else valor
+
+
+def _como_float(valor):
+    return math.nan if valor is None else float(valor)
+
+
+class PointStore:
+    """
+    Colección de PointRecord con sus tablas de códigos. Se arma con
+    color_calculator.calculate_point_records y se adapta con to_dicts() / to_dataframe().
+    Los registros se agregan de a uno (agregar / consumir) a medida que los produce el merge join;
+    al agregarlos se acumulan las columnas que usan ClusterIndex y statistics(), que así no
+    vuelven a recorrer los registros.
+    """
+
+    def __init__(self):
+        self.registros = []
+        self.latitudes = []      # float, NaN si falta
+        self.longitudes = []
+        self.codigos_forma = []  # shape_cod de cada registro
+        self.codigos_color = []  # color_cod de cada registro
+        self._conteo = {}        # (shape_cod, color_cod) -> cantidad de registros
+        self._clientes = set()
+        self.vendedores = CodeTable()
+        self.marcas = CodeTable()
+        self.categorias = CodeTable()
+        self.departamentos = CodeTable()
+        self.ciudades = CodeTable()
+        self.colores = CodeTable(['green', 'orange', 'red', 'black'])
+        self.formas = CodeTable(['circle', 'diamond'])
+        self.iniciales = CodeTable()
+
+    def construir(self, id_cliente, datos_cliente, transito_cliente, popup_index, hoy):
+        """Misma firma que color_calculator._construir_punto, pero retorna un PointRecord."""
+        color, shape, inicial = _clasificar_cliente(datos_cliente, transito_cliente, hoy)
+        return PointRecord(
+            id_cliente,
+            datos_cliente.get("descripcion_cliente"),
+            _coordenada(datos_cliente.get("latitud")),
+            _coordenada(datos_cliente.get("longitud")),
+            datos_cliente.get("id_vend"),
+            datos_cliente.get("id_marca"),
+            datos_cliente.get("id_categoria"),
+            datos_cliente.get("id_dpto"),
+            datos_cliente.get("id_ciudad"),
+            datos_cliente.get("preventa"),
+            self.vendedores.code(datos_cliente.get("descripcion_vend")),
+            self.marcas.code(datos_cliente.get("descripcion_marca")),
+            self.categorias.code(datos_cliente.get("DESCRIPCION_CATEGORIA")),
+            self.departamentos.code(datos_cliente.get("DESCRIPCION_DPTO")),
+            self.ciudades.code(datos_cliente.get("DESCRIPCION_CIUDAD")),
+            self.colores.code(color),
+            self.formas.code(shape),
+            self.iniciales.code(inicial),
+            _popup_de_cliente(id_cliente, datos_cliente, transito_cliente, popup_index),
+        )
+
+    def agregar(self, registro):
+        self.registros.append(registro)
+        self.latitudes.append(_como_float(registro.latitud))
+        self.longitudes.append(_como_float(registro.longitud))
+        self.codigos_forma.append(registro.shape_cod)
+        self.codigos_color.append(registro.color_cod)
+        clave = (registro.shape_cod, registro.color_cod)
+        self._conteo[clave] = self._conteo.get(clave, 0) + 1
+        if registro.id_cliente is not None:
+            self._clientes.add(registro.id_cliente)
+
+    def consumir(self, registros):
+        """Agrega los registros de un iterable (por ejemplo el generador del merge join) a medida que llegan."""
+        for registro in registros:
+            self.agregar(registro)
+        return self
+
+    def __len__(self):
+        return len(self.registros)
+
+    def __iter__(self):
+        return iter(self.registros)
+
+    # --- Adaptadores para los consumidores existentes ---
+
+    def to_dict(self, registro):
+        """Diccionario con las mismas claves (y orden) que color_calculator._construir_punto."""
+        punto = {
+            "id_cliente": registro.id_cliente,
+            "descripcion_cliente": registro.descripcion_cliente,
+            "LATITUD": registro.latitud,
+            "LONGITUD": registro.longitud,
+            "id_vend": registro.id_vend,
+            "descripcion_vend": self.vendedores.value(registro.vendedor_cod),
+            "descripcion_marca": self.marcas.value(registro.marca_cod),
+            "preventa": registro.preventa,
+            "id_marca": registro.id_marca,
+            "id_categoria": registro.id_categoria,
+            "DESCRIPCION_CATEGORIA": self.categorias.value(registro.categoria_cod),
+            "id_dpto": registro.id_dpto,
+            "DESCRIPCION_DPTO": self.departamentos.value(registro.dpto_cod),
+            "id_ciudad": registro.id_ciudad,
+            "DESCRIPCION_CIUDAD": self.ciudades.value(registro.ciudad_cod),
+            "color": self.colores.value(registro.color_cod),
+            "shape": self.formas.value(registro.shape_cod),
+            "popup_html": registro.popup_html,
+            "first_letter_vend": self.iniciales.value(registro.inicial_cod),
+        }
+        if registro.popup_html is None:
+            del punto["popup_html"]
+        return punto
+
+    def to_dicts(self):
+        """Lista de diccionarios (para json.dumps hacia el mapa o código que aún espera dicts)."""
+        return [self.to_dict(registro) for registro in self.registros]
+
+    def to_dataframe(self):
+        """
+        DataFrame con las columnas de los diccionarios; los textos de baja cardinalidad quedan
+        como pd.Categorical armados directamente desde los códigos (sin pasar por strings).
+        """
+        def _columna(atributo):
+            return [getattr(registro, atributo) for registro in self.registros]
+
+        def _categorica(atributo, tabla):
+            return pd.Categorical.from_codes(_columna(atributo), categories=pd.Index(tabla.valores, dtype=object))
+
+        columnas = {
+            "id_cliente": _columna('id_cliente'),
+            "descripcion_cliente": _columna('descripcion_cliente'),
+            "LATITUD": _columna('latitud'),
+            "LONGITUD": _columna('longitud'),
+            "id_vend": _columna('id_vend'),
+            "descripcion_vend": _categorica('vendedor_cod', self.vendedores),
+            "descripcion_marca": _categorica('marca_cod', self.marcas),
+            "preventa": _columna('preventa'),
+            "id_marca": _columna('id_marca'),
+            "id_categoria": _columna('id_categoria'),
+            "DESCRIPCION_CATEGORIA": _categorica('categoria_cod', self.categorias),
+            "id_dpto": _columna('id_dpto'),
+            "DESCRIPCION_DPTO": _categorica('dpto_cod', self.departamentos),
+            "id_ciudad": _columna('id_ciudad'),
+            "DESCRIPCION_CIUDAD": _categorica('ciudad_cod', self.ciudades),
+            "color": _categorica('color_cod', self.colores),
+            "shape": _categorica('shape_cod', self.formas),
+        }
+        if any(registro.popup_html is not None for registro in self.registros):
+            columnas["popup_html"] = _columna('popup_html')
+        columnas["first_letter_vend"] = _categorica('inicial_cod', self.iniciales)
+        return pd.DataFrame(columnas)
+
+    def statistics(self):
+        """
+        Mismas estadísticas que map_generator.calculate_statistics, a partir de los conteos por
+        código acumulados en agregar().
+        """
+        circulo = self.formas.code('circle')
+
+        def _contar(forma, color):
+            return self._conteo.get((self.formas.code(forma), self.colores.code(color)), 0)
+
+        total_circulos = sum(n for (forma, _), n in self._conteo.items() if forma == circulo)
+        return {
+            'total_general_clientes': len(self._clientes),
+            'total_circles': total_circulos,
+            'circles_green': _contar('circle', 'green'),
+            'circles_orange': _contar('circle', 'orange'),
+            'circles_red': _contar('circle', 'red'),
+            'circles_black': _contar('circle', 'black'),
+            'total_diamonds': len(self.registros) - total_circulos,
+            'diamonds_green': _contar('diamond', 'green'),
+            'diamonds_orange': _contar('diamond', 'orange'),
+            'diamonds_red': _contar('diamond', 'red'),
+            'diamonds_black': _contar('diamond', 'black'),
+        }
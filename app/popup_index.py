@@ -0,0 +1,103 @@
+# app/popup_index.py
+
+import json
+import threading
+
+from app.color_calculator import render_popup_cliente
+from app.popup_templates import PopupFragmentCache
+
+# Popups bajo demanda: en lugar de armar el HTML de cada cliente al procesar los puntos,
+# se guardan solo los datos necesarios (popup_datos) y el HTML se genera cuando el usuario
+# hace clic en el marcador:
+#   - App PyQt: PopupIndex queda en Python y el JS lo pide con Bridge.getPopupHtml(id_cliente).
+#   - Folium/Streamlit: el mapa es HTML estático, así que build_popup_lookup incrusta una tabla
+#     id -> HTML ya renderizado en Python (mismas plantillas y caché de fragmentos que la app PyQt)
+#     y LAZY_POPUP_JS_TEMPLATE solo lo enlaza al marcador en el primer clic.
+
+_CAMPOS_POPUP = [
+    'id_cliente', 'descripcion_cliente', 'ultima_venta_stock_date', 'descripcion_vend',
+    'descripcion_marca', 'DESCRIPCION_CATEGORIA', 'DESCRIPCION_DPTO', 'DESCRIPCION_CIUDAD',
+]
+
+
+def popup_datos(datos_cliente, transito_cliente):
+    """Datos mínimos de un cliente para renderizar su popup más tarde (sin armar HTML)."""
+    datos = {campo: datos_cliente.get(campo) for campo in _CAMPOS_POPUP if campo in datos_cliente}
+    datos['transito'] = transito_cliente
+    return datos
+
+
+def render_popup(datos):
+    """Genera el HTML completo del popup, idéntico al que se arma por adelantado."""
+    return render_popup_cliente(datos, datos.get('transito') or [])
+
+
+class PopupIndex:
+    """Índice id_cliente -> popup_datos, con el HTML generado solo al pedirlo."""
+
+    def __init__(self):
+        self._datos = {}
+        self._lock = threading.Lock()
+        self.renders = 0
+
+    @staticmethod
+    def _clave(id_cliente):
+        # El JS envía los IDs como texto: se indexa siempre por str para que 123 y "123" coincidan
+        return str(id_cliente)
+
+    def add(self, id_cliente, datos):
+        self._datos[self._clave(id_cliente)] = datos
+
+    def render(self, id_cliente):
+        """Retorna el HTML del popup del cliente, o None si no está en el índice."""
+        datos = self._datos.get(self._clave(id_cliente))
+        if datos is None:
+            return None
+        with self._lock:
+            self.renders += 1
+        return render_popup(datos)
+
+    def version(self, id_cliente):
+        """
+        Huella del contenido del popup del cliente (la misma clave que usa la caché de fragmentos),
+        para detectar si cambió entre dos cargas sin renderizarlo. None si no está en el índice.
+        """
+        datos = self._datos.get(self._clave(id_cliente))
+        if datos is None:
+            return None
+        return PopupFragmentCache.make_key(datos, datos.get('transito'))
+
+    def __len__(self):
+        return len(self._datos)
+
+    def __contains__(self, id_cliente):
+        return self._clave(id_cliente) in self._datos
+
+
+# --- Tabla de consulta para el mapa de Folium ---
+
+def build_popup_lookup(ids_y_datos):
+    """Serializa a JSON la tabla id_cliente -> HTML del popup (render_popup) para incrustarla en el mapa."""
+    lookup = json.dumps({str(id_cliente): render_popup(datos) for id_cliente, datos in ids_y_datos},
+                        ensure_ascii=False)
+    # Un '</script>' dentro de una descripción cerraría el bloque de script del mapa
+    return lookup.replace('</', '<\\/')
+
+
+# Script para Folium: {cluster} es la capa de marcadores y {lookup} la tabla de build_popup_lookup.
+# Cada marcador lleva la opción idCliente; su popup se enlaza en el primer clic.
+LAZY_POPUP_JS_TEMPLATE = """
+    (function() {{
+        var popupLookup = {lookup};
+
+        {cluster}.on('click', function(e) {{
+            var marker = e.layer;
+            var id = marker.options.idCliente;
+            if (id === undefined || marker.getPopup()) {{ return; }}
+            var html = popupLookup[String(id)];
+            if (html) {{
+                marker.bindPopup(html, {{maxWidth: 300}}).openPopup();
+            }}
+        }});
+    }})();
+"""
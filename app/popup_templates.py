@@ -0,0 +1,161 @@
+# app/popup_templates.py
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from jinja2 import Environment
+
+# Plantillas de los popups compiladas una sola vez al importar el módulo, y caché de fragmentos
+# ya renderizados. La salida es idéntica a la de los antiguos formateadores con '+=' (sin
+# autoescape: los textos se insertan tal cual, como antes).
+#
+# La info básica (se arma para todos los clientes) es un formato precompilado de str.format:
+# el costo fijo de crear un contexto Jinja2 por llamada lo haría varias veces más lento.
+# La sección de tránsito, con sus bucles, es una plantilla Jinja2 y solo se renderiza para
+# los clientes que tienen líneas; sin líneas el fragmento es siempre el mismo.
+
+PLANTILLA_INFO_BASICA = (
+    "<div class='popup-content'>"
+    "<h4>{descripcion_cliente} ({id_cliente})</h4>"
+    "<p><strong>Última Venta STOCK:</strong> {ultima_venta}</p>"
+    "<p><strong>Vendedor:</strong> {descripcion_vend}</p>"
+    "<p><strong>Marca (última venta):</strong> {descripcion_marca}</p>"
+    "<p><strong>Categoría:</strong> {categoria}</p>"
+    "<p><strong>Departamento:</strong> {departamento}</p>"
+    "<p><strong>Ciudad:</strong> {ciudad}</p>"
+).format
+
+_env = Environment(autoescape=False)
+
+ENCABEZADO_TRANSITO = "<hr><p><b>Mercadería en Tránsito/Programada:</b></p>"
+TRANSITO_VACIO = ENCABEZADO_TRANSITO + "<p>No hay mercadería en tránsito/programada para este cliente.</p>"
+
+PLANTILLA_TRANSITO = _env.from_string(
+    ENCABEZADO_TRANSITO +
+    "{% for marca, items in lineas %}"
+    "<p><strong>MARCA:</strong> {{ marca }}</p><p>PROGRAMADO:</p><ul>"
+    "{% for fecha, cantidad in items %}<li>{{ fecha }}: {{ cantidad }}</li>{% endfor %}"
+    "</ul><br>"
+    "{% endfor %}"
+)
+
+
+def lineas_para_popup(ventas_cliente):
+    """
+    Convierte las líneas en tránsito de un cliente a [(marca, [(fecha, cantidad), ...]), ...],
+    ya como texto. Si una línea trae 'PROGRAMACION' (lista) se usa cada programación.
+    """
+    lineas = []
+    for venta in ventas_cliente or []:
+        if 'PROGRAMACION' in venta and isinstance(venta['PROGRAMACION'], list):
+            items = [(str(p.get('FECHA', 'N/A')), str(p.get('CANTIDAD', 'N/A'))) for p in venta['PROGRAMACION']]
+        else:
+            items = [(str(venta.get('FECHA', 'N/A')), str(venta.get('CANTIDAD', 'N/A')))]
+        lineas.append((str(venta.get('MARCA', 'N/A')), items))
+    return lineas
+
+
+# --- Caché de fragmentos renderizados ---
+
+DEFAULT_MAX_FRAGMENTOS = 20000
+
+_CAMPOS_DESCRIPTIVOS = (
+    'descripcion_cliente', 'descripcion_vend', 'descripcion_marca',
+    'DESCRIPCION_CATEGORIA', 'DESCRIPCION_DPTO', 'DESCRIPCION_CIUDAD',
+)
+
+
+def huella_transito(transito_cliente):
+    """
+    Hash de las líneas en tránsito de un cliente ('' si no tiene). El JSON crudo de la fila
+    agrupada se hashea sin parsearlo.
+    """
+    if isinstance(transito_cliente, dict):
+        lineas = transito_cliente.get('LINEAS')
+    else:
+        lineas = transito_cliente
+    if not lineas:
+        return ''
+    if not isinstance(lineas, (str, bytes)):
+        lineas = json.dumps(lineas, default=str, sort_keys=True)
+    if isinstance(lineas, str):
+        lineas = lineas.encode('utf-8')
+    return hashlib.blake2b(lineas, digest_size=16).hexdigest()
+
+
+class PopupFragmentCache:
+    """
+    Caché LRU thread-safe de popups renderizados, con clave
+    (id_cliente, ultima_venta_stock_date, huella_transito, descripciones) y contadores
+    de aciertos/fallos.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_FRAGMENTOS):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._fragmentos = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @staticmethod
+    def make_key(datos_cliente, transito_cliente):
+        # Las descripciones del popup también forman parte de la clave: un cambio de nombre de
+        # vendedor o ciudad con la misma fecha de venta no debe devolver un fragmento viejo.
+        return (
+            datos_cliente.get('id_cliente'),
+            datos_cliente.get('ultima_venta_stock_date'),
+            huella_transito(transito_cliente),
+            tuple(datos_cliente.get(campo, 'N/A') for campo in _CAMPOS_DESCRIPTIVOS),
+        )
+
+    def get_or_render(self, datos_cliente, transito_cliente, renderizar):
+        """Retorna el popup en caché o lo genera con 'renderizar()' y lo guarda."""
+        key = self.make_key(datos_cliente, transito_cliente)
+        with self._lock:
+            html = self._fragmentos.get(key)
+            if html is not None:
+                self._fragmentos.move_to_end(key)
+                self._stats['hits'] += 1
+                return html
+            self._stats['misses'] += 1
+
+        html = renderizar()
+
+        with self._lock:
+            self._fragmentos[key] = html
+            self._fragmentos.move_to_end(key)
+            while len(self._fragmentos) > self.max_entries:
+                self._fragmentos.popitem(last=False)
+                self._stats['evictions'] += 1
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._fragmentos.clear()
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._fragmentos)
+            stats['max_entries'] = self.max_entries
+        consultas = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / consultas if consultas else 0.0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_popup_cache():
+    """Retorna la caché de fragmentos de popup compartida por todo el proceso."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PopupFragmentCache()
+        return _cache
@@ -0,0 +1,149 @@
+# app/relation_index.py
+
+import threading
+import time
+
+from app.result_cache import get_data_version
+
+# Índice de relaciones para los dropdowns en cascada (categoría -> marcas, categoría -> vendedores,
+# departamento -> ciudades). En lugar de un SELECT DISTINCT sobre ventas cada vez que cambia la
+# categoría, las relaciones se traen una sola vez por versión de datos (result_cache.get_data_version,
+# que consulta la tabla a lo sumo una vez por intervalo) y las listas de opciones se arman en memoria,
+# con el mismo formato y orden que fetch_marcas / fetch_vendedores / fetch_ciudades de app/database.py.
+
+
+def _como_id(valor):
+    """Filtro de un dropdown (entero o texto) como entero; None si no es un número."""
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_relation_rows(conexion):
+    """
+    Trae las tablas de descripción (ordenadas como en app/database.py) y las relaciones de ventas.
+    A diferencia de los fetch_* de database.py, los errores se propagan: un índice armado con
+    listas vacías por un error quedaría guardado para toda la versión de datos.
+    """
+    consultas = {
+        'categorias': "SELECT id_categoria, descripcion_categoria FROM categoria ORDER BY descripcion_categoria",
+        'marcas': "SELECT id_marca, descripcion_marca FROM marca ORDER BY descripcion_marca",
+        'vendedores': "SELECT ID_VEND, DESCRIPCION_VEND FROM vendedor ORDER BY DESCRIPCION_VEND",
+        'departamentos': "SELECT id_dpto, descripcion_dpto FROM departamento ORDER BY descripcion_dpto",
+        'ciudades': "SELECT id_ciudad, descripcion_ciudad, id_dpto FROM ciudad ORDER BY descripcion_ciudad",
+        'categoria_marca': "SELECT DISTINCT ID_CATEGORIA, ID_MARCA FROM ventas WHERE ID_CATEGORIA IS NOT NULL",
+        'categoria_vendedor': "SELECT DISTINCT ID_CATEGORIA, ID_VEND FROM ventas WHERE ID_CATEGORIA IS NOT NULL",
+    }
+    filas = {}
+    with conexion.cursor() as cursor:
+        for nombre, consulta in consultas.items():
+            cursor.execute(consulta)
+            filas[nombre] = [tuple(fila) for fila in cursor.fetchall()]
+    return filas
+
+
+class RelationIndex:
+    """
+    Listas de opciones de los filtros, precalculadas para cada categoría y departamento.
+    Cada lista es de tuplas (id, descripcion), igual que los fetch_* de app/database.py.
+    """
+
+    def __init__(self, filas, version=None):
+        inicio = time.perf_counter()
+        self.version = version
+        self._categorias = filas['categorias']
+        self._marcas = filas['marcas']
+        self._vendedores = filas['vendedores']
+        self._departamentos = filas['departamentos']
+        self._ciudades = [(id_ciudad, descripcion) for id_ciudad, descripcion, _ in filas['ciudades']]
+
+        self._marcas_por_categoria = self._agrupar(filas['categoria_marca'], self._marcas)
+        self._vendedores_por_categoria = self._agrupar(filas['categoria_vendedor'], self._vendedores)
+        self._ciudades_por_dpto = {}
+        for id_ciudad, descripcion, id_dpto in filas['ciudades']:
+            self._ciudades_por_dpto.setdefault(id_dpto, []).append((id_ciudad, descripcion))
+
+        print(f"--- [relation_index.py] Índice de relaciones armado: {len(self._marcas_por_categoria)} categorías, "
+              f"{len(self._ciudades_por_dpto)} departamentos ({time.perf_counter() - inicio:.3f}s) ---")
+
+    @staticmethod
+    def _agrupar(pares, opciones):
+        """{clave: [opciones cuyo id aparece con esa clave]}, conservando el orden de 'opciones'."""
+        ids_por_clave = {}
+        for clave, id_opcion in pares:
+            ids_por_clave.setdefault(clave, set()).add(id_opcion)
+        return {clave: [opcion for opcion in opciones if opcion[0] in ids] for clave, ids in ids_por_clave.items()}
+
+    @staticmethod
+    def _filtrar(todas, por_clave, valor):
+        if valor is None or valor == '':
+            return list(todas)
+        return list(por_clave.get(_como_id(valor), []))
+
+    def categorias(self):
+        return list(self._categorias)
+
+    def marcas(self, id_categoria=None):
+        """Marcas vendidas en la categoría (todas si no se indica), como fetch_marcas."""
+        return self._filtrar(self._marcas, self._marcas_por_categoria, id_categoria)
+
+    def vendedores(self, id_categoria=None):
+        """Vendedores con ventas en la categoría (todos si no se indica), como fetch_vendedores."""
+        return self._filtrar(self._vendedores, self._vendedores_por_categoria, id_categoria)
+
+    def departamentos(self):
+        return list(self._departamentos)
+
+    def ciudades(self, id_dpto=None):
+        """Ciudades del departamento (todas si no se indica), como fetch_ciudades."""
+        return self._filtrar(self._ciudades, self._ciudades_por_dpto, id_dpto)
+
+
+class RelationIndexCache:
+    """Guarda el RelationIndex vigente y lo vuelve a armar cuando cambia la versión de datos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indice = None
+
+    def get(self, pool):
+        """
+        Retorna el índice vigente; lo rearma si la versión de datos (con límite de frecuencia, ver
+        result_cache.DataVersionProbe) no coincide con la suya. Si la versión no se pudo consultar
+        se usa el índice anterior. Retorna None si nunca se pudo armar (los llamadores vuelven a
+        las consultas SQL).
+        """
+        with self._lock:
+            try:
+                version = get_data_version(pool)
+                if self._indice is not None and (version is None or version == self._indice.version):
+                    return self._indice
+                if pool is None:
+                    return self._indice
+                with pool.connection() as conexion:
+                    if conexion is None:
+                        print("Advertencia: Sin conexión para armar el índice de relaciones; se usa el anterior.")
+                        return self._indice
+                    self._indice = RelationIndex(fetch_relation_rows(conexion), version)
+            except Exception as e:
+                print(f"Error al armar el índice de relaciones de filtros: {e}")
+            return self._indice
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_relation_index_cache():
+    """Retorna el caché del índice de relaciones compartido por todo el proceso."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RelationIndexCache()
+        return _cache
+
+
+def get_relation_index(pool):
+    """Atajo: índice de relaciones vigente para 'pool' (o None si no se pudo armar)."""
+    return get_relation_index_cache().get(pool)
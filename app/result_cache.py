@@ -0,0 +1,241 @@
+# app/result_cache.py
+
+import threading
+import time
+from collections import OrderedDict
+
+import pymysql
+
+# Caché de resultados del mapa compartido por la app PyQt (DataWorker) y la de Streamlit.
+# La clave es el diccionario de filtros normalizado más una "versión de datos" barata de
+# consultar (UPDATE_TIME de information_schema y MAX(ID) de ventas, ver probe_data_version): si la
+# tabla cambia, cambia la versión y las entradas viejas dejan de coincidir, así una vista repetida
+# es instantánea pero no muestra datos desactualizados.
+# Los llamadores usan get_data_version(): la versión de cada base se vuelve a consultar a lo sumo
+# cada DEFAULT_INTERVALO_VERSION segundos (un cambio en ventas tarda como máximo ese intervalo en
+# verse), así los reruns seguidos de Streamlit no consultan la base en cada uno.
+
+DEFAULT_MAX_ENTRIES = 32
+DEFAULT_INTERVALO_VERSION = 5  # Segundos durante los que se reutiliza la última versión consultada
+
+# Nombres de filtros de la app de Streamlit -> nombres usados por app/database.py
+_ALIAS_FILTROS = {
+    'categoria_id': 'id_categoria',
+    'marca_id': 'id_marca',
+    'vendedor_desc': 'descripcion_vend',
+    'departamento_id': 'id_dpto',
+    'ciudad_id': 'id_ciudad',
+}
+
+
+def normalize_filters(filtros):
+    """
+    Normaliza un diccionario de filtros a una tupla ordenada y hasheable: unifica los nombres de
+    Streamlit y PyQt, descarta los filtros vacíos (None o '') y convierte los IDs numéricos a int,
+    para que {'id_marca': '3'} y {'marca_id': 3, 'id_dpto': None} den la misma clave.
+    """
+    normalizados = {}
+    for clave, valor in (filtros or {}).items():
+        clave = _ALIAS_FILTROS.get(clave, clave)
+        if valor is None or valor == '':
+            continue
+        if isinstance(valor, str):
+            valor = valor.strip()
+            if clave.startswith('id_') and valor.lstrip('-').isdigit():
+                valor = int(valor)
+        normalizados[clave] = valor
+    return tuple(sorted(normalizados.items()))
+
+
+def probe_data_version(conexion):
+    """
+    Consulta que identifica el estado de la tabla ventas sin recorrerla. Retorna una tupla
+    (update_time, max_id) o None si no se pudo consultar.
+    - UPDATE_TIME (information_schema.TABLES) cambia con cada INSERT/UPDATE/DELETE confirmado,
+      incluidas las ventas en tránsito que pasan a PREVENTA=1 sin cambiar su FECHA. En MySQL 8 se
+      pide sin la caché de estadísticas (information_schema_stats_expiry); InnoDB lo deja en NULL
+      tras reiniciar el servidor hasta la próxima escritura.
+    - MAX(ID) se resuelve con la clave primaria y detecta inserciones aunque UPDATE_TIME falte.
+    """
+    try:
+        with conexion.cursor() as cursor:
+            try:
+                cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+            except pymysql.MySQLError:
+                pass  # MySQL 5.7 / MariaDB: UPDATE_TIME no se cachea
+            cursor.execute(
+                "SELECT UPDATE_TIME FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'ventas'"
+            )
+            fila = cursor.fetchone()
+            update_time = fila[0] if fila else None
+            try:
+                cursor.execute("SELECT MAX(ID) FROM ventas")
+                max_id = cursor.fetchone()[0]
+            except pymysql.MySQLError:
+                max_id = None  # Tabla sin columna ID: solo UPDATE_TIME
+        if update_time is None and max_id is None:
+            # Sin ninguno de los dos no se distinguen versiones: mejor no cachear
+            print("Advertencia: La tabla ventas no informa UPDATE_TIME ni MAX(ID); no se usa el caché de resultados.")
+            return None
+        return (None if update_time is None else str(update_time), max_id)
+    except Exception as e:
+        print(f"Advertencia: No se pudo consultar la versión de datos de ventas: {e}")
+        return None
+
+
+def _clave_pool(pool):
+    """Identifica la base de un pool (app/db_pool.ConnectionPool): host, puerto y base de datos."""
+    db_config = getattr(pool, 'db_config', None)
+    if not db_config:
+        return id(pool)
+    return (db_config.get('host'), db_config.get('port'), db_config.get('database'))
+
+
+class DataVersionProbe:
+    """
+    probe_data_version con límite de frecuencia por base de datos, compartido por todo el proceso:
+    dentro de 'intervalo' segundos desde la última consulta exitosa a la base de un pool se
+    reutiliza la misma versión.
+    """
+
+    def __init__(self, intervalo=DEFAULT_INTERVALO_VERSION):
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._versiones = {}  # clave del pool -> (versión, time.monotonic() de la consulta)
+
+    def get(self, pool):
+        """Versión de datos vigente (sin consultar la base dentro del intervalo) o None si no se pudo consultar."""
+        if pool is None:
+            return None
+        clave = _clave_pool(pool)
+        ahora = time.monotonic()
+        with self._lock:
+            guardada = self._versiones.get(clave)
+        if guardada is not None and ahora - guardada[1] < self.intervalo:
+            return guardada[0]
+
+        # La consulta va fuera del lock: es indexada, y una base lenta no frena a las demás
+        with pool.connection() as conexion:
+            version = probe_data_version(conexion) if conexion is not None else None
+        # Un fallo no se recuerda: la próxima llamada vuelve a intentar
+        if version is not None:
+            with self._lock:
+                self._versiones[clave] = (version, ahora)
+        return version
+
+    def invalidate(self, pool=None):
+        """Fuerza a consultar la versión de 'pool' (o de todas las bases) en la próxima llamada."""
+        with self._lock:
+            if pool is None:
+                self._versiones.clear()
+            else:
+                self._versiones.pop(_clave_pool(pool), None)
+
+
+class ResultCache:
+    """
+    Caché LRU thread-safe de resultados del mapa, acotado a 'max_entries' entradas,
+    con contadores de aciertos, fallos y desalojos.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (espacio, version, filtros) -> resultado
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    @staticmethod
+    def make_key(espacio, filtros, version):
+        """'espacio' separa resultados de distinta forma (por ejemplo 'pyqt' y 'streamlit')."""
+        return (espacio, version, normalize_filters(filtros))
+
+    def get(self, key):
+        """Retorna el resultado guardado (y lo marca como el más reciente) o None si no está."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return self._entries[key]
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, key, resultado):
+        with self._lock:
+            espacio, version, _ = key
+            # Las entradas del mismo espacio con otra versión de datos ya no pueden acertar
+            viejas = [k for k in self._entries if k[0] == espacio and k[1] != version]
+            for k in viejas:
+                del self._entries[k]
+            self._stats['invalidations'] += len(viejas)
+
+            self._entries[key] = resultado
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def get_or_compute(self, espacio, filtros, version, calcular):
+        """
+        Retorna el resultado en caché para (espacio, filtros, version) o lo calcula con
+        'calcular()' y lo guarda. Si 'version' es None (no se pudo consultar) no se usa el caché.
+        """
+        if version is None:
+            return calcular()
+        key = self.make_key(espacio, filtros, version)
+        resultado = self.get(key)
+        if resultado is not None:
+            print(f"--- [result_cache.py] Acierto de caché para {key[2]} ({self.stats_resumen()}) ---")
+            return resultado
+        resultado = calcular()
+        if resultado is not None:
+            self.put(key, resultado)
+        return resultado
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['max_entries'] = self.max_entries
+        consultas = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / consultas if consultas else 0.0
+        return stats
+
+    def stats_resumen(self):
+        stats = self.stats()
+        return f"aciertos={stats['hits']}, fallos={stats['misses']}, entradas={stats['entries']}/{stats['max_entries']}"
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Retorna el caché de resultados compartido por todo el proceso."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
+
+
+_version_probe = None
+_version_probe_lock = threading.Lock()
+
+
+def get_data_version_probe():
+    """Retorna el DataVersionProbe compartido por todo el proceso."""
+    global _version_probe
+    with _version_probe_lock:
+        if _version_probe is None:
+            _version_probe = DataVersionProbe()
+        return _version_probe
+
+
+def get_data_version(pool):
+    """Atajo: versión de datos de ventas con límite de frecuencia (ver DataVersionProbe)."""
+    return get_data_version_probe().get(pool)
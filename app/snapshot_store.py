@@ -0,0 +1,504 @@
+# app/snapshot_store.py
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+import pymysql
+
+# Snapshot local (SQLite) del conjunto de datos del mapa.
+# Guarda, por cliente y combinación (categoría, marca, vendedor), la fecha de la última venta
+# PREVENTA=1, más las líneas en tránsito (PREVENTA 2/3), los puntos de venta y las tablas de
+# descripción. Con eso cualquier combinación de filtros se responde localmente, sin red.
+#
+# Refresco incremental: solo se traen las ventas PREVENTA=1 con FECHA >= marca de agua guardada
+# y se combinan con MAX(). Las ventas anteriores a la marca de agua se verifican con un control
+# (cantidad de filas y suma de CRC32, ver fetch_control_preventa_1): si una venta vieja se agregó,
+# cambió, se borró o cambió de PREVENTA, el control no coincide y se reconstruye completo.
+# Las líneas en tránsito y las tablas pequeñas se reemplazan completas en cada refresco, porque
+# pueden cambiar o borrarse sin que cambie su FECHA.
+
+SNAPSHOT_FILENAME = "mapa_snapshot.sqlite3"
+DEFAULT_MAX_AGE = 15 * 60             # Segundos tras los cuales se hace un refresco incremental
+DEFAULT_REBUILD_AFTER = 24 * 60 * 60  # Segundos tras los cuales se reconstruye desde cero
+
+SIN_ID = -1  # Valor guardado en lugar de NULL en las claves de ultima_venta_p1
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (
+        clave TEXT PRIMARY KEY,
+        valor TEXT
+    );
+    CREATE TABLE IF NOT EXISTS ultima_venta_p1 (
+        id_cliente INTEGER NOT NULL,
+        id_categoria INTEGER NOT NULL,
+        id_marca INTEGER NOT NULL,
+        id_vend INTEGER NOT NULL,
+        ultima_fecha TEXT,
+        PRIMARY KEY (id_cliente, id_categoria, id_marca, id_vend)
+    );
+    CREATE TABLE IF NOT EXISTS transito (
+        id_cliente INTEGER NOT NULL,
+        id_marca INTEGER,
+        fecha TEXT,
+        tipo TEXT,
+        marca TEXT,
+        cantidad TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_transito_cliente ON transito (id_cliente);
+    CREATE TABLE IF NOT EXISTS puntos_venta (
+        id_cliente INTEGER PRIMARY KEY,
+        descripcion_cliente TEXT,
+        latitud REAL,
+        longitud REAL,
+        id_dpto INTEGER,
+        id_ciudad INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS vendedor (id_vend INTEGER PRIMARY KEY, descripcion_vend TEXT);
+    CREATE TABLE IF NOT EXISTS marca (id_marca INTEGER PRIMARY KEY, descripcion_marca TEXT);
+    CREATE TABLE IF NOT EXISTS categoria (id_categoria INTEGER PRIMARY KEY, descripcion_categoria TEXT);
+    CREATE TABLE IF NOT EXISTS departamento (id_dpto INTEGER PRIMARY KEY, descripcion_dpto TEXT);
+    CREATE TABLE IF NOT EXISTS ciudad (id_ciudad INTEGER PRIMARY KEY, descripcion_ciudad TEXT);
+"""
+
+
+def get_cache_dir():
+    """
+    Directorio del caché local. Se puede cambiar con la variable de entorno MAPA_CACHE_DIR;
+    por defecto ~/.mapa_interactivo (funciona igual en desarrollo y en el ejecutable de PyInstaller).
+    """
+    cache_dir = os.environ.get("MAPA_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".mapa_interactivo")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def _texto(valor):
+    """Convierte fechas y decimales a texto para SQLite (las fechas ISO se comparan bien como texto)."""
+    if valor is None:
+        return None
+    if isinstance(valor, (datetime, date, Decimal)):
+        return str(valor)
+    return valor
+
+
+def _filtro_presente(valor):
+    return valor is not None and valor != ''
+
+
+def fetch_dataset_rows(conexion, watermark=None):
+    """
+    Trae de MySQL el dataset del mapa sin filtrar: última fecha PREVENTA=1 por (cliente, categoría,
+    marca, vendedor) (solo FECHA >= 'watermark' si se indica), líneas en tránsito, puntos de venta
+    con coordenadas y tablas de descripción. Lo usan el snapshot local y el FilterManager en memoria.
+    Retorna (ventas_p1, transito, puntos, tablas).
+    """
+    with conexion.cursor(pymysql.cursors.DictCursor) as cursor:
+        query = f"""
+            SELECT
+                ID_CLIENTE,
+                COALESCE(ID_CATEGORIA, {SIN_ID}) AS ID_CATEGORIA,
+                COALESCE(ID_MARCA, {SIN_ID}) AS ID_MARCA,
+                COALESCE(ID_VEND, {SIN_ID}) AS ID_VEND,
+                MAX(FECHA) AS ULTIMA_FECHA
+            FROM ventas
+            WHERE PREVENTA = 1 {"AND FECHA >= %s" if watermark else ""}
+            GROUP BY ID_CLIENTE, ID_CATEGORIA, ID_MARCA, ID_VEND
+        """
+        cursor.execute(query, (watermark,) if watermark else None)
+        ventas_p1 = cursor.fetchall()
+
+        cursor.execute("""
+            SELECT v.ID_CLIENTE, v.ID_MARCA, v.FECHA,
+                CASE
+                    WHEN v.PREVENTA = 2 THEN 'PREVENTA'
+                    WHEN v.PREVENTA = 3 THEN 'PROGRAMADO'
+                END AS TIPO,
+                m.DESCRIPCION_MARCA AS MARCA,
+                v.CANTIDAD
+            FROM ventas v
+            LEFT JOIN marca m ON v.ID_MARCA = m.ID_MARCA
+            WHERE v.PREVENTA IN (2, 3) AND v.CANTIDAD > 0
+        """)
+        transito = cursor.fetchall()
+
+        cursor.execute("""
+            SELECT ID_CLIENTE, DESCRIPCION_CLIENTE, LATITUD, LONGITUD, ID_DPTO, ID_CIUDAD
+            FROM puntos_venta
+            WHERE LATITUD IS NOT NULL AND LONGITUD IS NOT NULL AND LATITUD != '' AND LONGITUD != ''
+        """)
+        puntos = cursor.fetchall()
+
+        tablas = {}
+        for tabla, id_col, desc_col in (
+            ("vendedor", "ID_VEND", "DESCRIPCION_VEND"),
+            ("marca", "ID_MARCA", "DESCRIPCION_MARCA"),
+            ("categoria", "ID_CATEGORIA", "DESCRIPCION_CATEGORIA"),
+            ("departamento", "ID_DPTO", "DESCRIPCION_DPTO"),
+            ("ciudad", "ID_CIUDAD", "DESCRIPCION_CIUDAD"),
+        ):
+            cursor.execute(f"SELECT {id_col} AS ID, {desc_col} AS DESCRIPCION FROM {tabla}")
+            tablas[tabla] = cursor.fetchall()
+    return ventas_p1, transito, puntos, tablas
+
+
+def fetch_control_preventa_1(conexion, limites):
+    """
+    Control de las ventas PREVENTA=1 con FECHA anterior a cada límite (o sin FECHA): cantidad de
+    filas y suma de CRC32 de (cliente, categoría, marca, vendedor, fecha). Una sola pasada sobre
+    las filas PREVENTA=1 para todos los límites. Retorna {limite: 'filas:suma'}.
+    """
+    columnas = []
+    params = []
+    for i, limite in enumerate(limites):
+        condicion = "(FECHA < %s OR FECHA IS NULL)"
+        columnas.append(f"SUM({condicion}) AS FILAS_{i}")
+        columnas.append(
+            f"SUM(IF({condicion}, CRC32(CONCAT_WS('|', ID_CLIENTE, COALESCE(ID_CATEGORIA, {SIN_ID}), "
+            f"COALESCE(ID_MARCA, {SIN_ID}), COALESCE(ID_VEND, {SIN_ID}), COALESCE(FECHA, ''))), 0)) AS SUMA_{i}"
+        )
+        params.extend([limite, limite])
+    with conexion.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute(f"SELECT {', '.join(columnas)} FROM ventas WHERE PREVENTA = 1", tuple(params))
+        fila = cursor.fetchall()[0]
+    return {limite: f"{int(fila[f'FILAS_{i}'] or 0)}:{int(fila[f'SUMA_{i}'] or 0)}" for i, limite in enumerate(limites)}
+
+
+def _nueva_marca_de_agua(ventas_p1, watermark):
+    fechas = (_texto(f["ULTIMA_FECHA"]) for f in ventas_p1)
+    return max((fecha for fecha in fechas if fecha is not None), default=watermark)
+
+
+class SnapshotStore:
+    """
+    Snapshot local del dataset del mapa, con refresco incremental por marca de agua de FECHA,
+    política de antigüedad y reconstrucción forzada.
+    """
+
+    def __init__(self, db_path=None, max_age=DEFAULT_MAX_AGE, rebuild_after=DEFAULT_REBUILD_AFTER):
+        self.db_path = db_path or os.path.join(get_cache_dir(), SNAPSHOT_FILENAME)
+        self.max_age = max_age
+        self.rebuild_after = rebuild_after
+        self._write_lock = threading.Lock()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            self._migrar(db)
+
+    def _migrar(self, db):
+        # Versiones anteriores declaraban ultima_fecha NOT NULL y el INSERT fallaba para un cliente
+        # cuyas ventas PREVENTA=1 no tienen FECHA: se recrea la tabla y se reconstruye completo.
+        columnas = {fila["name"]: fila["notnull"] for fila in db.execute("PRAGMA table_info(ultima_venta_p1)")}
+        if columnas.get("ultima_fecha"):
+            print("--- [snapshot_store.py] Esquema anterior de ultima_venta_p1: se recrea y se reconstruirá el snapshot ---")
+            db.execute("DROP TABLE ultima_venta_p1")
+            db.executescript(SCHEMA)
+            db.execute("DELETE FROM meta WHERE clave IN ('watermark', 'last_rebuild', 'control_p1')")
+
+    def _connect(self):
+        # Una conexión SQLite por operación: son baratas y evitan compartirlas entre hilos.
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    # --- Metadatos y política de antigüedad ---
+
+    def _get_meta(self, db, clave):
+        fila = db.execute("SELECT valor FROM meta WHERE clave = ?", (clave,)).fetchone()
+        return fila["valor"] if fila else None
+
+    def _set_meta(self, db, clave, valor):
+        db.execute(
+            "INSERT INTO meta (clave, valor) VALUES (?, ?) ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor",
+            (clave, None if valor is None else str(valor))
+        )
+
+    def status(self):
+        """
+        Retorna la marca de agua, las fechas de último refresco/reconstrucción y los conteos de filas.
+        Todo sale de la tabla meta (los conteos se guardan al refrescar): se consulta en cada carga.
+        """
+        with self._connect() as db:
+            meta = {fila["clave"]: fila["valor"] for fila in db.execute("SELECT clave, valor FROM meta")}
+        return {
+            "db_path": self.db_path,
+            "watermark": meta.get("watermark"),
+            "last_refresh": float(meta.get("last_refresh") or 0),
+            "last_rebuild": float(meta.get("last_rebuild") or 0),
+            "ultima_venta_p1": int(meta.get("filas_ultima_venta_p1") or 0),
+            "transito": int(meta.get("filas_transito") or 0),
+            "puntos_venta": int(meta.get("filas_puntos_venta") or 0),
+        }
+
+    def is_empty(self):
+        return self.status()["last_rebuild"] == 0
+
+    def is_stale(self):
+        """True si el último refresco es más antiguo que max_age (o nunca se construyó)."""
+        estado = self.status()
+        return estado["last_rebuild"] == 0 or time.time() - estado["last_refresh"] > self.max_age
+
+    def needs_rebuild(self):
+        """True si nunca se construyó o si la última reconstrucción completa supera rebuild_after."""
+        estado = self.status()
+        return estado["last_rebuild"] == 0 or time.time() - estado["last_rebuild"] > self.rebuild_after
+
+    # --- Refresco desde MySQL ---
+
+    def _traer_de_mysql(self, conexion, watermark, cancelacion):
+        """
+        fetch_dataset_rows desde 'watermark' y el control de las ventas anteriores a 'watermark' y a
+        la nueva marca de agua. Retorna (filas, nueva_marca_de_agua, control).
+        """
+        def traer():
+            filas = fetch_dataset_rows(conexion, watermark)
+            nuevo_watermark = _nueva_marca_de_agua(filas[0], watermark)
+            limites = [limite for limite in dict.fromkeys((watermark, nuevo_watermark)) if limite is not None]
+            control = fetch_control_preventa_1(conexion, limites) if limites else {}
+            return filas, nuevo_watermark, control
+
+        if cancelacion is None:
+            return traer()
+        try:
+            with cancelacion.consulta(conexion):
+                resultado = traer()
+        except pymysql.MySQLError:
+            cancelacion.check()  # Interrumpida con KILL QUERY: se informa como cancelación
+            raise
+        cancelacion.check()
+        return resultado
+
+    def refresh(self, conexion, force_rebuild=False, cancelacion=None):
+        """
+        Actualiza el snapshot desde MySQL. Hace una reconstrucción completa si se fuerza, si la
+        política lo requiere o si cambiaron ventas anteriores a la marca de agua (control guardado
+        distinto del actual); si no, solo trae las ventas PREVENTA=1 con FECHA >= marca de agua.
+        Con 'cancelacion' (CancelToken de app/load_control.py) las consultas se pueden cancelar en el
+        servidor y se lanza LoadCancelled sin escribir nada: una carga reemplazada no retiene el
+        lock de escritura mientras la nueva lo espera.
+        Retorna un diccionario con el modo usado, filas traídas y duración.
+        """
+        with self._write_lock:
+            if cancelacion is not None:
+                cancelacion.check()  # Pudo quedar reemplazada mientras esperaba el lock
+            inicio = time.perf_counter()
+            with self._connect() as db:
+                watermark = self._get_meta(db, "watermark")
+                control_guardado = self._get_meta(db, "control_p1")
+            # Sin marca de agua o sin control anterior no se puede verificar lo viejo: reconstrucción
+            rebuild = force_rebuild or self.needs_rebuild() or watermark is None or control_guardado is None
+
+            print(f"--- [snapshot_store.py] Refrescando snapshot ({'reconstrucción completa' if rebuild else f'incremental desde {watermark}'}) ---")
+
+            (ventas_p1, transito, puntos, tablas), nuevo_watermark, control = self._traer_de_mysql(
+                conexion, None if rebuild else watermark, cancelacion
+            )
+            if not rebuild and control.get(watermark) != control_guardado:
+                print(f"--- [snapshot_store.py] Cambiaron ventas anteriores a {watermark} "
+                      f"(control {control_guardado} -> {control.get(watermark)}): reconstrucción completa ---")
+                rebuild = True
+                (ventas_p1, transito, puntos, tablas), nuevo_watermark, control = self._traer_de_mysql(
+                    conexion, None, cancelacion
+                )
+
+            with self._connect() as db:
+                if rebuild:
+                    db.execute("DELETE FROM ultima_venta_p1")
+                db.executemany(
+                    """
+                    INSERT INTO ultima_venta_p1 (id_cliente, id_categoria, id_marca, id_vend, ultima_fecha)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(id_cliente, id_categoria, id_marca, id_vend)
+                    DO UPDATE SET ultima_fecha = COALESCE(MAX(ultima_fecha, excluded.ultima_fecha), ultima_fecha, excluded.ultima_fecha)
+                    """,
+                    [(f["ID_CLIENTE"], f["ID_CATEGORIA"], f["ID_MARCA"], f["ID_VEND"], _texto(f["ULTIMA_FECHA"])) for f in ventas_p1]
+                )
+
+                db.execute("DELETE FROM transito")
+                db.executemany(
+                    "INSERT INTO transito (id_cliente, id_marca, fecha, tipo, marca, cantidad) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(f["ID_CLIENTE"], f["ID_MARCA"], _texto(f["FECHA"]), f["TIPO"], f["MARCA"], _texto(f["CANTIDAD"])) for f in transito]
+                )
+
+                db.execute("DELETE FROM puntos_venta")
+                filas_puntos = []
+                for f in puntos:
+                    try:
+                        filas_puntos.append((f["ID_CLIENTE"], f["DESCRIPCION_CLIENTE"], float(f["LATITUD"]), float(f["LONGITUD"]), f["ID_DPTO"], f["ID_CIUDAD"]))
+                    except (TypeError, ValueError):
+                        print(f"Advertencia: Coordenadas inválidas para cliente {f['ID_CLIENTE']} en el snapshot, se omite.")
+                db.executemany("INSERT INTO puntos_venta VALUES (?, ?, ?, ?, ?, ?)", filas_puntos)
+
+                for tabla, filas in tablas.items():
+                    db.execute(f"DELETE FROM {tabla}")
+                    db.executemany(f"INSERT OR REPLACE INTO {tabla} VALUES (?, ?)", [(f["ID"], f["DESCRIPCION"]) for f in filas])
+
+                ahora = time.time()
+                self._set_meta(db, "watermark", nuevo_watermark)
+                self._set_meta(db, "control_p1", control.get(nuevo_watermark))
+                self._set_meta(db, "filas_ultima_venta_p1", db.execute("SELECT COUNT(*) FROM ultima_venta_p1").fetchone()[0])
+                self._set_meta(db, "filas_transito", len(transito))
+                self._set_meta(db, "filas_puntos_venta", len(filas_puntos))
+                self._set_meta(db, "last_refresh", ahora)
+                if rebuild:
+                    self._set_meta(db, "last_rebuild", ahora)
+
+            resultado = {
+                "modo": "rebuild" if rebuild else "incremental",
+                "watermark": nuevo_watermark,
+                "filas_preventa_1": len(ventas_p1),
+                "filas_transito": len(transito),
+                "puntos_venta": len(filas_puntos),
+                "segundos": time.perf_counter() - inicio,
+            }
+            print(f"--- [snapshot_store.py] Snapshot actualizado: {resultado} ---")
+            return resultado
+
+    def ensure_fresh(self, conexion, cancelacion=None):
+        """Refresca el snapshot solo si la política de antigüedad lo indica. Retorna el resultado o None."""
+        if self.is_stale():
+            return self.refresh(conexion, cancelacion=cancelacion)
+        return None
+
+    # --- Lectura local (mismas columnas que las consultas de app/database.py) ---
+
+    def _filtros_venta(self, id_categoria, id_marca, descripcion_vend):
+        joins = ""
+        where_parts = []
+        params = []
+        if _filtro_presente(id_categoria):
+            where_parts.append("u.id_categoria = ?")
+            params.append(id_categoria)
+        if _filtro_presente(id_marca):
+            where_parts.append("u.id_marca = ?")
+            params.append(id_marca)
+        if _filtro_presente(descripcion_vend):
+            joins = "JOIN vendedor ve_f ON ve_f.id_vend = u.id_vend"
+            where_parts.append("ve_f.descripcion_vend = ?")
+            params.append(descripcion_vend)
+        where = " AND ".join(where_parts) if where_parts else "1=1"
+        return joins, where, params
+
+    def _filtros_ubicacion(self, id_dpto, id_ciudad):
+        where_parts = []
+        params = []
+        if _filtro_presente(id_dpto):
+            where_parts.append("pv.id_dpto = ?")
+            params.append(id_dpto)
+        if _filtro_presente(id_ciudad):
+            where_parts.append("pv.id_ciudad = ?")
+            params.append(id_ciudad)
+        where = " AND ".join(where_parts) if where_parts else "1=1"
+        return where, params
+
+    def fetch_points_preventa_1(self, id_categoria=None, id_marca=None, descripcion_vend=None, id_dpto=None, id_ciudad=None):
+        """Equivalente local de database.fetch_points_with_last_sale_preventa_1 (una fila por cliente)."""
+        joins, where_venta, params = self._filtros_venta(id_categoria, id_marca, descripcion_vend)
+        where_ubicacion, params_ubicacion = self._filtros_ubicacion(id_dpto, id_ciudad)
+        query = f"""
+            WITH candidatas AS (
+                SELECT u.*,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY u.id_cliente
+                           ORDER BY u.ultima_fecha DESC, u.id_marca, u.id_vend, u.id_categoria
+                       ) AS rn
+                FROM ultima_venta_p1 u
+                {joins}
+                WHERE {where_venta}
+            )
+            SELECT
+                pv.id_cliente AS ID_CLIENTE,
+                pv.descripcion_cliente AS DESCRIPCION_CLIENTE,
+                pv.latitud AS LATITUD,
+                pv.longitud AS LONGITUD,
+                c.ultima_fecha AS ULTIMA_VENTA,
+                NULLIF(c.id_vend, {SIN_ID}) AS ID_VEND,
+                ve.descripcion_vend AS DESCRIPCION_VEND,
+                m.descripcion_marca AS DESCRIPCION_MARCA,
+                1 AS PREVENTA,
+                NULLIF(c.id_marca, {SIN_ID}) AS ID_MARCA,
+                NULLIF(c.id_categoria, {SIN_ID}) AS ID_CATEGORIA,
+                cat.descripcion_categoria AS DESCRIPCION_CATEGORIA,
+                dpto.descripcion_dpto AS DESCRIPCION_DPTO,
+                ciu.descripcion_ciudad AS DESCRIPCION_CIUDAD
+            FROM puntos_venta pv
+            JOIN candidatas c ON c.id_cliente = pv.id_cliente AND c.rn = 1
+            LEFT JOIN vendedor ve ON ve.id_vend = c.id_vend
+            LEFT JOIN marca m ON m.id_marca = c.id_marca
+            LEFT JOIN categoria cat ON cat.id_categoria = c.id_categoria
+            LEFT JOIN departamento dpto ON dpto.id_dpto = pv.id_dpto
+            LEFT JOIN ciudad ciu ON ciu.id_ciudad = pv.id_ciudad
+            WHERE {where_ubicacion}
+            ORDER BY pv.id_cliente
+        """
+        with self._connect() as db:
+            return [dict(fila) for fila in db.execute(query, params + params_ubicacion)]
+
+    def fetch_points_preventa_no_1_aggregated(self, ids_marcas=None, filtros_preventa_1=None):
+        """Equivalente local de database.fetch_points_preventa_no_1_aggregated (una fila por cliente)."""
+        where_parts = []
+        params = []
+        if ids_marcas is not None:
+            if ids_marcas:
+                where_parts.append(f"t.id_marca IN ({', '.join(['?'] * len(ids_marcas))})")
+                params.extend(ids_marcas)
+            else:
+                where_parts.append("1=0")
+
+        if filtros_preventa_1 is not None:
+            joins, where_venta, params_venta = self._filtros_venta(
+                filtros_preventa_1.get('id_categoria'), filtros_preventa_1.get('id_marca'), filtros_preventa_1.get('descripcion_vend')
+            )
+            where_ubicacion, params_ubicacion = self._filtros_ubicacion(filtros_preventa_1.get('id_dpto'), filtros_preventa_1.get('id_ciudad'))
+            where_parts.append(f"""t.id_cliente IN (
+                SELECT u.id_cliente FROM ultima_venta_p1 u
+                {joins}
+                JOIN puntos_venta pv ON pv.id_cliente = u.id_cliente
+                WHERE {where_venta} AND {where_ubicacion}
+            )""")
+            params.extend(params_venta + params_ubicacion)
+
+        query = f"""
+            SELECT
+                t.id_cliente AS ID_CLIENTE,
+                COUNT(*) AS CANTIDAD_LINEAS,
+                json_group_array(json_object('FECHA', t.fecha, 'TIPO', t.tipo, 'MARCA', t.marca, 'ID_MARCA', t.id_marca, 'CANTIDAD', t.cantidad)) AS LINEAS
+            FROM transito t
+            WHERE {" AND ".join(where_parts) if where_parts else "1=1"}
+            GROUP BY t.id_cliente
+            ORDER BY t.id_cliente
+        """
+        with self._connect() as db:
+            return [dict(fila) for fila in db.execute(query, params)]
+
+
+# --- Línea de comandos: estado, refresco y reconstrucción forzada ---
+
+def main(argv=None):
+    from app.db_pool import get_pool
+
+    parser = argparse.ArgumentParser(description="Administra el snapshot local del mapa.")
+    parser.add_argument("accion", choices=["status", "refresh", "rebuild"], help="status: muestra el estado; refresh: refresco incremental; rebuild: reconstrucción completa")
+    parser.add_argument("--db-path", default=None, help="Ruta del archivo SQLite (por defecto en el directorio de caché)")
+    args = parser.parse_args(argv)
+
+    store = SnapshotStore(db_path=args.db_path)
+    if args.accion == "status":
+        print(store.status())
+        return 0
+
+    pool = get_pool()
+    if pool is None:
+        print("Error: No hay configuración de base de datos (app/db_config.json).")
+        return 1
+    with pool.connection() as conexion:
+        if conexion is None:
+            return 1
+        store.refresh(conexion, force_rebuild=(args.accion == "rebuild"))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
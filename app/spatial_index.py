@@ -0,0 +1,83 @@
+# app/spatial_index.py
+
+import numpy as np
+
+# Índice espacial en memoria para responder "qué puntos hay dentro de esta vista" sin recorrer
+# todos los puntos. Es una grilla regular en grados: los puntos se ordenan por celda y cada
+# columna de la grilla queda como un rango contiguo, así una consulta solo toca las celdas que
+# cubren la vista (búsqueda binaria por columna) y filtra exactamente dentro de ellas.
+
+DEFAULT_CELDA_GRADOS = 0.05  # ~5 km: pocas decenas de clientes por celda en zonas densas
+
+
+def normalizar_limites(limites):
+    """
+    Lleva limites=(sur, oeste, norte, este) del mapa a longitudes entre -180 y 180 (Leaflet entrega
+    longitudes fuera de ese rango al desplazarse más allá del antimeridiano).
+    """
+    sur, oeste, norte, este = (float(v) for v in limites)
+    if este - oeste >= 360.0:
+        return sur, -180.0, norte, 180.0
+    return sur, (oeste + 180.0) % 360.0 - 180.0, norte, (este + 180.0) % 360.0 - 180.0
+
+
+class SpatialGridIndex:
+    """Grilla de celdas de 'celda_grados' sobre arreglos de latitud y longitud (sin NaN)."""
+
+    def __init__(self, lat, lon, celda_grados=DEFAULT_CELDA_GRADOS):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.celda = celda_grados
+        self._filas = int(np.ceil(180.0 / celda_grados)) + 1
+
+        claves = self._clave(self._columna(self.lon), self._fila(self.lat))
+        self._orden = np.argsort(claves, kind='stable')  # posición de cada punto, agrupados por celda
+        self._claves = claves[self._orden]
+
+    def _columna(self, lon):
+        return np.floor((np.asarray(lon) + 180.0) / self.celda).astype(np.int64)
+
+    def _fila(self, lat):
+        return np.floor((np.asarray(lat) + 90.0) / self.celda).astype(np.int64)
+
+    def _clave(self, columna, fila):
+        return columna * self._filas + fila
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _rangos_de_columnas(self, oeste, este):
+        if oeste <= este:
+            return [(int(self._columna(oeste)), int(self._columna(este)))]
+        # La vista cruza el antimeridiano: dos tramos de columnas
+        return [(int(self._columna(oeste)), int(self._columna(180.0))),
+                (int(self._columna(-180.0)), int(self._columna(este)))]
+
+    def query(self, limites):
+        """
+        Índices (en el orden de los arreglos originales) de los puntos dentro de
+        limites=(sur, oeste, norte, este).
+        """
+        sur, oeste, norte, este = normalizar_limites(limites)
+        fila_sur, fila_norte = int(self._fila(max(sur, -90.0))), int(self._fila(min(norte, 90.0)))
+
+        tramos = []
+        for columna_inicio, columna_fin in self._rangos_de_columnas(oeste, este):
+            columnas = np.arange(columna_inicio, columna_fin + 1, dtype=np.int64)
+            desde = np.searchsorted(self._claves, self._clave(columnas, fila_sur), side='left')
+            hasta = np.searchsorted(self._claves, self._clave(columnas, fila_norte), side='right')
+            tramos.extend(self._orden[d:h] for d, h in zip(desde, hasta) if h > d)
+        if not tramos:
+            return np.empty(0, dtype=np.int64)
+
+        candidatos = np.concatenate(tramos)
+        lat, lon = self.lat[candidatos], self.lon[candidatos]
+        dentro = (lat >= sur) & (lat <= norte)
+        if oeste <= este:
+            dentro &= (lon >= oeste) & (lon <= este)
+        else:
+            dentro &= (lon >= oeste) | (lon <= este)
+        return np.sort(candidatos[dentro])
+
+    def count(self, limites):
+        return len(self.query(limites))
@@ -3,14 +3,13 @@
 from PyQt5.QtWidgets import QHBoxLayout, QComboBox, QPushButton, QWidget, QSizePolicy
 from PyQt5.QtCore import Qt, pyqtSignal
 from app.database import (
-    connect_to_database,
-    close_database_connection,
     fetch_categorias,
     fetch_marcas,
     fetch_vendedores,
     fetch_departamentos,
     fetch_ciudades
 )
+from app.db_pool import get_pool
 
 
 class FiltersUI(QWidget):
@@ -191,9 +190,10 @@ class FiltersUI(QWidget):
 
         if departamento_seleccionado_id is not None:
             conexion_local = None
+            pool = get_pool()
             try:
-                print("DEBUG_FILTERS_UI: Conectando localmente para fetch_ciudades...")
-                conexion_local = connect_to_database()
+                print("DEBUG_FILTERS_UI: Tomando conexión del pool para fetch_ciudades...")
+                conexion_local = pool.checkout() if pool else None
                 if conexion_local is None:
                     print("ERROR_FILTERS_UI: No se pudo establecer conexión local para actualizar filtros de ciudad.")
                     return
@@ -204,8 +204,8 @@ class FiltersUI(QWidget):
                 print(f"ERROR_FILTERS_UI: Error al actualizar filtro de ciudad: {e}")
             finally:
                 if conexion_local:
-                    close_database_connection(conexion_local)
-                    print("DEBUG_FILTERS_UI: Conexión local cerrada.")
+                    pool.release(conexion_local)
+                    print("DEBUG_FILTERS_UI: Conexión local devuelta al pool.")
         else:
             print("DEBUG_FILTERS_UI: Departamento no seleccionado, usando todas las ciudades.")
             ciudades_filtradas = self._all_ciudades
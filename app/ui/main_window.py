@@ -1,101 +1,378 @@
 import os
 import sys
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtWidgets import QMainWindow, QVBoxLayout, QWidget, QMessageBox
-from PyQt5.QtCore import QUrl, QThread, pyqtSignal, QObject, pyqtSlot
+from PyQt5.QtCore import QUrl, QThread, QTimer, pyqtSignal, QObject, pyqtSlot
 from PyQt5.QtWebEngineWidgets import QWebEngineView
 from PyQt5.QtWebChannel import QWebChannel
 
 # Importar funciones y clases necesarias desde tus módulos
 from app import database # Importar el módulo database completo
-from app.color_calculator import calculate_colors_and_shapes_for_all_points
-from app.map_generator import calculate_statistics
+from app import db_pool
+from app.cluster_engine import ClusterIndex
+from app.color_calculator import calculate_point_records
+from app.fetch_orchestrator import fetch_map_rows
+from app.load_control import LoadCancelled, LoadController
+from app.map_diff import MapState
+from app.map_payload import view_payload
+from app.popup_index import PopupIndex
+from app.relation_index import get_relation_index
+from app.result_cache import get_data_version, get_result_cache
+from app.snapshot_store import SnapshotStore
+
+MAX_PEDIDOS_FILTROS = 4  # Consultas de filtros simultáneas (cada una usa una conexión del pool)
+CARGA_COALESCE_MS = 150  # Cambios de filtro dentro de esta ventana se juntan en una sola carga
+ESPERA_CIERRE_MS = 3000  # Espera máxima por las cargas canceladas al cerrar la aplicación
 
 # --- CLASE DataWorker para el hilo separado ---
 class DataWorker(QThread):
     data_loaded = pyqtSignal(dict)
     error_occurred = pyqtSignal(str)
 
-    def __init__(self, filter_params):
+    def __init__(self, filter_params, snapshot_store=None, cancelacion=None):
         super().__init__()
         self.filter_params = filter_params
-
-    def run(self):
-        conexion = None
-        try:
-            conexion = database.connect_to_database()
-            if conexion is None:
-                self.error_occurred.emit("No se pudo conectar a la base de datos en el hilo de datos.")
-                return
-
-            print("\n- Cargando y procesando datos en hilo separado -")
-
-            id_categoria = self.filter_params.get('id_categoria')
-            id_marca = self.filter_params.get('id_marca')
-            descripcion_vend_filtro = self.filter_params.get('descripcion_vend')
-            id_dpto = self.filter_params.get('id_dpto')
-            id_ciudad = self.filter_params.get('id_ciudad')
-
-            print("- Buscando puntos PREVENTA=1 de la base de datos...")
-            puntos_circulos = database.fetch_points_with_last_sale_preventa_1(
-                conexion,
-                id_categoria=id_categoria,
-                id_marca=id_marca,
-                descripcion_vend=descripcion_vend_filtro,
-                id_dpto=id_dpto,
-                id_ciudad=id_ciudad
-            )
+        self.snapshot_store = snapshot_store
+        self.cancelacion = cancelacion  # CancelToken de esta carga (app/load_control.py)
+
+    def _punto_de_control(self):
+        """Lanza LoadCancelled si una carga más nueva reemplazó a esta."""
+        if self.cancelacion is not None:
+            self.cancelacion.check()
+
+    def _preparar_snapshot(self, pool):
+        """
+        Refresca el snapshot local si venció. Retorna (snapshot_a_usar, conexion_abierta):
+        el snapshot es None si no existe o no pudo construirse (se consulta MySQL directamente).
+        """
+        snapshot = self.snapshot_store
+        if snapshot is None or not snapshot.is_stale():
+            return snapshot, None
+        self._punto_de_control()
+
+        conexion = pool.checkout() if pool else None
+        if conexion is not None:
+            try:
+                # Con el token, una carga más nueva interrumpe este refresco (KILL QUERY) en lugar de
+                # esperar el lock de escritura del snapshot hasta que termine
+                snapshot.refresh(conexion, cancelacion=self.cancelacion)
+            except LoadCancelled:
+                pool.release(conexion)
+                raise
+            except Exception as e:
+                print(f"Advertencia: No se pudo refrescar el snapshot local: {e}")
+        if snapshot.is_empty():
+            print("- Snapshot local vacío, se consultará la base de datos directamente. -")
+            return None, conexion
+        return snapshot, conexion
+
+    def _version_de_datos(self, snapshot, pool):
+        """Versión de los datos para el caché de resultados (None si no se pudo determinar)."""
+        if snapshot is not None:
+            estado = snapshot.status()
+            return ('snapshot', estado['watermark'], estado['last_refresh'])
+        return get_data_version(pool)
+
+    def _cargar_datos(self, snapshot, pool, filtros):
+        """Consulta los puntos (snapshot o MySQL), calcula colores/formas y estadísticas."""
+        if snapshot is not None:
+            print("- Buscando puntos PREVENTA=1 en el snapshot local...")
+            puntos_circulos = snapshot.fetch_points_preventa_1(**filtros)
             print(f"- Encontrados {len(puntos_circulos)} puntos PREVENTA=1.")
 
             ids_marcas_en_circulos = list(set([p.get('ID_MARCA') for p in puntos_circulos if p.get('ID_MARCA') is not None]))
             print(f"- IDs de marcas únicas en PREVENTA=1 para filtrar diamantes: {len(ids_marcas_en_circulos)}")
 
-            print("- Buscando puntos PREVENTA!=1 de la base de datos...")
-            puntos_diamantes = database.fetch_points_with_last_sale_preventa_no_1(
-                conexion, ids_marcas=ids_marcas_en_circulos
+            print("- Buscando puntos PREVENTA!=1 en el snapshot local...")
+            self._punto_de_control()
+            puntos_diamantes = snapshot.fetch_points_preventa_no_1_aggregated(
+                ids_marcas=ids_marcas_en_circulos, filtros_preventa_1=filtros
+            )
+        else:
+            # Ambas consultas en paralelo, cada una en su conexión; el orquestador aplica
+            # después la restricción de marcas de los círculos sobre los diamantes.
+            print("- Buscando puntos PREVENTA=1 y PREVENTA!=1 de la base de datos (en paralelo)...")
+            puntos_circulos, puntos_diamantes, _ = fetch_map_rows(
+                pool, filtros, restringir_marcas_a_preventa_1=True, cancelacion=self.cancelacion
             )
-            print(f"- Encontrados {len(puntos_diamantes)} puntos PREVENTA!=1.")
+            print(f"- Encontrados {len(puntos_circulos)} puntos PREVENTA=1.")
+        print(f"- Encontrados {len(puntos_diamantes)} clientes con PREVENTA!=1.")
+        self._punto_de_control()
+
+        print("- Procesando puntos para asignar colores y formas (usando color_calculator)...")
+        # Los popups no viajan con los puntos: el JS los pide con Bridge.getPopupHtml al abrirlos.
+        # Ambas fuentes (MySQL y snapshot) vienen ordenadas por ID_CLIENTE: se combinan con merge join.
+        # Los puntos se guardan como registros compactos (PointStore) y no como diccionarios:
+        # es lo que queda en el caché de resultados.
+        popup_index = PopupIndex()
+        puntos_para_mapa = calculate_point_records(
+            puntos_circulos, puntos_diamantes, popup_index=popup_index, ordenado_por_cliente=True
+        )
+        print(f"- {len(puntos_para_mapa)} puntos listos para el mapa.")
+        self._punto_de_control()
+
+        print("- Calculando estadísticas a partir de puntos procesados...")
+        estadisticas = puntos_para_mapa.statistics()
+        self._punto_de_control()  # Antes del índice de clusters, la última etapa costosa
+
+        # Índice espacial + jerarquía de clusters por zoom: el mapa pide solo lo que tiene en pantalla
+        cluster_index = ClusterIndex(puntos_para_mapa)
+
+        return {
+            'puntos_para_mapa': puntos_para_mapa,
+            'estadisticas': estadisticas,
+            'popup_index': popup_index,
+            'cluster_index': cluster_index
+        }
 
-            print("- Procesando puntos para asignar colores y formas (usando color_calculator)...")
-            puntos_para_mapa = calculate_colors_and_shapes_for_all_points(puntos_circulos, puntos_diamantes)
-            print(f"- {len(puntos_para_mapa)} puntos listos para el mapa.")
+    def run(self):
+        pool = db_pool.get_pool()
+        try:
+            snapshot, conexion = self._preparar_snapshot(pool)
+            if conexion is not None:
+                # La conexión del refresco del snapshot ya no hace falta: las consultas usan las suyas
+                pool.release(conexion)
+            if snapshot is None and pool is None:
+                self.error_occurred.emit("No se pudo conectar a la base de datos en el hilo de datos.")
+                return
+            self._punto_de_control()
 
-            print("- Calculando estadísticas a partir de puntos procesados (usando map_generator)...")
-            estadisticas = calculate_statistics(puntos_para_mapa)
+            print("\n- Cargando y procesando datos en hilo separado -")
 
-            self.data_loaded.emit({
-                'puntos_para_mapa': puntos_para_mapa,
-                'estadisticas': estadisticas
-            })
+            filtros = {
+                'id_categoria': self.filter_params.get('id_categoria'),
+                'id_marca': self.filter_params.get('id_marca'),
+                'descripcion_vend': self.filter_params.get('descripcion_vend'),
+                'id_dpto': self.filter_params.get('id_dpto'),
+                'id_ciudad': self.filter_params.get('id_ciudad')
+            }
 
+            # Una combinación de filtros ya vista con la misma versión de datos se sirve del caché
+            version = self._version_de_datos(snapshot, pool)
+            resultado = get_result_cache().get_or_compute(
+                'pyqt', filtros, version, lambda: self._cargar_datos(snapshot, pool, filtros)
+            )
+            self._punto_de_control()
+            self.data_loaded.emit(resultado)
+
+        except LoadCancelled as e:
+            # Reemplazada por una carga más nueva: no se emite nada (ni se guarda en el caché)
+            print(f"- {e} -")
+        except ConnectionError as e:
+            self.error_occurred.emit(f"No se pudo conectar a la base de datos en el hilo de datos: {e}")
         except Exception as e:
             error_msg = f"Error en el hilo de datos: {e}"
             print(error_msg)
             self.error_occurred.emit(error_msg)
-        finally:
-            if conexion:
-                database.close_database_connection(conexion)
-                print("- Conexión a la base de datos cerrada en el hilo de datos. -")
 
 
 # --- CLASE Bridge para la comunicación entre Python y JavaScript ---
 class Bridge(QObject):
     filters_applied = pyqtSignal(dict)
+    render_completed = pyqtSignal(dict)  # Tiempos de renderizado informados por el mapa
+    filterDataReady = pyqtSignal(str, int, str)  # (tipo, id_pedido, resultado_json) para el JS
+    _resultado_listo = pyqtSignal(str, int, str)  # Interno: lo emite un hilo del pool de pedidos
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.popup_index = None  # PopupIndex de la última carga de datos (lo asigna MainWindow)
+        self.cluster_index = None  # ClusterIndex de la última carga de datos (lo asigna MainWindow)
+        self.estado_mapa = MapState()  # Puntos que el mapa ya tiene, para enviar solo diferencias
+        self.id_vista = 0  # Número de la última respuesta de getPointsInView
+        self.bloques_vista = []  # Bloques columnares restantes de esa respuesta (app/map_payload.py)
+        # Las vistas se calculan en el pool de pedidos: el lock protege estado_mapa, id_vista y bloques_vista
+        self._vista_lock = threading.Lock()
+        self._pool_pedidos = ThreadPoolExecutor(max_workers=MAX_PEDIDOS_FILTROS, thread_name_prefix="bridge_filtros")
+        # Un hilo propio para las vistas: no esperan detrás de consultas de filtros y salen en orden
+        self._pool_vistas = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bridge_vistas")
+        self._pedidos_lock = threading.Lock()
+        self._ultimo_id_pedido = 0
+        self._pedido_vigente = {}  # tipo -> id del último pedido de ese tipo
+        self._resultado_listo.connect(self._publicar_resultado)
+
+    @pyqtSlot(str, result=str)
+    def getPopupHtml(self, id_cliente_str):
+        """Genera bajo demanda el HTML del popup de un cliente del mapa actual."""
+        try:
+            html = self.popup_index.render(id_cliente_str) if self.popup_index is not None else None
+            if html is None:
+                return json.dumps({"status": "error", "message": f"Cliente {id_cliente_str} no encontrado en el mapa actual."})
+            return json.dumps({"status": "success", "html": html})
+        except Exception as e:
+            print(f"Error al generar el popup del cliente {id_cliente_str}: {e}")
+            return json.dumps({"status": "error", "message": f"Error al generar el popup: {e}"})
+
+    # --- Vistas del mapa ---
+    # Como los filtros, getPointsInView, getPointsChunk y getClusterChildren no trabajan en el hilo
+    # de Qt: se encolan en el pool del Bridge y el resultado llega al JS por filterDataReady (tipos
+    # 'vista', 'bloque' y 'hijos'), desde un hilo propio (_pool_vistas). El JS pide las vistas y sus
+    # bloques de a uno, en orden.
+
+    @pyqtSlot(str, result=str)
+    def getPointsInView(self, vista_json):
+        """
+        Contenido de la vista actual del mapa, resuelto con el índice espacial en memoria.
+        'vista_json' es {"zoom": z, "sur": .., "oeste": .., "norte": .., "este": ..}. El resultado
+        (por filterDataReady) trae los puntos dentro de la vista o, si son demasiados para ese zoom,
+        los clusters visibles. Los puntos a agregar o reemplazar van en bloques columnares: el
+        primero en la respuesta y los demás por getPointsChunk(id_vista, n), que el JS pide
+        mientras inserta los anteriores.
+        """
+        return self._encolar_pedido('vista', self._calcular_vista, vista_json, executor=self._pool_vistas)
+
+    def _calcular_vista(self, vista_json):
+        cluster_index, popup_index = self.cluster_index, self.popup_index
+        with self._vista_lock:
+            try:
+                if cluster_index is None:
+                    return json.dumps({"status": "error", "message": "No hay datos cargados en el mapa."})
+                vista = json.loads(vista_json)
+                limites = (vista['sur'], vista['oeste'], vista['norte'], vista['este'])
+                resultado = cluster_index.get_view(vista['zoom'], limites)
+                # Solo la diferencia con los puntos que el mapa ya tiene (window.aplicarCambiosMapa)
+                cambios = self.estado_mapa.diff(resultado['puntos'], popup_index)
+                respuesta, self.bloques_vista = view_payload(cambios)
+                self.id_vista += 1
+                return json.dumps({
+                    "status": "success", "id_vista": self.id_vista, "zoom": resultado['zoom'],
+                    "clusters": resultado['clusters'], **respuesta
+                }, default=str)
+            except Exception as e:
+                print(f"Error al obtener los puntos de la vista {vista_json}: {e}")
+                # El JS vacía el mapa ante un error: el próximo pedido se envía completo
+                self.estado_mapa.reset()
+                return json.dumps({"status": "error", "message": f"Error al obtener los puntos de la vista: {e}"})
+
+    @pyqtSlot(str)
+    def reportRenderTiming(self, tiempos_json):
+        """El mapa avisa que terminó de aplicar una vista (aplicarCambiosMapa), con sus tiempos en ms."""
+        try:
+            self.render_completed.emit(json.loads(tiempos_json))
+        except Exception as e:
+            print(f"Error al procesar los tiempos de renderizado desde JS: {e}")
+
+    @pyqtSlot(int, int, result=str)
+    def getPointsChunk(self, id_vista, numero):
+        """Bloque columnar 'numero' (desde 1; el 0 viaja en la respuesta) de la vista 'id_vista'."""
+        return self._encolar_pedido('bloque', self._bloque_de_vista, id_vista, numero, executor=self._pool_vistas)
+
+    def _bloque_de_vista(self, id_vista, numero):
+        with self._vista_lock:
+            if id_vista != self.id_vista or not 1 <= numero <= len(self.bloques_vista):
+                # Los pedidos de vista son de a uno: esto solo pasa si el JS perdió la secuencia
+                self.estado_mapa.reset()
+                return json.dumps({"status": "error", "message": f"Bloque {numero} de la vista {id_vista} inexistente."})
+            return self.bloques_vista[numero - 1]
+
+    @pyqtSlot(str, result=str)
+    def getClusterChildren(self, id_cluster):
+        """Hijos de un cluster (drill-down) y el zoom al que hay que acercarse para separarlo."""
+        return self._encolar_pedido('hijos', self._hijos_de_cluster, id_cluster, executor=self._pool_vistas)
+
+    def _hijos_de_cluster(self, id_cluster):
+        cluster_index = self.cluster_index
+        try:
+            if cluster_index is None:
+                return json.dumps({"status": "error", "message": "No hay datos cargados en el mapa."})
+            resultado = cluster_index.get_children(id_cluster)
+            resultado['expansion_zoom'] = cluster_index.expansion_zoom(id_cluster)
+            return json.dumps({"status": "success", **resultado}, default=str)
+        except Exception as e:
+            print(f"Error al obtener los hijos del cluster {id_cluster}: {e}")
+            return json.dumps({"status": "error", "message": f"Error al obtener los hijos del cluster: {e}"})
+
+    # --- Pedidos asíncronos (filtros y vistas del mapa) ---
+    # Los slots de filtros no consultan MySQL en el hilo de Qt: registran el pedido, lo ejecutan en
+    # el pool del Bridge y retornan enseguida {"status": "pending", "request_id": n}. El resultado
+    # (el mismo JSON que antes retornaba el slot) llega al JS por la señal filterDataReady. Solo se
+    # publica la respuesta del último pedido de cada tipo; las de pedidos anteriores se descartan.
+
+    def _encolar_pedido(self, tipo, funcion, *args, executor=None):
+        with self._pedidos_lock:
+            self._ultimo_id_pedido += 1
+            id_pedido = self._ultimo_id_pedido
+            self._pedido_vigente[tipo] = id_pedido
+
+        def ejecutar():
+            try:
+                resultado = funcion(*args)
+            except Exception as e:
+                print(f"Error en el pedido {id_pedido} ({tipo}): {e}")
+                resultado = json.dumps({"status": "error", "message": f"Error al obtener {tipo}: {e}"})
+            if self._es_vigente(tipo, id_pedido):
+                self._resultado_listo.emit(tipo, id_pedido, resultado)  # Se entrega en el hilo de Qt
+
+        try:
+            (executor or self._pool_pedidos).submit(ejecutar)
+        except RuntimeError as e:  # El pool ya se cerró (la ventana se está cerrando)
+            print(f"No se pudo encolar el pedido {id_pedido} ({tipo}): {e}")
+            return json.dumps({"status": "error", "message": f"No se pudo encolar el pedido: {e}"})
+        return json.dumps({"status": "pending", "request_id": id_pedido, "tipo": tipo})
+
+    def _es_vigente(self, tipo, id_pedido):
+        with self._pedidos_lock:
+            return self._pedido_vigente.get(tipo) == id_pedido
+
+    @pyqtSlot(str, int, str)
+    def _publicar_resultado(self, tipo, id_pedido, resultado):
+        # Se vuelve a comprobar en el hilo de Qt: pudo llegar un pedido más nuevo mientras tanto
+        if not self._es_vigente(tipo, id_pedido):
+            print(f"- Respuesta descartada del pedido {id_pedido} ({tipo}): hay un pedido más reciente -")
+            return
+        self.filterDataReady.emit(tipo, id_pedido, resultado)
+
+    def shutdown(self):
+        """Cierra los pools de pedidos sin esperar las consultas en curso (sus respuestas se pierden)."""
+        with self._pedidos_lock:
+            self._pedido_vigente.clear()
+        self._pool_pedidos.shutdown(wait=False, cancel_futures=True)
+        self._pool_vistas.shutdown(wait=False, cancel_futures=True)
 
     @pyqtSlot(result=str)
     def getInitialFilterData(self):
         print("JS solicitó datos iniciales para los filtros.")
+        return self._encolar_pedido('iniciales', self._cargar_datos_iniciales_filtros)
+
+    @pyqtSlot(str, result=str)
+    def getFilteredMarcas(self, id_categoria_str):
+        print(f"JS solicitó marcas filtradas para categoría: {id_categoria_str}")
+        return self._encolar_pedido('marcas', self._cargar_marcas_filtradas, id_categoria_str)
+
+    @pyqtSlot(str, result=str)
+    def getFilteredVendedores(self, id_categoria_str):
+        print(f"JS solicitó vendedores filtrados para categoría: {id_categoria_str}")
+        return self._encolar_pedido('vendedores', self._cargar_vendedores_filtrados, id_categoria_str)
+
+    @pyqtSlot(str, result=str)
+    def getFilteredCiudades(self, id_dpto_str):
+        print(f"JS solicitó ciudades filtradas para departamento: {id_dpto_str}")
+        return self._encolar_pedido('ciudades', self._cargar_ciudades_filtradas, id_dpto_str)
+
+    def _cargar_datos_iniciales_filtros(self):
         conexion = None
+        pool = db_pool.get_pool()
         try:
-            conexion = database.connect_to_database()
-            if conexion is None: # Corregido de '==' a 'is' para None
-                return json.dumps({"error": "No se pudo conectar a la base de datos para filtros."})
-
-            categorias_raw = database.fetch_categorias(conexion)
-            marcas_raw = database.fetch_marcas(conexion)
-            vendedores_raw = database.fetch_vendedores(conexion)
-            departamentos_raw = database.fetch_departamentos(conexion)
-            ciudades_raw = database.fetch_ciudades(conexion)
+            # Índice de relaciones en memoria (app/relation_index.py); MySQL solo si no se pudo armar
+            indice = get_relation_index(pool)
+            if indice is not None:
+                categorias_raw = indice.categorias()
+                marcas_raw = indice.marcas()
+                vendedores_raw = indice.vendedores()
+                departamentos_raw = indice.departamentos()
+                ciudades_raw = indice.ciudades()
+            else:
+                conexion = pool.checkout() if pool else None
+                if conexion is None: # Corregido de '==' a 'is' para None
+                    return json.dumps({"error": "No se pudo conectar a la base de datos para filtros."})
+
+                categorias_raw = database.fetch_categorias(conexion)
+                marcas_raw = database.fetch_marcas(conexion)
+                vendedores_raw = database.fetch_vendedores(conexion)
+                departamentos_raw = database.fetch_departamentos(conexion)
+                ciudades_raw = database.fetch_ciudades(conexion)
 
             # Transformar tuplas a diccionarios para JS
             categorias_formatted = [{"id": item[0], "descripcion": item[1]} for item in categorias_raw]
@@ -117,7 +394,7 @@ class Bridge(QObject):
             return json.dumps({"error": f"Error al obtener datos iniciales de filtros: {e}"})
         finally:
             if conexion:
-                database.close_database_connection(conexion)
+                pool.release(conexion)
 
     @pyqtSlot(str, result=str)
     def applyFilters(self, json_filter_params):
@@ -146,18 +423,20 @@ class Bridge(QObject):
             print(f"Error al procesar resetFilters desde JS: {e}")
             return json.dumps({"status": "error", "message": f"Error al reiniciar filtros: {e}"})
 
-    @pyqtSlot(str, result=str)
-    def getFilteredMarcas(self, id_categoria_str):
-        print(f"JS solicitó marcas filtradas para categoría: {id_categoria_str}")
+    def _cargar_marcas_filtradas(self, id_categoria_str):
         conexion = None
+        pool = db_pool.get_pool()
         try:
-            conexion = database.connect_to_database()
-            if conexion is None:
-                return json.dumps({"error": "No se pudo conectar a la base de datos para marcas filtradas."})
-            
             id_categoria = int(id_categoria_str) if id_categoria_str and id_categoria_str.isdigit() else None
-            
-            marcas_raw = database.fetch_marcas(conexion, id_categoria=id_categoria)
+
+            indice = get_relation_index(pool)
+            if indice is not None:
+                marcas_raw = indice.marcas(id_categoria)
+            else:
+                conexion = pool.checkout() if pool else None
+                if conexion is None:
+                    return json.dumps({"error": "No se pudo conectar a la base de datos para marcas filtradas."})
+                marcas_raw = database.fetch_marcas(conexion, id_categoria=id_categoria)
             marcas_formatted = [{"id": item[0], "descripcion": item[1]} for item in marcas_raw]
             return json.dumps({"status": "success", "data": marcas_formatted})
         except Exception as e:
@@ -165,20 +444,22 @@ class Bridge(QObject):
             return json.dumps({"status": "error", "message": f"Error al obtener marcas filtradas: {e}"})
         finally:
             if conexion:
-                database.close_database_connection(conexion)
+                pool.release(conexion)
 
-    @pyqtSlot(str, result=str)
-    def getFilteredVendedores(self, id_categoria_str):
-        print(f"JS solicitó vendedores filtrados para categoría: {id_categoria_str}")
+    def _cargar_vendedores_filtrados(self, id_categoria_str):
         conexion = None
+        pool = db_pool.get_pool()
         try:
-            conexion = database.connect_to_database()
-            if conexion is None:
-                return json.dumps({"error": "No se pudo conectar a la base de datos para vendedores filtrados."})
-            
             id_categoria = int(id_categoria_str) if id_categoria_str and id_categoria_str.isdigit() else None
-            
-            vendedores_raw = database.fetch_vendedores(conexion, id_categoria=id_categoria)
+
+            indice = get_relation_index(pool)
+            if indice is not None:
+                vendedores_raw = indice.vendedores(id_categoria)
+            else:
+                conexion = pool.checkout() if pool else None
+                if conexion is None:
+                    return json.dumps({"error": "No se pudo conectar a la base de datos para vendedores filtrados."})
+                vendedores_raw = database.fetch_vendedores(conexion, id_categoria=id_categoria)
             # Ya fetch_vendedores devuelve el formato adecuado (None, descripcion)
             vendedores_formatted = [{"id": item[0], "descripcion": item[1]} for item in vendedores_raw]
             return json.dumps({"status": "success", "data": vendedores_formatted})
@@ -187,20 +468,22 @@ class Bridge(QObject):
             return json.dumps({"status": "error", "message": f"Error al obtener vendedores filtrados: {e}"})
         finally:
             if conexion:
-                database.close_database_connection(conexion)
+                pool.release(conexion)
 
-    @pyqtSlot(str, result=str)
-    def getFilteredCiudades(self, id_dpto_str):
-        print(f"JS solicitó ciudades filtradas para departamento: {id_dpto_str}")
+    def _cargar_ciudades_filtradas(self, id_dpto_str):
         conexion = None
+        pool = db_pool.get_pool()
         try:
-            conexion = database.connect_to_database()
-            if conexion is None:
-                return json.dumps({"error": "No se pudo conectar a la base de datos para ciudades filtradas."})
-            
             id_dpto = int(id_dpto_str) if id_dpto_str and id_dpto_str.isdigit() else None
-            
-            ciudades_raw = database.fetch_ciudades(conexion, id_dpto=id_dpto)
+
+            indice = get_relation_index(pool)
+            if indice is not None:
+                ciudades_raw = indice.ciudades(id_dpto)
+            else:
+                conexion = pool.checkout() if pool else None
+                if conexion is None:
+                    return json.dumps({"error": "No se pudo conectar a la base de datos para ciudades filtradas."})
+                ciudades_raw = database.fetch_ciudades(conexion, id_dpto=id_dpto)
             ciudades_formatted = [{"id": item[0], "descripcion": item[1]} for item in ciudades_raw]
             return json.dumps({"status": "success", "data": ciudades_formatted})
         except Exception as e:
@@ -208,7 +491,7 @@ class Bridge(QObject):
             return json.dumps({"status": "error", "message": f"Error al obtener ciudades filtradas: {e}"})
         finally:
             if conexion:
-                database.close_database_connection(conexion)
+                pool.release(conexion)
 
 
 # --- CLASE MainWindow ---
@@ -219,9 +502,26 @@ class MainWindow(QMainWindow):
         self.setGeometry(100, 100, 1200, 800)
 
         self.data_worker = None
+        self.workers_cancelados = set()  # Cargas reemplazadas que todavía están terminando
+        self.load_controller = LoadController()  # Generación de carga vigente
+        self.filtros_pendientes = None  # Último pedido de carga a la espera de CARGA_COALESCE_MS
         self.map_loaded_and_ready = False
         self.loaded_data_from_worker = None
         self.current_filter_params = {}
+        self.envio_iniciado = None  # time.perf_counter() del último envío de datos al mapa
+        self.ultimos_tiempos_render = None
+
+        # Snapshot local del dataset: los cambios de filtro se resuelven sin red mientras esté vigente
+        try:
+            self.snapshot_store = SnapshotStore()
+        except Exception as e:
+            print(f"Advertencia: No se pudo abrir el snapshot local, se usará solo la base de datos: {e}")
+            self.snapshot_store = None
+
+        # Los cambios de filtro seguidos se juntan en una sola carga
+        self.temporizador_carga = QTimer(self)
+        self.temporizador_carga.setSingleShot(True)
+        self.temporizador_carga.timeout.connect(self._lanzar_carga_pendiente)
 
         self.init_ui()
         self.apply_stylesheet()
@@ -241,6 +541,7 @@ class MainWindow(QMainWindow):
         self.browser.page().setWebChannel(self.channel)
 
         self.bridge.filters_applied.connect(self.on_apply_filters)
+        self.bridge.render_completed.connect(self.on_render_completed)
 
         map_path = os.path.join(os.path.dirname(__file__), '..', '..', 'mapa_base.html')
         map_path = os.path.abspath(map_path)
@@ -287,45 +588,90 @@ class MainWindow(QMainWindow):
         self._start_data_worker(self.current_filter_params)
 
     def _start_data_worker(self, filter_params):
-        if self.data_worker and self.data_worker.isRunning():
-            print("Deteniendo worker anterior...")
-            self.data_worker.quit()
-            self.data_worker.wait()
-            print("Worker anterior detenido.")
+        # Nunca se espera a la carga anterior en el hilo de Qt: se cancela (sus consultas reciben
+        # KILL QUERY) y la nueva arranca cuando pasan CARGA_COALESCE_MS sin otro cambio de filtros
+        generacion = self.load_controller.cancelar()
+        if generacion is not None and self.data_worker is not None and self.data_worker.isRunning():
+            print(f"- Carga {generacion} reemplazada por filtros nuevos -")
+        self.filtros_pendientes = filter_params
+        self.temporizador_carga.start(CARGA_COALESCE_MS)
+
+    def _lanzar_carga_pendiente(self):
+        filter_params, self.filtros_pendientes = self.filtros_pendientes, None
+        if filter_params is None:
+            return
+
+        pool = db_pool.get_pool()
+        cancelacion = self.load_controller.nueva_carga(pool.db_config if pool is not None else None)
+
+        anterior = self.data_worker
+        if anterior is not None and anterior.isRunning():
+            # Termina sola en segundo plano; se conserva la referencia hasta que el hilo termine
+            self.workers_cancelados.add(anterior)
+            anterior.finished.connect(lambda worker=anterior: self.workers_cancelados.discard(worker))
 
-        self.data_worker = DataWorker(filter_params)
+        self.data_worker = DataWorker(filter_params, snapshot_store=self.snapshot_store, cancelacion=cancelacion)
         self.data_worker.data_loaded.connect(self.handle_data_loaded)
         self.data_worker.error_occurred.connect(self.handle_data_error)
 
+        print(f"- Carga {cancelacion.generacion} iniciada ({len(self.workers_cancelados)} canceladas terminando) -")
         self.data_worker.start()
 
+    def _es_carga_vigente(self):
+        """True si la señal recibida viene del worker de la carga vigente."""
+        worker = self.sender()
+        return worker is self.data_worker and self.load_controller.es_vigente(worker.cancelacion)
+
     def handle_data_loaded(self, data):
+        if not self._es_carga_vigente():
+            print("- Se descartan los datos de una carga reemplazada -")
+            return
         print("\n- Datos recibidos del hilo de fondo. Actualizando UI y mapa -")
         self.loaded_data_from_worker = data
-        self.send_data_to_map(data['puntos_para_mapa'], data['estadisticas'])
+        self.bridge.popup_index = data.get('popup_index')
+        self.bridge.cluster_index = data.get('cluster_index')
+        self.send_data_to_map(data['estadisticas'], data['cluster_index'])
 
     def handle_data_error(self, error_message):
+        if not self._es_carga_vigente():
+            print(f"- Error de una carga reemplazada (se ignora): {error_message} -")
+            return
         QMessageBox.critical(self, "Error de Carga de Datos", error_message)
         print(f"Error en carga de datos desde hilo: {error_message}")
 
-    def send_data_to_map(self, puntos_para_mapa, estadisticas):
+    def send_data_to_map(self, estadisticas, cluster_index):
         if not self.map_loaded_and_ready:
             print("Advertencia: Intento de enviar datos antes de que el mapa esté listo.")
             return
 
-        js_data_puntos = json.dumps(puntos_para_mapa)
+        # Solo se envían las estadísticas y los límites de los datos: el mapa pide a
+        # Bridge.getPointsInView lo que hay en pantalla después de cada movimiento, y los
+        # marcadores que siguen igual con los nuevos filtros no se vuelven a crear.
+        self.envio_iniciado = time.perf_counter()
         js_data_stats = json.dumps(estadisticas)
-
-        print("- Enviando datos filtrados al mapa mediante JavaScript -")
-
-        self.browser.page().runJavaScript(f"window.updateMapAndStats({js_data_puntos}, {js_data_stats});")
-        self.browser.page().runJavaScript(f"console.log('Datos de marcadores y estadísticas enviados a JS.');")
-        print("- Datos enviados al mapa correctamente.")
+        js_limites = json.dumps(cluster_index.bounds())
+        print(f"- Mapa en modo vista: {len(cluster_index)} puntos indexados en memoria -")
+        self.browser.page().runJavaScript(f"window.activarVistaServidor({js_data_stats}, {js_limites});")
+
+    def on_render_completed(self, tiempos):
+        if self.envio_iniciado is not None:
+            tiempos['ms_desde_envio'] = round((time.perf_counter() - self.envio_iniciado) * 1000)
+            self.envio_iniciado = None
+        self.ultimos_tiempos_render = tiempos
+        print(f"- Mapa renderizado: {tiempos.get('marcadores', 0)} marcadores en {tiempos.get('bloques', 0)} bloques "
+              f"(-{tiempos.get('quitados', 0)}), creación {tiempos.get('ms_creacion')} ms, "
+              f"inserción {tiempos.get('ms_insercion')} ms, total en el navegador {tiempos.get('ms_total')} ms, "
+              f"desde el envío {tiempos.get('ms_desde_envio', 'N/A')} ms -")
 
     def closeEvent(self, event):
         print("- Cerrando la aplicación -")
-        if self.data_worker and self.data_worker.isRunning():
-            print("Deteniendo hilo de carga de datos...")
-            self.data_worker.quit()
-            self.data_worker.wait()
+        self.temporizador_carga.stop()
+        self.load_controller.cancelar()
+        workers = [w for w in [self.data_worker, *self.workers_cancelados] if w is not None and w.isRunning()]
+        if workers:
+            print(f"Cancelando {len(workers)} carga(s) de datos en curso...")
+            for worker in workers:
+                worker.wait(ESPERA_CIERRE_MS)
+        self.bridge.shutdown()
+        db_pool.close_all_pools()
         event.accept()
\ No newline at end of file
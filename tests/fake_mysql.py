@@ -0,0 +1,108 @@
+# tests/fake_mysql.py
+
+import threading
+import time
+import zlib
+
+import pymysql
+
+# Conexión MySQL falsa para las pruebas: responde las consultas de fetch_dataset_rows
+# (app/snapshot_store.py) con filas fijas y, si se pide, deja cada consulta colgada hasta que
+# llegue un KILL QUERY con su thread_id (por otra conexión falsa, como hace app/load_control.py).
+
+_conexiones = {}  # thread_id -> FakeConnection, para que KILL QUERY encuentre su consulta
+_siguiente_id = [1000]
+_lock = threading.Lock()
+
+
+class FakeCursor:
+    def __init__(self, conexion):
+        self.conexion = conexion
+        self._filas = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params=None):
+        self.conexion.consultas.append(query)
+        if query.startswith("KILL QUERY"):
+            time.sleep(self.conexion.segundos_kill)  # KILL lento por la red
+            objetivo = _conexiones.get(int(query.split()[-1]))
+            if objetivo is not None:
+                objetivo.matada.set()
+            return
+        self.conexion.en_consulta.set()
+        if self.conexion.bloquear:
+            if self.conexion.matada.wait(10):
+                raise pymysql.err.OperationalError(1317, "Query execution was interrupted")
+        self._filas = self.conexion.filas_para(query, params)
+
+    def fetchall(self):
+        filas, self._filas = list(self._filas), []
+        return filas
+
+    def fetchmany(self, cantidad):
+        filas, self._filas = list(self._filas[:cantidad]), self._filas[cantidad:]
+        return filas
+
+
+class FakeConnection:
+    """
+    'datos' es un diccionario con las filas (como las entrega DictCursor) de 'ventas_p1',
+    'transito', 'puntos' y de cada tabla de descripción ('vendedor', 'marca', ...).
+    """
+
+    def __init__(self, datos=None, bloquear=False, segundos_kill=0, version_servidor='8.0.36'):
+        with _lock:
+            _siguiente_id[0] += 1
+            self._thread_id = _siguiente_id[0]
+            _conexiones[self._thread_id] = self
+        self.datos = datos or {}
+        self.bloquear = bloquear
+        self.segundos_kill = segundos_kill
+        self.version_servidor = version_servidor
+        self.consultas = []
+        self.en_consulta = threading.Event()
+        self.matada = threading.Event()
+
+    def thread_id(self):
+        return self._thread_id
+
+    def get_server_info(self):
+        return self.version_servidor
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self)
+
+    def close(self):
+        _conexiones.pop(self._thread_id, None)
+
+    def filas_para(self, query, params):
+        if "CRC32" in query:
+            return [self._control(params[::2])]
+        if "PREVENTA = 1" in query:
+            filas = self.datos.get('ventas_p1', [])
+            if params:
+                filas = [f for f in filas if f['ULTIMA_FECHA'] is not None and str(f['ULTIMA_FECHA']) >= str(params[0])]
+            return filas
+        if "PREVENTA IN (2, 3)" in query:
+            return self.datos.get('transito', [])
+        if "FROM puntos_venta" in query:
+            return self.datos.get('puntos', [])
+        tabla = query.split("FROM")[-1].split()[0]
+        return self.datos.get(tabla, [])
+
+    def _control(self, limites):
+        """Como snapshot_store.fetch_control_preventa_1, tomando cada fila de 'ventas_p1' como una venta."""
+        control = {}
+        for i, limite in enumerate(limites):
+            filas = [f for f in self.datos.get('ventas_p1', [])
+                     if f['ULTIMA_FECHA'] is None or str(f['ULTIMA_FECHA']) < str(limite)]
+            control[f'FILAS_{i}'] = len(filas)
+            control[f'SUMA_{i}'] = sum(zlib.crc32('|'.join(
+                str(f[c] if f[c] is not None else '') for c in ('ID_CLIENTE', 'ID_CATEGORIA', 'ID_MARCA', 'ID_VEND', 'ULTIMA_FECHA')
+            ).encode()) for f in filas)
+        return control
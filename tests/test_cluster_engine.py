@@ -0,0 +1,26 @@
+import numpy as np
+
+from app.cluster_engine import ClusterIndex
+
+
+def _puntos(cantidad=2000, seed=1):
+    rng = np.random.default_rng(seed)
+    colores = ('green', 'orange', 'red', 'black')
+    return [{'id_cliente': i, 'LATITUD': float(lat), 'LONGITUD': float(lon), 'shape': 'circle', 'color': colores[i % 4]}
+            for i, (lat, lon) in enumerate(zip(rng.uniform(-26, -24, cantidad), rng.uniform(-58, -56, cantidad)))]
+
+
+def test_miembros_por_cluster_igual_al_recorrido():
+    indice = ClusterIndex(_puntos())
+    for zoom in (0, 6, 12, indice.max_zoom):
+        nivel = indice._niveles[zoom]
+        for j in range(len(nivel.cantidad)):
+            assert np.array_equal(indice._miembros(zoom, j), np.flatnonzero(nivel.cluster_de_punto == j))
+
+
+def test_hijos_de_un_cluster():
+    indice = ClusterIndex(_puntos())
+    cluster = indice.get_clusters(4)['clusters'][0]
+    hijos = indice.get_children(cluster['id'])
+    assert sum(c['cantidad'] for c in hijos['clusters']) + len(hijos['puntos']) == cluster['cantidad']
+    assert len(indice.get_leaves(cluster['id'], limite=cluster['cantidad'])) == cluster['cantidad']
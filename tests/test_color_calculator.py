@@ -0,0 +1,199 @@
+# tests/test_color_calculator.py
+
+import json
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.color_calculator import (
+    calculate_colors_and_shapes_for_all_points,
+    calculate_point_records,
+    UnsortedInputError,
+    _construir_punto,
+    check_vectorized_equivalence,
+    classify_points_vectorized,
+    iter_points_merge_join,
+)
+from app.cluster_engine import ClusterIndex
+from app.popup_index import build_popup_lookup
+
+HOY = date(2026, 3, 31)
+
+
+def _fila(id_cliente, fecha, vendedor="Ana", **extra):
+    fila = {
+        'ID_CLIENTE': id_cliente, 'DESCRIPCION_CLIENTE': f"Cliente {id_cliente}",
+        'LATITUD': -25.3 - id_cliente / 1000, 'LONGITUD': -57.6, 'ULTIMA_VENTA': fecha,
+        'ID_VEND': 1, 'DESCRIPCION_VEND': vendedor, 'DESCRIPCION_MARCA': "Marca A", 'PREVENTA': 1,
+        'ID_MARCA': 10, 'ID_CATEGORIA': 100, 'DESCRIPCION_CATEGORIA': "Bebidas",
+        'ID_DPTO': 5, 'DESCRIPCION_DPTO': "Central", 'ID_CIUDAD': 50, 'DESCRIPCION_CIUDAD': "Asunción",
+    }
+    fila.update(extra)
+    return fila
+
+
+def _hace(dias):
+    return HOY - timedelta(days=dias)
+
+
+# Cliente -> (días desde la última venta, color esperado), alrededor de los límites de 30/60/90 días
+LIMITES = {
+    1: (0, 'green'), 2: (30, 'green'), 3: (31, 'orange'), 4: (60, 'orange'),
+    5: (61, 'red'), 6: (90, 'red'), 7: (91, 'black'), 8: (-3, 'green'),
+}
+
+
+def _filas_fijas():
+    preventa_1 = [_fila(c, _hace(dias)) for c, (dias, _) in LIMITES.items()]
+    preventa_1 += [
+        # Fechas en los distintos formatos que devuelven MySQL y el snapshot
+        _fila(20, datetime.combine(_hace(45), datetime.min.time()).replace(hour=13)),
+        _fila(21, _hace(61).strftime("%Y-%m-%d")),
+        _fila(22, _hace(10).strftime("%Y-%m-%d %H:%M:%S")),
+        # Sin fecha: negro. Fecha inválida o campos requeridos nulos: el cliente se descarta
+        _fila(23, None),
+        _fila(24, "no es fecha"),
+        _fila(25, _hace(5), LATITUD=None),
+        # Varias filas del mismo cliente: manda la más reciente (vendedor incluido)
+        _fila(26, _hace(80), vendedor="Pedro"),
+        _fila(26, _hace(20), vendedor="  juan "),
+        _fila(26, None, vendedor="Zoe"),
+        # Vendedor sin descripción: inicial '?'
+        _fila(27, _hace(1), vendedor=None),
+    ]
+    transito = [
+        {'ID_CLIENTE': 2, 'ID_MARCA': 10, 'FECHA': _hace(1), 'TIPO': 'PREVENTA', 'MARCA': "Marca A", 'CANTIDAD': 3},
+        {'ID_CLIENTE': 2, 'ID_MARCA': 11, 'FECHA': _hace(2), 'TIPO': 'PROGRAMADO', 'MARCA': "Marca B", 'CANTIDAD': 1},
+        {'ID_CLIENTE': 7, 'ID_MARCA': 10, 'FECHA': _hace(3), 'TIPO': 'PREVENTA', 'MARCA': "Marca A", 'CANTIDAD': 2},
+        # Cliente en tránsito sin ventas PREVENTA=1: no aparece en el mapa
+        {'ID_CLIENTE': 99, 'ID_MARCA': 10, 'FECHA': _hace(3), 'TIPO': 'PREVENTA', 'MARCA': "Marca A", 'CANTIDAD': 2},
+    ]
+    return preventa_1, transito
+
+
+def _por_cliente(puntos):
+    return {p['id_cliente']: p for p in puntos}
+
+
+def test_colores_en_los_limites_de_dias():
+    preventa_1, transito = _filas_fijas()
+    puntos = _por_cliente(calculate_colors_and_shapes_for_all_points(preventa_1, transito, hoy=HOY))
+    for id_cliente, (_, color) in LIMITES.items():
+        assert puntos[id_cliente]['color'] == color, id_cliente
+    assert puntos[20]['color'] == 'orange'
+    assert puntos[21]['color'] == 'red'
+    assert puntos[22]['color'] == 'green'
+    assert puntos[23]['color'] == 'black'
+
+
+def test_filas_descartadas_y_ultima_venta_por_cliente():
+    preventa_1, transito = _filas_fijas()
+    puntos = _por_cliente(calculate_colors_and_shapes_for_all_points(preventa_1, transito, hoy=HOY))
+    assert 24 not in puntos and 25 not in puntos and 99 not in puntos
+    assert puntos[26]['color'] == 'green'
+    assert puntos[26]['first_letter_vend'] == 'J'
+    assert puntos[27]['first_letter_vend'] == '?'
+
+
+def test_diamantes_en_transito():
+    preventa_1, transito = _filas_fijas()
+    agrupado = [{'ID_CLIENTE': 3, 'CANTIDAD_LINEAS': 2, 'LINEAS': "[]"}, {'ID_CLIENTE': 4, 'CANTIDAD_LINEAS': 0, 'LINEAS': "[]"}]
+    for filas_transito in (transito, agrupado):
+        puntos = _por_cliente(calculate_colors_and_shapes_for_all_points(preventa_1, filas_transito, hoy=HOY))
+        en_transito = {c for c, p in puntos.items() if p['shape'] == 'diamond'}
+        assert en_transito == ({2, 7} if filas_transito is transito else {3})
+
+
+def test_vectorizado_equivale_al_bucle():
+    preventa_1, transito = _filas_fijas()
+    assert check_vectorized_equivalence(preventa_1, transito, hoy=HOY) == []
+
+
+@pytest.mark.parametrize('hoy', [HOY, datetime(2026, 5, 1, 8, 30), date(2025, 12, 31)])
+def test_equivalencia_con_fecha_de_referencia_fija(hoy):
+    preventa_1, transito = _filas_fijas()
+    assert check_vectorized_equivalence(preventa_1, transito, hoy=hoy) == []
+    vectorizado = classify_points_vectorized(preventa_1, transito, hoy=hoy, incluir_popup=False)
+    bucle = _por_cliente(calculate_colors_and_shapes_for_all_points(preventa_1, transito, hoy=hoy))
+    assert dict(zip(vectorizado['id_cliente'], vectorizado['color'])) == {c: p['color'] for c, p in bucle.items()}
+
+
+def test_merge_join_equivale_al_bucle():
+    preventa_1, transito = _filas_fijas()
+    ordenadas = sorted(preventa_1, key=lambda fila: fila['ID_CLIENTE'])
+    transito_ordenado = sorted(transito, key=lambda fila: fila['ID_CLIENTE'])
+    bucle = calculate_colors_and_shapes_for_all_points(ordenadas, transito_ordenado, hoy=HOY)
+    merge = calculate_colors_and_shapes_for_all_points(ordenadas, transito_ordenado, ordenado_por_cliente=True, hoy=HOY)
+    assert not isinstance(merge, list)  # Generador: los puntos se producen a pedido
+    assert list(merge) == bucle
+
+
+def test_merge_join_descarta_solo_el_cliente_con_error():
+    preventa_1, transito = _filas_fijas()
+    ordenadas = sorted(preventa_1, key=lambda fila: fila['ID_CLIENTE'])
+
+    def construir(id_cliente, *args):
+        if id_cliente == 3:
+            raise ValueError("dato corrupto")
+        return _construir_punto(id_cliente, *args)
+
+    puntos = _por_cliente(iter_points_merge_join(ordenadas, sorted(transito, key=lambda f: f['ID_CLIENTE']), construir=construir, hoy=HOY))
+    assert 3 not in puntos
+    assert {1, 2, 4, 26} <= set(puntos)
+
+
+@pytest.mark.parametrize('desordenar', ['preventa_1', 'transito'])
+def test_merge_join_rechaza_entradas_desordenadas(desordenar):
+    preventa_1, transito = _filas_fijas()
+    preventa_1 = sorted(preventa_1, key=lambda fila: fila['ID_CLIENTE'])
+    transito = sorted(transito, key=lambda fila: fila['ID_CLIENTE'])
+    if desordenar == 'preventa_1':
+        preventa_1.reverse()
+    else:
+        # Las líneas del cliente 7 antes que las del 2: se detecta al pasar del 7 al 2
+        transito = [fila for fila in transito if fila['ID_CLIENTE'] == 7] + [fila for fila in transito if fila['ID_CLIENTE'] != 7]
+    with pytest.raises(UnsortedInputError):
+        list(iter_points_merge_join(preventa_1, transito, hoy=HOY))
+
+
+def test_merge_join_junta_muchas_lineas_de_un_cliente():
+    lineas = [{'ID_CLIENTE': 1, 'ID_MARCA': 10, 'FECHA': HOY, 'TIPO': 'PREVENTA', 'MARCA': "Marca A", 'CANTIDAD': i + 1}
+              for i in range(2000)]
+    recibidas = []
+
+    def construir(id_cliente, datos_cliente, transito_cliente, popup_index, hoy):
+        recibidas.append(transito_cliente)
+        return _construir_punto(id_cliente, datos_cliente, None, popup_index, hoy)
+
+    list(iter_points_merge_join([_fila(1, HOY)], lineas, construir=construir, hoy=HOY))
+    assert recibidas == [lineas]
+
+
+def test_tabla_de_popups_perezosos_usa_el_html_de_python():
+    preventa_1, transito = _filas_fijas()
+    con_html = classify_points_vectorized(preventa_1, transito, hoy=HOY)
+    perezosos = classify_points_vectorized(preventa_1, transito, hoy=HOY, lazy_popups=True)
+    lookup = json.loads(build_popup_lookup(zip(perezosos['id_cliente'], perezosos['popup_datos'])))
+    assert lookup == {str(c): html for c, html in zip(con_html['id_cliente'], con_html['popup_html'])}
+    assert '</' not in build_popup_lookup(zip(perezosos['id_cliente'], perezosos['popup_datos']))  # No cierra el <script>
+
+
+def test_point_store_consume_el_merge_join():
+    preventa_1, transito = _filas_fijas()
+    ordenadas = sorted(preventa_1, key=lambda fila: fila['ID_CLIENTE'])
+    transito_ordenado = sorted(transito, key=lambda fila: fila['ID_CLIENTE'])
+    store = calculate_point_records(iter(ordenadas), iter(transito_ordenado), ordenado_por_cliente=True)
+    dicts = store.to_dicts()
+    assert [p['id_cliente'] for p in dicts] == sorted({f['ID_CLIENTE'] for f in preventa_1} - {24, 25})
+
+    # Las columnas acumuladas al agregar dan el mismo índice y las mismas estadísticas que los diccionarios
+    por_store, por_dicts = ClusterIndex(store), ClusterIndex(dicts)
+    assert np.array_equal(por_store.categoria, por_dicts.categoria)
+    assert np.array_equal(por_store.lat, por_dicts.lat)
+    estadisticas = store.statistics()
+    assert estadisticas['total_general_clientes'] == len(dicts)
+    for forma in ('circle', 'diamond'):
+        for color in ('green', 'orange', 'red', 'black'):
+            esperado = sum(1 for p in dicts if (p['shape'], p['color']) == (forma, color))
+            assert estadisticas[f'{forma}s_{color}'] == esperado
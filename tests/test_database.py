@@ -0,0 +1,85 @@
+import pymysql
+import pytest
+
+from app import database
+from fake_mysql import FakeConnection
+
+
+@pytest.mark.parametrize('version, esperado', [
+    ('8.0.36', True),
+    ('8.4.0-commercial', True),
+    ('5.7.44-log', False),
+    ('5.5.5-10.6.12-MariaDB-0ubuntu0.22.04.1', True),
+    ('10.1.48-MariaDB', False),
+    ('5.5.5-10.1.48-MariaDB', False),
+    ('desconocida', False),
+])
+def test_soporta_funciones_ventana(version, esperado):
+    assert database.soporta_funciones_ventana(FakeConnection(version_servidor=version)) is esperado
+
+
+def test_sin_version_del_servidor_usa_max_join():
+    class SinVersion(FakeConnection):
+        def get_server_info(self):
+            raise AttributeError("sin versión")
+
+    conexion = SinVersion()
+    database.fetch_points_with_last_sale_preventa_1(conexion)
+    assert "ROW_NUMBER" not in conexion.consultas[0]
+
+
+@pytest.mark.parametrize('version, usa_row_number', [('8.0.36', True), ('5.7.44', False)])
+def test_estrategia_segun_el_servidor(version, usa_row_number):
+    conexion = FakeConnection(version_servidor=version)
+    database.fetch_points_with_last_sale_preventa_1(conexion, id_categoria=10)
+    list(database.stream_points_with_last_sale_preventa_1(conexion, id_categoria=10))
+    assert [("ROW_NUMBER" in consulta) for consulta in conexion.consultas] == [usa_row_number, usa_row_number]
+
+
+def test_estrategia_explicita():
+    conexion = FakeConnection(version_servidor='5.7.44')
+    database.fetch_points_with_last_sale_preventa_1(conexion, usar_row_number=True)
+    assert "ROW_NUMBER" in conexion.consultas[0]
+
+
+@pytest.mark.parametrize('filtros', [
+    {},
+    {'id_marca': 101},
+    {'id_categoria': 10, 'id_marca': 101, 'descripcion_vend': 'Ana', 'id_dpto': 2, 'id_ciudad': 21},
+])
+def test_transito_de_todas_las_marcas_del_cliente(filtros):
+    for construir in (database.build_points_preventa_no_1_query, database.build_points_preventa_no_1_aggregated_query):
+        query, params = construir(filtros_preventa_1=filtros)
+        # El filtro de marca elige clientes (EXISTS sobre sus ventas PREVENTA=1), no líneas en tránsito
+        assert "v.ID_MARCA = %s" not in query and "v.ID_MARCA IN" not in query
+        assert "v_c.ID_CLIENTE = v.ID_CLIENTE" in query and "IN (SELECT" not in query
+        assert query.count("%s") == len(params) == len(filtros)
+
+
+def test_transito_limitado_a_marcas():
+    query, params = database.build_points_preventa_no_1_aggregated_query(ids_marcas=[100, 101], filtros_preventa_1={'id_marca': 101})
+    assert "v.ID_MARCA IN (%s, %s)" in query and params == [100, 101, 101]
+
+
+def test_error_a_mitad_del_streaming_se_propaga():
+    class CortadaAMitad(FakeConnection):
+        def cursor(self, cursorclass=None):
+            cursor = super().cursor(cursorclass)
+            leer = cursor.fetchmany
+            lotes = []
+
+            def fetchmany(cantidad):
+                lotes.append(cantidad)
+                if len(lotes) > 1:
+                    raise pymysql.err.OperationalError(2013, "Lost connection to MySQL server during query")
+                return leer(cantidad)
+
+            cursor.fetchmany = fetchmany
+            return cursor
+
+    ventas = [{'ID_CLIENTE': i, 'ULTIMA_FECHA': '2026-03-01'} for i in range(5)]
+    filas = []
+    with pytest.raises(pymysql.MySQLError):
+        for fila in database.stream_points_with_last_sale_preventa_1(CortadaAMitad({'ventas_p1': ventas}), batch_size=2):
+            filas.append(fila)
+    assert len(filas) == 2  # El consumidor sabe que el resultado quedó incompleto
@@ -0,0 +1,183 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from app.fetch_orchestrator import restringir_transito_a_marcas
+from app.filters import FilterManager
+from app.snapshot_store import SIN_ID, SnapshotStore
+from fake_mysql import FakeConnection
+
+
+def _venta(cliente, categoria, marca, vendedor, fecha):
+    return {'ID_CLIENTE': cliente, 'ID_CATEGORIA': categoria, 'ID_MARCA': marca, 'ID_VEND': vendedor, 'ULTIMA_FECHA': fecha}
+
+
+def _punto(cliente, dpto, ciudad):
+    return {'ID_CLIENTE': cliente, 'DESCRIPCION_CLIENTE': f'Cliente {cliente}', 'LATITUD': f'-25.{cliente}',
+            'LONGITUD': f'-57.{cliente}', 'ID_DPTO': dpto, 'ID_CIUDAD': ciudad}
+
+
+def _transito(cliente, marca, fecha, tipo='PREVENTA', cantidad='2'):
+    return {'ID_CLIENTE': cliente, 'ID_MARCA': marca, 'FECHA': fecha, 'TIPO': tipo,
+            'MARCA': None if marca is None else f'Marca {marca}', 'CANTIDAD': cantidad}
+
+
+# Filas como las entrega fetch_dataset_rows: los NULL de las claves de venta ya vienen como SIN_ID
+DATOS = {
+    'ventas_p1': [
+        _venta(1, 10, 100, 7, '2026-03-01'),
+        _venta(1, 11, 101, 8, '2026-01-15'),
+        # Mismo día en varias combinaciones: desempate por marca, vendedor y categoría
+        _venta(2, 11, 102, 8, '2026-02-20'),
+        _venta(2, 10, 101, 8, '2026-02-20'),
+        _venta(2, 10, 101, 7, '2026-02-20'),
+        _venta(3, 10, SIN_ID, 7, '2026-03-10'),
+        _venta(3, 10, 100, SIN_ID, '2026-03-10'),
+        _venta(4, SIN_ID, 102, 8, '2025-10-01'),
+        _venta(5, 11, 100, 7, '2025-12-24'),
+        _venta(6, 10, 100, 7, '2026-03-05'),  # Sin coordenadas: no aparece en el mapa
+    ],
+    'transito': [
+        _transito(1, 100, '2026-03-20'),
+        _transito(1, 101, '2026-03-21', 'PROGRAMADO'),
+        _transito(2, 102, '2026-03-22'),
+        _transito(4, 100, '2026-03-23'),
+        _transito(4, None, '2026-03-24'),
+        _transito(9, 100, '2026-03-25'),  # Cliente sin ventas PREVENTA=1
+    ],
+    'puntos': [_punto(1, 1, 11), _punto(2, 1, 12), _punto(3, 2, 21), _punto(4, 2, 22), _punto(5, None, None),
+               {**_punto(6, 1, 11), 'LATITUD': None}],
+    'vendedor': [{'ID': 7, 'DESCRIPCION': 'Ana'}, {'ID': 8, 'DESCRIPCION': 'Beto'}],
+    'marca': [{'ID': 100, 'DESCRIPCION': 'Marca 100'}, {'ID': 101, 'DESCRIPCION': 'Marca 101'},
+              {'ID': 102, 'DESCRIPCION': 'Marca 102'}],
+    'categoria': [{'ID': 10, 'DESCRIPCION': 'Bebidas'}, {'ID': 11, 'DESCRIPCION': 'Limpieza'}],
+    'departamento': [{'ID': 1, 'DESCRIPCION': 'Central'}, {'ID': 2, 'DESCRIPCION': 'Itapúa'}],
+    'ciudad': [{'ID': 11, 'DESCRIPCION': 'Luque'}, {'ID': 12, 'DESCRIPCION': 'Limpio'},
+               {'ID': 21, 'DESCRIPCION': 'Encarnación'}, {'ID': 22, 'DESCRIPCION': 'Hohenau'}],
+}
+
+COMBINACIONES = [
+    {},
+    {'id_categoria': 10},
+    {'id_categoria': '11'},
+    {'id_marca': 101},
+    {'descripcion_vend': 'Ana'},
+    {'id_dpto': 2},
+    {'id_ciudad': 12},
+    {'id_categoria': 10, 'id_marca': 100, 'id_dpto': 2},
+    {'id_categoria': 99},
+]
+
+
+class FakePool:
+    """Pool con la interfaz de app/db_pool.ConnectionPool que entrega conexiones falsas."""
+
+    def __init__(self, datos, demora=0):
+        self.datos = datos
+        self.demora = demora
+        self.conexiones = 0
+
+    @contextmanager
+    def connection(self, timeout=None):
+        self.conexiones += 1
+        time.sleep(self.demora)
+        yield FakeConnection(self.datos)
+
+
+def _filtros(combinacion):
+    filtros = dict.fromkeys(('id_categoria', 'id_marca', 'descripcion_vend', 'id_dpto', 'id_ciudad'))
+    filtros.update(combinacion)
+    return filtros
+
+
+def _manager(datos=DATOS, demora=0):
+    manager = FilterManager({'host': 'servidor-de-prueba', 'user': 'u', 'password': '', 'database': 'ventas'})
+    manager.pool = FakePool(datos, demora)
+    return manager
+
+
+@pytest.fixture(scope='module')
+def snapshot(tmp_path_factory):
+    store = SnapshotStore(db_path=str(tmp_path_factory.mktemp('snapshot') / 'snapshot.sqlite3'))
+    store.refresh(FakeConnection(DATOS))
+    return store
+
+
+def _marcas_de_lineas(lineas):
+    return sorted((linea['ID_MARCA'] is None, linea['ID_MARCA']) for linea in lineas)
+
+
+@pytest.mark.parametrize('restringir', [False, True])
+@pytest.mark.parametrize('combinacion', COMBINACIONES)
+def test_filter_rows_igual_al_snapshot(snapshot, combinacion, restringir):
+    filtros = _filtros(combinacion)
+    manager = _manager()
+    dataset = manager.ensure_dataset('v1')
+    puntos_mem, transito_mem, resultado = manager.filter_rows(filtros, restringir, dataset=dataset)
+
+    puntos_sql = snapshot.fetch_points_preventa_1(**filtros)
+    transito_sql = snapshot.fetch_points_preventa_no_1_aggregated(ids_marcas=None, filtros_preventa_1=filtros)
+    for fila in transito_sql:
+        fila['LINEAS'] = json.loads(fila['LINEAS'])
+    if restringir:
+        ids_marcas = {p['ID_MARCA'] for p in puntos_sql if p['ID_MARCA'] is not None}
+        transito_sql = [f for f in (restringir_transito_a_marcas(fila, ids_marcas) for fila in transito_sql) if f is not None]
+
+    # Misma fila elegida por cliente (incluidos los empates del mismo día) y mismas descripciones
+    columnas = ('ID_CLIENTE', 'ULTIMA_VENTA', 'ID_VEND', 'ID_MARCA', 'ID_CATEGORIA', 'DESCRIPCION_VEND',
+                'DESCRIPCION_MARCA', 'DESCRIPCION_CATEGORIA', 'DESCRIPCION_DPTO', 'DESCRIPCION_CIUDAD')
+    assert [tuple(p[c] for c in columnas) for p in puntos_mem] == [tuple(p[c] for c in columnas) for p in puntos_sql]
+    assert [p['LATITUD'] for p in puntos_mem] == pytest.approx([p['LATITUD'] for p in puntos_sql])
+
+    lineas_sql = {f['ID_CLIENTE']: (f['CANTIDAD_LINEAS'], _marcas_de_lineas(f['LINEAS'])) for f in transito_sql}
+    lineas_mem = {f['ID_CLIENTE']: (f['CANTIDAD_LINEAS'], _marcas_de_lineas(f['LINEAS'])) for f in transito_mem}
+    # El tránsito de memoria solo incluye clientes del mapa; el de SQL, todos los que cumplen los filtros
+    assert lineas_mem == {c: v for c, v in lineas_sql.items() if c in set(resultado.clientes.tolist())}
+    assert resultado.estadisticas['total_general_clientes'] == len(puntos_sql)
+
+
+def test_desempate_del_mismo_dia():
+    manager = _manager()
+    puntos = {p['ID_CLIENTE']: p for p in manager.filter_rows(_filtros({}), dataset=manager.ensure_dataset('v1'))[0]}
+    assert (puntos[2]['ID_MARCA'], puntos[2]['ID_VEND'], puntos[2]['ID_CATEGORIA']) == (101, 7, 10)
+    assert (puntos[3]['ID_MARCA'], puntos[3]['ID_VEND']) == (None, 7)  # SIN_ID ordena primero, como NULL
+
+
+def test_filter_rows_usa_un_solo_dataset():
+    manager = _manager()
+    viejo = manager.ensure_dataset('v1')
+    otros_datos = {**DATOS, 'ventas_p1': [_venta(4, 11, 100, 8, '2026-03-30')]}
+    manager.pool = FakePool(otros_datos)
+    nuevo = manager.ensure_dataset('v2')
+    assert manager.dataset is nuevo and nuevo is not viejo
+
+    # Un pedido que tomó el dataset viejo arma sus filas con ese mismo dataset, aunque otra sesión lo reemplazó
+    puntos, _, resultado = manager.filter_rows(_filtros({}), dataset=viejo)
+    assert [p['ID_CLIENTE'] for p in puntos] == resultado.clientes.tolist() == [1, 2, 3, 4, 5]
+    assert [p['ID_CLIENTE'] for p in manager.filter_rows(_filtros({}))[0]] == [4]
+
+
+def test_ensure_dataset_concurrente_carga_una_vez():
+    manager = _manager(demora=0.1)
+    datasets = []
+    hilos = [threading.Thread(target=lambda: datasets.append(manager.ensure_dataset('v1'))) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join(5)
+
+    assert manager.pool.conexiones == 1
+    assert len(datasets) == 8 and all(d is datasets[0] for d in datasets)
+    assert manager.ensure_dataset('v1') is datasets[0] and manager.pool.conexiones == 1
+    assert manager.ensure_dataset('v2') is not datasets[0] and manager.pool.conexiones == 2
+
+
+@pytest.mark.parametrize('restringir, marcas', [(False, [100, 101]), (True, [101])])
+def test_filtro_de_marca_no_recorta_el_transito(restringir, marcas):
+    manager = _manager()
+    _, transito, _ = manager.filter_rows(_filtros({'id_marca': 101}), restringir, dataset=manager.ensure_dataset('v1'))
+    lineas = {f['ID_CLIENTE']: sorted(l['ID_MARCA'] for l in f['LINEAS']) for f in transito}
+    assert lineas[1] == marcas
@@ -0,0 +1,170 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+import pytest
+
+import app.fetch_orchestrator as fetch_orchestrator
+import app.load_control as load_control
+from app import database
+from app.load_control import LoadCancelled, LoadController
+from app.snapshot_store import SnapshotStore
+from fake_mysql import FakeConnection
+
+DB_CONFIG = {'host': 'servidor-de-prueba'}
+SEGUNDOS_KILL = 0.3  # Lo que tarda en llegar el KILL QUERY; el hilo de la UI no debe esperarlo
+MAXIMO_UI = 0.05     # Tiempo máximo aceptable para nueva_carga en el hilo de la UI
+
+DATOS = {
+    'ventas_p1': [
+        {'ID_CLIENTE': 1, 'ID_CATEGORIA': 10, 'ID_MARCA': 100, 'ID_VEND': 7, 'ULTIMA_FECHA': '2026-03-01'},
+        {'ID_CLIENTE': 2, 'ID_CATEGORIA': 10, 'ID_MARCA': 101, 'ID_VEND': 7, 'ULTIMA_FECHA': '2026-02-01'},
+    ],
+    'puntos': [
+        {'ID_CLIENTE': 1, 'DESCRIPCION_CLIENTE': 'Uno', 'LATITUD': '-25.3', 'LONGITUD': '-57.6', 'ID_DPTO': 1, 'ID_CIUDAD': 1},
+        {'ID_CLIENTE': 2, 'DESCRIPCION_CLIENTE': 'Dos', 'LATITUD': '-25.4', 'LONGITUD': '-57.5', 'ID_DPTO': 1, 'ID_CIUDAD': 1},
+    ],
+}
+
+
+@pytest.fixture
+def conexiones_kill(monkeypatch):
+    """Las conexiones propias que abre load_control para enviar KILL QUERY."""
+    abiertas = []
+
+    def conectar(db_config):
+        conexion = FakeConnection(segundos_kill=SEGUNDOS_KILL)
+        abiertas.append(conexion)
+        return conexion
+
+    monkeypatch.setattr(load_control, 'connect_to_database', conectar)
+    monkeypatch.setattr(load_control, 'close_database_connection', lambda conexion: conexion.close())
+    return abiertas
+
+
+def _en_hilo(funcion, *args, **kwargs):
+    """Ejecuta 'funcion' en un hilo y retorna (hilo, resultado) con 'valor' o 'error'."""
+    resultado = {}
+
+    def correr():
+        try:
+            resultado['valor'] = funcion(*args, **kwargs)
+        except Exception as e:
+            resultado['error'] = e
+
+    hilo = threading.Thread(target=correr, daemon=True)
+    hilo.start()
+    return hilo, resultado
+
+
+def _nueva_carga_cronometrada(controlador):
+    inicio = time.perf_counter()
+    token = controlador.nueva_carga(DB_CONFIG)
+    return token, time.perf_counter() - inicio
+
+
+def test_nueva_carga_no_espera_el_kill_query(conexiones_kill):
+    controlador = LoadController()
+    vieja = controlador.nueva_carga(DB_CONFIG)
+    conexion = FakeConnection(bloquear=True)
+
+    def consultar():
+        with vieja.consulta(conexion):
+            conexion.cursor().execute("SELECT 1")
+
+    hilo, resultado = _en_hilo(consultar)
+    assert conexion.en_consulta.wait(2)
+
+    nueva, segundos = _nueva_carga_cronometrada(controlador)
+
+    assert segundos < MAXIMO_UI
+    assert controlador.es_vigente(nueva) and not controlador.es_vigente(vieja)
+    hilo.join(2)
+    assert isinstance(resultado.get('error'), pymysql.err.OperationalError)  # Interrumpida en el servidor
+    assert conexiones_kill[0].consultas == [f"KILL QUERY {conexion.thread_id()}"]
+
+
+def test_token_cancelado_no_inicia_consultas():
+    controlador = LoadController()
+    token = controlador.nueva_carga()
+    assert controlador.cancelar() == token.generacion
+    with pytest.raises(LoadCancelled):
+        token.check()
+    with pytest.raises(LoadCancelled):
+        with token.consulta(FakeConnection()):
+            pass
+    assert controlador.cancelar() is None
+
+
+def test_fetch_map_rows_reemplazada_no_bloquea(conexiones_kill, monkeypatch):
+    def consulta_lenta(conexion, **kwargs):
+        try:
+            conexion.cursor().execute("SELECT ...")
+        except pymysql.MySQLError:
+            return []  # Como app/database.py: el error se imprime y la consulta retorna vacía
+        return [{'ID_CLIENTE': 1}]
+
+    monkeypatch.setattr(database, 'fetch_points_with_last_sale_preventa_1', consulta_lenta)
+    monkeypatch.setattr(database, 'fetch_points_preventa_no_1_aggregated', consulta_lenta)
+    conexiones = []
+
+    class Pool:
+        db_config = DB_CONFIG
+
+        @contextmanager
+        def connection(self, timeout=None):
+            conexion = FakeConnection(bloquear=True)
+            conexiones.append(conexion)
+            yield conexion
+
+    controlador = LoadController()
+    vieja = controlador.nueva_carga(DB_CONFIG)
+    hilo, resultado = _en_hilo(
+        fetch_orchestrator.fetch_map_rows, Pool(), {}, restringir_marcas_a_preventa_1=True, cancelacion=vieja
+    )
+    for _ in range(200):
+        if len(conexiones) == 2 and all(c.en_consulta.is_set() for c in conexiones):
+            break
+        time.sleep(0.01)
+
+    _, segundos = _nueva_carga_cronometrada(controlador)
+
+    assert segundos < MAXIMO_UI
+    hilo.join(5)
+    assert isinstance(resultado.get('error'), LoadCancelled)
+    assert sorted(conexiones_kill[0].consultas) == sorted(f"KILL QUERY {c.thread_id()}" for c in conexiones)
+
+
+def test_refresco_reemplazado_libera_el_snapshot(conexiones_kill, tmp_path):
+    store = SnapshotStore(db_path=str(tmp_path / "snapshot.sqlite3"))
+    controlador = LoadController()
+    vieja = controlador.nueva_carga(DB_CONFIG)
+    colgada = FakeConnection(DATOS, bloquear=True)
+    hilo_viejo, resultado_viejo = _en_hilo(store.refresh, colgada, cancelacion=vieja)
+    assert colgada.en_consulta.wait(2)
+
+    nueva, segundos = _nueva_carga_cronometrada(controlador)
+    assert segundos < MAXIMO_UI
+
+    # La carga nueva refresca en cuanto el KILL QUERY corta al refresco viejo, sin esperar a que termine
+    inicio = time.perf_counter()
+    hilo_nuevo, resultado_nuevo = _en_hilo(store.refresh, FakeConnection(DATOS), cancelacion=nueva)
+    hilo_nuevo.join(5)
+    hilo_viejo.join(5)
+
+    assert time.perf_counter() - inicio < 2
+    assert isinstance(resultado_viejo.get('error'), LoadCancelled)
+    assert resultado_nuevo.get('valor', {}).get('puntos_venta') == 2
+    assert store.status()['ultima_venta_p1'] == 2
+
+
+def test_refresco_de_carga_cancelada_no_escribe(tmp_path):
+    store = SnapshotStore(db_path=str(tmp_path / "snapshot.sqlite3"))
+    token = LoadController().nueva_carga()
+    token.cancel()
+    conexion = FakeConnection(DATOS)
+    with pytest.raises(LoadCancelled):
+        store.refresh(conexion, cancelacion=token)
+    assert conexion.consultas == []
+    assert store.is_empty()
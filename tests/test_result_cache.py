@@ -0,0 +1,88 @@
+import threading
+from contextlib import contextmanager
+
+from app.result_cache import DataVersionProbe, probe_data_version
+
+
+class _Cursor:
+    def __init__(self, conexion):
+        self.conexion = conexion
+        self._fila = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params=None):
+        self.conexion.consultas.append(query)
+        self.conexion.liberar.wait(5)
+        if "information_schema.TABLES" in query:
+            self._fila = (self.conexion.datos['update_time'],)
+        elif "MAX(ID)" in query:
+            self._fila = (self.conexion.datos['max_id'],)
+
+    def fetchone(self):
+        return self._fila
+
+
+class _Conexion:
+    def __init__(self, datos, liberar):
+        self.datos = datos
+        self.liberar = liberar
+        self.consultas = []
+
+    def cursor(self):
+        return _Cursor(self)
+
+
+class _Pool:
+    def __init__(self, database, update_time='2026-03-01 10:00:00', max_id=10):
+        self.db_config = {'host': 'servidor-de-prueba', 'port': 3306, 'database': database}
+        self.datos = {'update_time': update_time, 'max_id': max_id}
+        self.liberar = threading.Event()
+        self.liberar.set()
+        self.conexiones = []
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conexion = _Conexion(self.datos, self.liberar)
+        self.conexiones.append(conexion)
+        yield conexion
+
+
+def test_la_version_no_recorre_ventas():
+    pool = _Pool('ventas')
+    assert probe_data_version(pool.connection().__enter__()) == ('2026-03-01 10:00:00', 10)
+    consultas = pool.conexiones[0].consultas
+    assert not any("COUNT(" in c or "SUM(" in c or "MAX(FECHA)" in c for c in consultas)
+
+    pool.datos.update(update_time=None, max_id=None)
+    assert probe_data_version(pool.connection().__enter__()) is None  # Sin forma de distinguir versiones
+
+
+def test_version_por_base_y_sin_lock_durante_la_consulta():
+    probe = DataVersionProbe(intervalo=60)
+    lenta, otra = _Pool('lenta'), _Pool('otra', max_id=20)
+    assert probe.get(lenta) == ('2026-03-01 10:00:00', 10)
+
+    # La versión de una base no se usa para otra
+    assert probe.get(otra) == ('2026-03-01 10:00:00', 20)
+
+    # Una consulta colgada en una base no frena la consulta de otra
+    probe.invalidate()
+    lenta.liberar.clear()
+    hilo = threading.Thread(target=probe.get, args=(lenta,), daemon=True)
+    hilo.start()
+    otra.datos['max_id'] = 21
+    assert probe.get(otra) == ('2026-03-01 10:00:00', 21)
+    lenta.liberar.set()
+    hilo.join(5)
+
+    # Dentro del intervalo no se vuelve a consultar
+    conexiones = len(otra.conexiones)
+    otra.datos['max_id'] = 22
+    assert probe.get(otra)[1] == 21 and len(otra.conexiones) == conexiones
+    probe.invalidate(otra)
+    assert probe.get(otra)[1] == 22
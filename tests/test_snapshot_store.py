@@ -0,0 +1,90 @@
+import sqlite3
+
+from app.snapshot_store import SnapshotStore
+from fake_mysql import FakeConnection
+
+
+def _venta(cliente, marca, fecha):
+    return {'ID_CLIENTE': cliente, 'ID_CATEGORIA': 10, 'ID_MARCA': marca, 'ID_VEND': 7, 'ULTIMA_FECHA': fecha}
+
+
+def _punto(cliente):
+    return {'ID_CLIENTE': cliente, 'DESCRIPCION_CLIENTE': f'Cliente {cliente}', 'LATITUD': f'-25.{cliente}',
+            'LONGITUD': f'-57.{cliente}', 'ID_DPTO': 1, 'ID_CIUDAD': 1}
+
+
+VENTAS = [_venta(1, 100, '2026-03-01'), _venta(2, 101, '2026-02-01'), _venta(3, 100, '2026-01-10')]
+DATOS = {'ventas_p1': VENTAS, 'puntos': [_punto(1), _punto(2), _punto(3)]}
+
+
+def _store(tmp_path):
+    store = SnapshotStore(db_path=str(tmp_path / 'snapshot.sqlite3'))
+    assert store.refresh(FakeConnection(DATOS))['modo'] == 'rebuild'
+    return store
+
+
+def _marcas(store):
+    return {p['ID_CLIENTE']: p['ID_MARCA'] for p in store.fetch_points_preventa_1()}
+
+
+def test_sin_cambios_viejos_el_refresco_es_incremental(tmp_path):
+    store = _store(tmp_path)
+    datos = {**DATOS, 'ventas_p1': VENTAS + [_venta(2, 102, '2026-03-05')]}
+    assert store.refresh(FakeConnection(datos))['modo'] == 'incremental'
+    assert _marcas(store) == {1: 100, 2: 102, 3: 100}
+
+
+def test_cambio_anterior_a_la_marca_de_agua_reconstruye(tmp_path):
+    store = _store(tmp_path)
+    # Se borra la venta del cliente 3 y la del cliente 2 cambia de marca, ambas antes de la marca de agua
+    datos = {**DATOS, 'ventas_p1': [VENTAS[0], _venta(2, 102, '2026-02-01')]}
+    resultado = store.refresh(FakeConnection(datos))
+    assert resultado['modo'] == 'rebuild'
+    assert _marcas(store) == {1: 100, 2: 102}
+    assert store.status()['ultima_venta_p1'] == 2
+    assert store.refresh(FakeConnection(datos))['modo'] == 'incremental'
+
+
+def test_venta_sin_fecha(tmp_path):
+    store = SnapshotStore(db_path=str(tmp_path / 'snapshot.sqlite3'))
+    datos = {**DATOS, 'ventas_p1': VENTAS + [_venta(4, 101, None)], 'puntos': DATOS['puntos'] + [_punto(4)]}
+    store.refresh(FakeConnection(datos))
+    puntos = {p['ID_CLIENTE']: p for p in store.fetch_points_preventa_1()}
+    assert puntos[4]['ULTIMA_VENTA'] is None and puntos[4]['ID_MARCA'] == 101
+    assert store.status()['watermark'] == '2026-03-01'
+
+
+def test_status_lee_los_conteos_de_meta(tmp_path):
+    store = _store(tmp_path)
+    status = store.status()
+    assert (status['ultima_venta_p1'], status['transito'], status['puntos_venta']) == (3, 0, 3)
+    consultas = []
+    conectar = store._connect
+
+    def conectar_trazado():
+        db = conectar()
+        db.set_trace_callback(consultas.append)
+        return db
+
+    store._connect = conectar_trazado
+    assert store.status() == status
+    assert consultas and not any('COUNT' in consulta for consulta in consultas)
+
+
+def test_esquema_anterior_se_recrea(tmp_path):
+    ruta = str(tmp_path / 'snapshot.sqlite3')
+    with sqlite3.connect(ruta) as db:
+        db.execute("""
+            CREATE TABLE ultima_venta_p1 (
+                id_cliente INTEGER NOT NULL, id_categoria INTEGER NOT NULL, id_marca INTEGER NOT NULL,
+                id_vend INTEGER NOT NULL, ultima_fecha TEXT NOT NULL,
+                PRIMARY KEY (id_cliente, id_categoria, id_marca, id_vend)
+            )
+        """)
+        db.execute("CREATE TABLE meta (clave TEXT PRIMARY KEY, valor TEXT)")
+        db.execute("INSERT INTO meta VALUES ('watermark', '2026-03-01')")
+    store = SnapshotStore(db_path=ruta)
+    assert store.status()['watermark'] is None
+    store.refresh(FakeConnection({**DATOS, 'ventas_p1': VENTAS + [_venta(4, 101, None)]}))
+    assert store.status()['ultima_venta_p1'] == 4
+